@@ -0,0 +1,98 @@
+"""
+HTTP API load test: requests/s and p50/p99 latency per endpoint
+
+--concurrency clients loop over --endpoints for --duration seconds against a
+running bot. Compare api.workers: 0 with api.workers: N, ideally while a
+backup is compressing (python main.py backup in another terminal), to see
+how much scrapers queue behind the bot process. --conditional replays each
+endpoint's ETag (If-None-Match), as dashboards polling the catalog do.
+
+Usage:
+    python benchmarks/bench_api.py [--url http://127.0.0.1:8080] [--concurrency 32] [--duration 20]
+        [--endpoints /api/health,/api/backups,/api/metrics.prom] [--token TOKEN] [--conditional]
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import itertools
+import time
+from collections import Counter, defaultdict
+
+from aiohttp import ClientSession, ClientTimeout, TCPConnector
+
+DEFAULT_ENDPOINTS = "/api/health,/api/backup/last,/api/backups,/api/backups/stats/daily,/api/metrics,/api/metrics.prom"
+
+
+def _percentile(samples, q: float) -> float:
+    return samples[min(len(samples) - 1, int(q * len(samples)))]
+
+
+async def _client(session, url, endpoints, deadline, headers, conditional, latencies, statuses, etags):
+    for path in itertools.cycle(endpoints):
+        if time.perf_counter() >= deadline:
+            return
+        h = dict(headers)
+        if conditional and path in etags:
+            h["If-None-Match"] = etags[path]
+        started = time.perf_counter()
+        try:
+            async with session.get(url + path, headers=h, allow_redirects=False) as resp:
+                await resp.read()
+                status = str(resp.status)
+                if conditional and "ETag" in resp.headers:
+                    etags[path] = resp.headers["ETag"]
+        except Exception as e:
+            status = type(e).__name__
+        latencies[path].append(time.perf_counter() - started)
+        statuses[path][status] += 1
+
+
+async def _run(args):
+    endpoints = [e.strip() for e in args.endpoints.split(",") if e.strip()]
+    headers = {"Authorization": f"Bearer {args.token}"} if args.token else {}
+    latencies = defaultdict(list)
+    statuses = defaultdict(Counter)
+    etags = {}
+    connector = TCPConnector(limit=args.concurrency)
+    async with ClientSession(connector=connector, timeout=ClientTimeout(total=60)) as session:
+        deadline = time.perf_counter() + args.duration
+        clients = []
+        for i in range(args.concurrency):
+            # Stagger starting endpoints so every route sees concurrent load
+            order = endpoints[i % len(endpoints):] + endpoints[:i % len(endpoints)]
+            clients.append(_client(session, args.url.rstrip("/"), order, deadline, headers,
+                                   args.conditional, latencies, statuses, etags))
+        started = time.perf_counter()
+        await asyncio.gather(*clients)
+        elapsed = time.perf_counter() - started
+
+    print(f"{args.url}: {args.concurrency} clients, {elapsed:.1f}s"
+          + (", conditional requests" if args.conditional else ""))
+    print(f"{'endpoint':<32} {'requests':>9} {'req/s':>9} {'p50 ms':>9} {'p99 ms':>9}  status")
+    total = 0
+    for path in endpoints:
+        samples = sorted(latencies[path])
+        if not samples:
+            continue
+        total += len(samples)
+        codes = " ".join(f"{code}x{n}" for code, n in statuses[path].most_common())
+        print(f"{path:<32} {len(samples):>9} {len(samples) / elapsed:>9.1f} "
+              f"{_percentile(samples, 0.50) * 1000:>9.2f} {_percentile(samples, 0.99) * 1000:>9.2f}  {codes}")
+    print(f"{'total':<32} {total:>9} {total / elapsed:>9.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--url", default="http://127.0.0.1:8080")
+    parser.add_argument("--endpoints", default=DEFAULT_ENDPOINTS, help="comma-separated paths")
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--duration", type=float, default=20.0, help="seconds")
+    parser.add_argument("--token", default="", help="API token for protected endpoints")
+    parser.add_argument("--conditional", action="store_true", help="send If-None-Match with the last ETag")
+    args = parser.parse_args()
+    asyncio.run(_run(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,101 @@
+"""
+Database micro-benchmark: insert and lookup latency on a large backups table
+
+Usage:
+    python benchmarks/bench_db.py [--rows 1000000] [--samples 2000] [--path bench.sqlite3]
+"""
+from __future__ import annotations
+
+import argparse
+import datetime as dt
+import random
+import statistics
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from onec_backup_bot.db import Database  # noqa: E402
+
+
+def _percentiles(samples):
+    samples = sorted(samples)
+    p = lambda q: samples[min(len(samples) - 1, int(q * len(samples)))]
+    return statistics.mean(samples), p(0.50), p(0.99)
+
+
+def _report(name, samples):
+    mean, p50, p99 = _percentiles(samples)
+    print(f"{name:<22} mean={mean * 1e6:9.1f}us  p50={p50 * 1e6:9.1f}us  p99={p99 * 1e6:9.1f}us")
+
+
+def _bulk_load(db: Database, rows: int):
+    start = dt.datetime(2020, 1, 1)
+    statuses = ["OK"] * 90 + ["SKIP"] * 7 + ["ERR"] * 3
+    batch = []
+    with db._connect() as conn:
+        for i in range(rows):
+            status = random.choice(statuses)
+            batch.append((
+                (start + dt.timedelta(minutes=i)).isoformat(timespec='seconds'),
+                f"D:/1C_Backups/x_{i}.zip", status, random.randint(10 ** 8, 10 ** 10),
+                random.uniform(60, 3600), 0 if status != "ERR" else 1, None,
+                f"{i:064x}" if status in ("OK", "SKIP") else None,
+            ))
+            if len(batch) >= 50_000:
+                conn.executemany(
+                    "INSERT INTO backups(ts, path, status, size_bytes, duration_sec, rc, stderr, fingerprint) "
+                    "VALUES(?,?,?,?,?,?,?,?)", batch)
+                batch.clear()
+        if batch:
+            conn.executemany(
+                "INSERT INTO backups(ts, path, status, size_bytes, duration_sec, rc, stderr, fingerprint) "
+                "VALUES(?,?,?,?,?,?,?,?)", batch)
+
+
+def _timed(fn, n):
+    samples = []
+    for _ in range(n):
+        t0 = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - t0)
+    return samples
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--rows", type=int, default=1_000_000)
+    parser.add_argument("--samples", type=int, default=2000)
+    parser.add_argument("--path", type=Path, default=None)
+    args = parser.parse_args()
+
+    path = args.path or Path(tempfile.mkdtemp()) / "bench.sqlite3"
+    db = Database(path)
+    print(f"Database: {path}")
+
+    t0 = time.perf_counter()
+    _bulk_load(db, args.rows)
+    print(f"Bulk load of {args.rows} rows: {time.perf_counter() - t0:.1f}s")
+
+    now = dt.datetime.now()
+    _report("insert_backup", _timed(lambda: db.insert_backup(
+        ts=now, path="x.zip", status="OK", size_bytes=1, duration_sec=1.0, rc=0, stderr=None,
+        fingerprint="f" * 64), args.samples))
+    _report("last_success", _timed(db.last_success, args.samples))
+    _report("last_fingerprint", _timed(db.last_fingerprint, args.samples))
+    _report("recent_backups(20)", _timed(lambda: db.recent_backups(limit=20), args.samples))
+
+    with db._connect() as conn:
+        for sql in (
+            "SELECT * FROM backups WHERE status='OK' ORDER BY id DESC LIMIT 1",
+            "SELECT fingerprint FROM backups INDEXED BY idx_backups_fingerprint WHERE fingerprint IS NOT NULL AND status IN ('OK','SKIP') ORDER BY id DESC LIMIT 1",
+        ):
+            plan = " / ".join(r[3] for r in conn.execute(f"EXPLAIN QUERY PLAN {sql}"))
+            print(f"plan: {plan}")
+    db.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,68 @@
+"""
+Encryption overhead benchmark: compression alone vs compression + AES-256-GCM chunks
+
+Usage:
+    python benchmarks/bench_encryption.py [--file dump.dt | --size-mb 512] [--codec zip] [--level 1]
+"""
+from __future__ import annotations
+
+import argparse
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from onec_backup_bot import encryption  # noqa: E402
+from onec_backup_bot.cli import _synthetic_dump  # noqa: E402
+from onec_backup_bot.compression import CodecSpec, decompress_archive, get_codec  # noqa: E402
+from onec_backup_bot.encryption import KeyRing, new_key  # noqa: E402
+from onec_backup_bot.fileio import LEGACY  # noqa: E402
+
+
+def _timed(fn):
+    t0 = time.perf_counter()
+    fn()
+    return max(time.perf_counter() - t0, 1e-9)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--file", type=Path, default=None)
+    parser.add_argument("--size-mb", type=float, default=512.0)
+    parser.add_argument("--codec", default="zip")
+    parser.add_argument("--level", type=int, default=1)
+    parser.add_argument("--workers", type=int, nargs="*", default=[1, 4])
+    args = parser.parse_args()
+
+    work = Path(tempfile.mkdtemp())
+    src = args.file
+    if src is None:
+        src = work / "synthetic.dt"
+        _synthetic_dump(src, args.size_mb)
+    size = src.stat().st_size
+    codec = get_codec(args.codec)
+    keyring = KeyRing.load(f"bench:{new_key()}")
+    seal = ("bench", keyring.get("bench"))
+    spec = CodecSpec(codec.name, args.level)
+    print(f"Source {src} ({size / 1e6:.0f} MB), codec {spec}")
+
+    plain = work / "plain.out"
+    base = _timed(lambda: codec.compress(src, plain, args.level, io_opts=LEGACY))
+    print(f"{'compress':<24} {size / base / 1e6:8.1f} MB/s")
+    base_dec = _timed(lambda: decompress_archive(plain, spec, work, None, LEGACY))
+    print(f"{'decompress':<24} {size / base_dec / 1e6:8.1f} MB/s")
+
+    sealed = work / "sealed.out.enc"
+    for workers in args.workers:
+        encryption.DEFAULT_WORKERS = workers
+        sec = _timed(lambda: codec.compress(src, sealed, args.level, io_opts=LEGACY, seal=seal))
+        print(f"{f'compress+encrypt x{workers}':<24} {size / sec / 1e6:8.1f} MB/s  overhead {(sec / base - 1) * 100:+6.1f}%")
+        sec = _timed(lambda: decompress_archive(sealed, spec, work, None, LEGACY, keyring))
+        print(f"{f'decrypt+decompress x{workers}':<24} {size / sec / 1e6:8.1f} MB/s  overhead {(sec / base_dec - 1) * 100:+6.1f}%")
+    print(f"size: plain {plain.stat().st_size} bytes, sealed {sealed.stat().st_size} bytes")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,264 @@
+"""
+Offsite round trip against a local stand-in of the Telegram Bot API
+
+The stand-in answers sendDocument, getFile and file downloads the way the
+cloud Bot API does (50 MB upload and 20 MB download limits, 429 with
+retry_after) and keeps the documents in memory. --p429 and --pfail make that
+share of sendDocument calls answer 429 or 500, so pacing and retries are
+exercised. The run splits a synthetic archive into volumes, uploads them
+concurrently, then rebuilds it twice: from the catalog and from the posted
+*.manifest.json alone, as on a server that lost app.sqlite3.
+
+With --serve only the stand-in runs; point telegram.api_base (or
+TELEGRAM_API_BASE) at it to try the bot's own uploads and /offsite_restore.
+
+Usage:
+    python benchmarks/bench_offsite.py [--size-mb 100] [--volume-mb 19] [--concurrency 3]
+        [--rate-per-min 600] [--p429 0.1] [--pfail 0.05] [--seed 1] [--path DIR]
+    python benchmarks/bench_offsite.py --serve [--port 8081] [--p429 0.1] [--pfail 0.05]
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import hashlib
+import json
+import logging
+import random
+import sys
+import tempfile
+import time
+from collections import Counter
+from pathlib import Path
+
+from aiohttp import web
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from onec_backup_bot.db import Database  # noqa: E402
+from onec_backup_bot.offsite import TelegramOffsite  # noqa: E402
+
+UPLOAD_LIMIT = 50 * 1024 * 1024
+DOWNLOAD_LIMIT = 20 * 1024 * 1024
+TOKEN = "123456:STANDIN"
+
+
+class BotApiStandIn:
+    """sendDocument / getFile / file download with injectable 429s and server errors"""
+
+    def __init__(self, *, p429: float = 0.0, pfail: float = 0.0, retry_after: int = 1, seed: int = 1):
+        self.p429 = p429
+        self.pfail = pfail
+        self.retry_after = retry_after
+        self.random = random.Random(seed)
+        self.files = {}  # file_id -> (file_name, bytes)
+        self.calls = Counter()
+        self._message_id = 0
+
+    def app(self) -> web.Application:
+        app = web.Application(client_max_size=UPLOAD_LIMIT + 1024 * 1024)
+        app.add_routes([
+            web.post("/bot{token}/sendDocument", self.send_document),
+            web.route("*", "/bot{token}/getFile", self.get_file),
+            web.get("/file/bot{token}/{file_path:.+}", self.download),
+        ])
+        return app
+
+    @staticmethod
+    def _error(code: int, description: str, **parameters) -> web.Response:
+        payload = {"ok": False, "error_code": code, "description": description}
+        if parameters:
+            payload["parameters"] = parameters
+        return web.json_response(payload, status=code)
+
+    async def send_document(self, request: web.Request) -> web.Response:
+        self.calls["sendDocument"] += 1
+        fields, document, file_name = {}, None, None
+        reader = await request.multipart()
+        async for part in reader:
+            if part.name == "document":
+                file_name, document = part.filename, await part.read()
+            else:
+                fields[part.name] = await part.text()
+        roll = self.random.random()
+        if roll < self.p429:
+            self.calls["429"] += 1
+            return self._error(429, f"Too Many Requests: retry after {self.retry_after}",
+                               retry_after=self.retry_after)
+        if roll < self.p429 + self.pfail:
+            self.calls["500"] += 1
+            return self._error(500, "Internal Server Error")
+        if not fields.get("chat_id") or document is None:
+            return self._error(400, "Bad Request: chat_id and document are required")
+        if len(document) > UPLOAD_LIMIT:
+            return self._error(413, "Request Entity Too Large")
+        self._message_id += 1
+        file_id = f"BQAC{self._message_id:06d}"
+        self.files[file_id] = (file_name, document)
+        return web.json_response({"ok": True, "result": {
+            "message_id": self._message_id,
+            "date": int(time.time()),
+            "chat": {"id": int(fields["chat_id"]), "type": "supergroup"},
+            "caption": fields.get("caption", ""),
+            "document": {"file_id": file_id, "file_unique_id": file_id.lower(), "file_name": file_name,
+                         "file_size": len(document)},
+        }})
+
+    async def get_file(self, request: web.Request) -> web.Response:
+        self.calls["getFile"] += 1
+        form = await request.post() if request.method == "POST" else {}
+        file_id = request.query.get("file_id") or form.get("file_id")
+        if file_id not in self.files:
+            return self._error(400, "Bad Request: invalid file_id")
+        size = len(self.files[file_id][1])
+        if size > DOWNLOAD_LIMIT:
+            return self._error(400, "Bad Request: file is too big")
+        return web.json_response({"ok": True, "result": {
+            "file_id": file_id, "file_unique_id": file_id.lower(), "file_size": size,
+            "file_path": f"documents/{file_id}",
+        }})
+
+    async def download(self, request: web.Request) -> web.Response:
+        self.calls["download"] += 1
+        file_id = request.match_info["file_path"].rsplit("/", 1)[-1]
+        if file_id not in self.files:
+            raise web.HTTPNotFound()
+        return web.Response(body=self.files[file_id][1], content_type="application/octet-stream")
+
+    def manifest(self, file_name: str):
+        """The last manifest document posted for file_name, as the chat would show it"""
+        for name, data in reversed(list(self.files.values())):
+            if name == f"{file_name}.manifest.json":
+                return json.loads(data)
+        return None
+
+
+def _make_archive(path: Path, size: int, seed: int) -> str:
+    rnd = random.Random(seed)
+    h = hashlib.sha256()
+    with open(path, "wb") as f:
+        left = size
+        while left:
+            chunk = rnd.randbytes(min(left, 1024 * 1024))
+            f.write(chunk)
+            h.update(chunk)
+            left -= len(chunk)
+    return h.hexdigest()
+
+
+def _sha256(path: Path) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+async def _serve(args):
+    standin = BotApiStandIn(p429=args.p429, pfail=args.pfail, retry_after=args.retry_after, seed=args.seed)
+    runner = web.AppRunner(standin.app(), access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, "127.0.0.1", args.port).start()
+    print(f"Bot API stand-in on http://127.0.0.1:{args.port} (any token; 429 {args.p429:.0%}, "
+          f"500 {args.pfail:.0%}). Ctrl+C to stop")
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await runner.cleanup()
+
+
+async def _round_trip(args, root: Path) -> bool:
+    logging.basicConfig(level=logging.WARNING, format="%(levelname)s %(message)s")
+    logger = logging.getLogger("bench_offsite")
+    standin = BotApiStandIn(p429=args.p429, pfail=args.pfail, retry_after=args.retry_after, seed=args.seed)
+    runner = web.AppRunner(standin.app(), access_log=None)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]
+    api_base = f"http://127.0.0.1:{port}"
+
+    archive = root / "Zernosbyt_2025-01-15_01-30-00.dt.zst"
+    size = int(args.size_mb * 1024 * 1024)
+    digest = await asyncio.to_thread(_make_archive, archive, size, args.seed)
+    db = Database(root / "app.sqlite3")
+    offsite = TelegramOffsite(bot_token=TOKEN, chat_id="-1001", db=db, logger=logger, api_base=api_base,
+                              volume_mb=args.volume_mb, concurrency=args.concurrency,
+                              rate_per_min=args.rate_per_min, retries=args.retries)
+    ok = True
+    try:
+        started = time.perf_counter()
+        uploaded = await offsite.upload(1, archive)
+        upload_sec = time.perf_counter() - started
+        upload = db.offsite_upload(1)
+        print(f"upload:     {'OK' if uploaded else 'FAILED'}, {upload['parts']} volumes of {args.volume_mb:g} MB, "
+              f"{size / 2**20:.1f} MB in {upload_sec:.1f}s ({size / 2**20 / upload_sec:.1f} MB/s), "
+              f"concurrency {args.concurrency}")
+        print(f"stand-in:   {standin.calls['sendDocument']} sendDocument calls, {standin.calls['429']} answered 429, "
+              f"{standin.calls['500']} answered 500")
+        ok &= uploaded
+
+        for label, kwargs, client in (
+            ("catalog", {"backup_id": 1}, offsite),
+            # A fresh client without a database: only what the chat holds
+            ("manifest", {"manifest": standin.manifest(archive.name)},
+             TelegramOffsite(bot_token=TOKEN, chat_id="-1001", db=None, logger=logger, api_base=api_base)),
+        ):
+            if label == "manifest" and kwargs["manifest"] is None:
+                print("manifest:   FAILED, no manifest document was posted")
+                ok = False
+                continue
+            started = time.perf_counter()
+            try:
+                rebuilt = await client.reassemble(root / f"restored-{label}", **kwargs)
+            except Exception as e:
+                print(f"{label + ':':<11} FAILED, {e}")
+                ok = False
+                continue
+            finally:
+                if client is not offsite:
+                    await client.close()
+            seconds = time.perf_counter() - started
+            match = await asyncio.to_thread(_sha256, rebuilt) == digest
+            print(f"{label + ':':<11} {'OK' if match else 'MISMATCH'}, rebuilt {rebuilt.stat().st_size} bytes "
+                  f"in {seconds:.1f}s ({size / 2**20 / seconds:.1f} MB/s), sha256 {'matches' if match else 'differs'}")
+            ok &= match
+    finally:
+        await offsite.close()
+        db.close()
+        await runner.cleanup()
+    return ok
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--serve", action="store_true", help="only run the stand-in")
+    parser.add_argument("--port", type=int, default=8081)
+    parser.add_argument("--size-mb", type=float, default=100.0)
+    parser.add_argument("--volume-mb", type=float, default=19.0)
+    parser.add_argument("--concurrency", type=int, default=3)
+    parser.add_argument("--rate-per-min", type=float, default=600.0, help="sendDocument pacing")
+    parser.add_argument("--retries", type=int, default=5)
+    parser.add_argument("--p429", type=float, default=0.1, help="share of uploads answered 429")
+    parser.add_argument("--pfail", type=float, default=0.05, help="share of uploads answered 500")
+    parser.add_argument("--retry-after", type=int, default=1, help="retry_after sent with 429, seconds")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--path", type=Path, default=None, help="work folder (default: a temp dir)")
+    args = parser.parse_args()
+    if args.serve:
+        try:
+            asyncio.run(_serve(args))
+        except KeyboardInterrupt:
+            pass
+        return
+    if args.path is not None:
+        args.path.mkdir(parents=True, exist_ok=True)
+        ok = asyncio.run(_round_trip(args, args.path))
+    else:
+        with tempfile.TemporaryDirectory(prefix="bench_offsite_") as tmp:
+            ok = asyncio.run(_round_trip(args, Path(tmp)))
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,86 @@
+"""
+Reconciliation benchmark: scan a large backup tree and diff it with the catalog
+
+Builds --archives empty archives spread over date folders (one manifest per
+folder) plus matching catalog rows, then knocks a few out of sync: archives
+deleted, archives without a row, rows pointing to an old backup_dir.
+
+Usage:
+    python benchmarks/bench_reconcile.py [--archives 100000] [--per-day 40] [--workers 16] [--path DIR]
+"""
+from __future__ import annotations
+
+import argparse
+import datetime as dt
+import os
+import random
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from onec_backup_bot.db import Database  # noqa: E402
+from onec_backup_bot.manifests import reconcile, save_manifest  # noqa: E402
+
+
+def _build(root: Path, db: Database, archives: int, per_day: int, drift: int):
+    start = dt.datetime(2015, 1, 1)
+    manifests = {}
+    rows = []
+    for i in range(archives):
+        ts = start + dt.timedelta(days=i // per_day, minutes=i % per_day)
+        folder = root / ts.strftime("%Y-%m-%d")
+        if folder.name not in manifests:
+            folder.mkdir()
+            manifests[folder.name] = {}
+        name = f"Zernosbyt_{ts.strftime('%Y-%m-%d_%H-%M-%S')}.zst"
+        open(folder / name, "wb").close()
+        entry = {"id": i + 1, "ts": ts.isoformat(timespec="seconds"), "size_bytes": 0, "codec": "zstd:3"}
+        manifests[folder.name][name] = entry
+        rows.append((entry["ts"], str(folder / name), "OK", 0, 1.0, 0, None, f"{i:064x}", "zstd:3"))
+    for name, entries in manifests.items():
+        save_manifest(root / name, entries)
+
+    rng = random.Random(0)
+    picks = rng.sample(range(archives), 3 * drift)
+    for i in picks[:drift]:  # archive deleted
+        os.unlink(rows[i][1])
+    for i in picks[drift:2 * drift]:  # catalog still points to the old backup_dir
+        rows[i] = rows[i][:1] + (rows[i][1].replace(str(root), "D:/old_backups"),) + rows[i][2:]
+    orphans = set(picks[2 * drift:])  # archive without a row
+    with db._connect() as conn:
+        conn.executemany(
+            "INSERT INTO backups(ts, path, status, size_bytes, duration_sec, rc, stderr, fingerprint, codec) "
+            "VALUES(?,?,?,?,?,?,?,?,?)", [r for i, r in enumerate(rows) if i not in orphans])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--archives", type=int, default=100_000)
+    parser.add_argument("--per-day", type=int, default=40)
+    parser.add_argument("--drift", type=int, default=100, help="archives per kind of damage")
+    parser.add_argument("--workers", type=int, nargs="*", default=[1, 16])
+    parser.add_argument("--path", type=Path, default=None)
+    args = parser.parse_args()
+
+    root = args.path or Path(tempfile.mkdtemp())
+    db = Database(root / "app.sqlite3")
+    t0 = time.perf_counter()
+    _build(root, db, args.archives, args.per_day, args.drift)
+    print(f"Tree: {root} ({args.archives} archives) built in {time.perf_counter() - t0:.1f}s")
+
+    for workers in args.workers:
+        report = reconcile(db, root, workers=workers)
+        kinds = ", ".join(f"{k} {report.count(k)}" for k in ("moved", "missing", "orphan", "manifest"))
+        print(f"check  workers={workers:<3} {report.seconds:6.2f}s  {kinds}")
+    report = reconcile(db, root, repair=True, workers=max(args.workers))
+    print(f"repair workers={max(args.workers):<3} {report.seconds:6.2f}s")
+    report = reconcile(db, root, workers=max(args.workers))
+    print(f"after repair      {report.seconds:6.2f}s  {len(report.findings)} findings")
+    db.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,331 @@
+"""
+Threshold alerts over the metric snapshot
+Rules compare one gauge of the snapshot the metrics worker builds every
+interval (system metrics, backup SLO gauges, forecast) with a threshold or
+with a multiple of another gauge. Evaluation is incremental: rules are
+indexed by the gauges they read, and a sample only steps the rules whose
+inputs changed plus those waiting on the clock (pending `for_sec`, repeat
+reminders), so hundreds of rules cost a few dict lookups per sample.
+
+    inactive -> pending   condition true (for_sec > 0)
+    pending  -> firing    condition held for for_sec
+    firing   -> inactive  value back past `clear` (hysteresis)
+
+Transitions go to the log and, batched per evaluation and grouped by the
+rule's `group`, to telegram.broadcast_chat_id. Messages are paced to
+rate_per_min; whatever piles up meanwhile goes out in the next message, and
+a rule that fires and clears before its message left is dropped (flap).
+"""
+from __future__ import annotations
+
+import asyncio
+import operator
+import time
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, List, Optional, Sequence, Set
+
+OPS: Dict[str, Callable[[float, float], bool]] = {
+    ">": operator.gt, ">=": operator.ge, "<": operator.lt, "<=": operator.le,
+}
+MAX_MESSAGE = 4000  # Telegram caps messages at 4096 characters
+
+
+@dataclass
+class AlertRule:
+    name: str
+    metric: str
+    op: str = ">"
+    threshold: float = 0.0
+    ref: Optional[str] = None  # compare with factor * ref gauge instead of threshold
+    factor: float = 1.0
+    clear: Optional[float] = None  # resolve once past this (a factor when ref is set); default: the trigger
+    for_sec: float = 0.0
+    repeat_min: Optional[float] = None  # remind while firing (None: the engine default, 0: never)
+    severity: str = "warning"
+    group: str = ""
+    summary: str = ""  # format string: {value}, {limit}, {hours}/{days} (value in those units)
+
+    def limit(self, values: Dict[str, float], clearing: bool = False) -> Optional[float]:
+        if self.ref is None:
+            return self.clear if clearing and self.clear is not None else self.threshold
+        ref = values.get(self.ref)
+        if ref is None:
+            return None
+        return ref * (self.clear if clearing and self.clear is not None else self.factor)
+
+    def text(self, value: float, limit: float) -> str:
+        if self.summary:
+            try:
+                return self.summary.format(value=value, limit=limit, hours=value / 3600, days=value / 86400)
+            except (KeyError, ValueError, IndexError):
+                pass
+        return f"{self.metric} = {value:g} ({self.op} {limit:g})"
+
+
+def default_rules(rpo_hours: float = 24.0) -> List[AlertRule]:
+    """Used when alerts.rules is empty"""
+    return [
+        AlertRule("backup_disk_full", "disk_backup_disk_percent", ">", 90.0, clear=85.0, for_sec=300,
+                  severity="critical", group="disk", summary="Диск бэкапов заполнен на {value:.0f}%"),
+        AlertRule("backup_disk_forecast", "backup_forecast_disk_full_seconds", "<", 7 * 86400.0,
+                  clear=10 * 86400.0, group="disk",
+                  summary="Диск бэкапов заполнится через {days:.1f} дн."),
+        AlertRule("no_ok_backup", "backup_seconds_since_last_ok", ">", float(rpo_hours) * 3600,
+                  severity="critical", group="backup", summary="Нет успешного бэкапа {hours:.1f} ч"),
+        AlertRule("slow_backup", "backup_last_duration_seconds", ">", ref="backup_duration_p95_seconds",
+                  factor=2.0, clear=1.5, repeat_min=0, group="backup",
+                  summary="Бэкап шёл {value:.0f} с, порог 2 × p95 = {limit:.0f} с"),
+    ]
+
+
+def parse_rules(specs: Sequence[Any], logger=None, rpo_hours: float = 24.0) -> List[AlertRule]:
+    """Rules from config (dicts); bad entries are logged and skipped"""
+    if not specs:
+        return default_rules(rpo_hours)
+    rules: List[AlertRule] = []
+    names: Set[str] = set()
+    for spec in specs:
+        try:
+            rule = AlertRule(
+                name=str(spec["name"]), metric=str(spec["metric"]), op=str(spec.get("op", ">")),
+                threshold=float(spec.get("threshold", 0.0)), ref=spec.get("ref") or None,
+                factor=float(spec.get("factor", 1.0)),
+                clear=float(spec["clear"]) if spec.get("clear") is not None else None,
+                for_sec=float(spec.get("for_sec", 0.0)),
+                repeat_min=float(spec["repeat_min"]) if spec.get("repeat_min") is not None else None,
+                severity=str(spec.get("severity", "warning")), group=str(spec.get("group", "")),
+                summary=str(spec.get("summary", "")),
+            )
+            if rule.op not in OPS:
+                raise ValueError(f"op must be one of {', '.join(OPS)}")
+            if rule.name in names:
+                raise ValueError("duplicate rule name")
+        except (KeyError, TypeError, ValueError, AttributeError) as e:
+            if logger is not None:
+                logger.error(f"Invalid alert rule {spec!r}: {e}")
+            continue
+        names.add(rule.name)
+        rules.append(rule)
+    return rules
+
+
+@dataclass
+class Notification:
+    rule: AlertRule
+    state: str  # firing | resolved
+    value: float
+    limit: float
+    since: float  # wall time the alert started firing
+
+
+@dataclass
+class _State:
+    firing: bool = False
+    pending_since: Optional[float] = None  # monotonic
+    fired_at: float = 0.0  # wall time
+    last_sent: float = 0.0  # monotonic
+    value: Optional[float] = None
+    limit: Optional[float] = None
+
+
+class AlertEngine:
+    def __init__(self, rules: Sequence[AlertRule], repeat_min: float = 240.0):
+        self.rules = list(rules)
+        self.repeat_sec = float(repeat_min) * 60
+        self._states = [_State() for _ in self.rules]
+        # gauge -> rules reading it (as metric or ref)
+        self._watch: Dict[str, List[int]] = {}
+        for i, rule in enumerate(self.rules):
+            for name in {rule.metric, rule.ref} - {None}:
+                self._watch.setdefault(name, []).append(i)
+        self._values: Dict[str, float] = {}
+        # Rules with a clock-driven transition ahead (pending, or firing with reminders)
+        self._timed: Set[int] = set()
+
+    def _repeat_sec(self, rule: AlertRule) -> float:
+        return self.repeat_sec if rule.repeat_min is None else float(rule.repeat_min) * 60
+
+    def evaluate(self, snapshot: Dict[str, float], now: Optional[float] = None) -> List[Notification]:
+        """Step the rules affected by this sample; returns the transitions"""
+        now = time.monotonic() if now is None else now
+        values = self._values
+        dirty = set(self._timed)
+        for name, rules in self._watch.items():
+            value = snapshot.get(name)
+            if value != values.get(name):
+                if value is None:
+                    values.pop(name, None)
+                else:
+                    values[name] = value
+                dirty.update(rules)
+        out: List[Notification] = []
+        for i in dirty:
+            self._step(i, now, out)
+        return out
+
+    def _step(self, i: int, now: float, out: List[Notification]):
+        rule, st = self.rules[i], self._states[i]
+        value = self._values.get(rule.metric)
+        if value is None:
+            # No data: keep a firing alert as is, forget a pending one
+            st.pending_since = None
+            if not st.firing:
+                self._timed.discard(i)
+            return
+        op = OPS[rule.op]
+        st.value = value
+        if st.firing:
+            clear = rule.limit(self._values, clearing=True)
+            if clear is not None and not op(value, clear):
+                st.firing = False
+                self._timed.discard(i)
+                out.append(Notification(rule, "resolved", value, st.limit, st.fired_at))
+            elif self._repeat_sec(rule) > 0 and now - st.last_sent >= self._repeat_sec(rule):
+                st.last_sent = now
+                out.append(Notification(rule, "firing", value, st.limit, st.fired_at))
+            return
+        limit = rule.limit(self._values)
+        if limit is None or not op(value, limit):
+            st.pending_since = None
+            self._timed.discard(i)
+            return
+        if st.pending_since is None:
+            st.pending_since = now
+        if now - st.pending_since < rule.for_sec:
+            self._timed.add(i)
+            return
+        st.firing, st.pending_since, st.limit = True, None, limit
+        st.fired_at, st.last_sent = time.time(), now
+        if self._repeat_sec(rule) > 0:
+            self._timed.add(i)
+        else:
+            self._timed.discard(i)
+        out.append(Notification(rule, "firing", value, limit, st.fired_at))
+
+    def active(self) -> List[Dict[str, Any]]:
+        """Firing and pending alerts"""
+        rows = []
+        for rule, st in zip(self.rules, self._states):
+            if st.firing or st.pending_since is not None:
+                rows.append({"name": rule.name, "state": "firing" if st.firing else "pending",
+                             "severity": rule.severity, "group": rule.group, "metric": rule.metric,
+                             "value": st.value, "limit": st.limit,
+                             "since": time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(st.fired_at))
+                             if st.firing else None})
+        return rows
+
+
+def render(batch: Sequence[Notification]) -> str:
+    """One message: groups in order of appearance, firing before resolved"""
+    groups: Dict[str, List[Notification]] = {}
+    for n in batch:
+        groups.setdefault(n.rule.group, []).append(n)
+    lines: List[str] = []
+    for group, items in groups.items():
+        if group:
+            lines.append(f"[{group}]")
+        for n in sorted(items, key=lambda n: n.state != "firing"):
+            mark = ("🔴" if n.rule.severity == "critical" else "🟠") if n.state == "firing" else "✅"
+            tail = "" if n.state == "firing" else " — снято"
+            lines.append(f"{mark} {n.rule.name}: {n.rule.text(n.value, n.limit)}{tail}")
+    text = "\n".join(lines)
+    return text if len(text) <= MAX_MESSAGE else text[:MAX_MESSAGE - 1] + "…"
+
+
+class AlertDispatcher:
+    """Feeds samples to the engine on the shared loop and delivers the transitions"""
+
+    def __init__(self, engine: AlertEngine, logger, *, bot_token: str = "", chat_id: str = "",
+                 api_base: str = "https://api.telegram.org", rate_per_min: float = 6.0,
+                 group_wait_sec: float = 10.0):
+        self.engine = engine
+        self.logger = logger
+        self.bot_token = bot_token
+        self.chat_id = str(chat_id or "")
+        self.api_base = (api_base or "https://api.telegram.org").rstrip("/")
+        self.min_interval = 60.0 / rate_per_min if rate_per_min > 0 else 0.0
+        self.group_wait_sec = float(group_wait_sec)
+        # Undelivered notifications by rule name: the newest transition wins
+        self._queue: Dict[str, Notification] = {}
+        self._wake: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+        self._session = None  # aiohttp session, opened on the first message
+        self._next_send = 0.0
+
+    @property
+    def delivers(self) -> bool:
+        return bool(self.bot_token and self.chat_id)
+
+    def observe(self, snapshot: Dict[str, float]):
+        """Evaluate one sample (call on the loop the dispatcher was started on)"""
+        for n in self.engine.evaluate(snapshot):
+            rule = n.rule
+            log = self.logger.warning if n.state == "firing" else self.logger.info
+            log(f"Alert {n.state}: {rule.name} ({rule.severity}) {rule.text(n.value, n.limit)}")
+            if not self.delivers:
+                continue
+            queued = self._queue.get(rule.name)
+            if queued is not None and queued.state == "firing" and n.state == "resolved":
+                del self._queue[rule.name]  # flapped before the message left
+                continue
+            self._queue[rule.name] = n
+        if self._queue and self._wake is not None:
+            self._wake.set()
+
+    def start(self, loop: asyncio.AbstractEventLoop):
+        if not self.delivers:
+            return
+        asyncio.run_coroutine_threadsafe(self._start(), loop).result(timeout=5)
+
+    async def _start(self):
+        self._wake = asyncio.Event()
+        self._task = asyncio.create_task(self._run())
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except (asyncio.CancelledError, Exception):
+                pass
+            self._task = None
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._session = None
+
+    async def _run(self):
+        while True:
+            await self._wake.wait()
+            await asyncio.sleep(self.group_wait_sec)  # let the rest of a burst arrive
+            delay = self._next_send - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            self._wake.clear()
+            batch, self._queue = list(self._queue.values()), {}
+            if not batch:
+                continue
+            self._next_send = time.monotonic() + self.min_interval
+            try:
+                await self._send(render(batch))
+            except Exception as e:
+                self.logger.error(f"Alert delivery failed: {e}")
+                for n in batch:  # retried with the next batch unless superseded
+                    self._queue.setdefault(n.rule.name, n)
+
+    async def _send(self, text: str):
+        import aiohttp
+
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=30))
+        url = f"{self.api_base}/bot{self.bot_token}/sendMessage"
+        for _ in range(3):
+            async with self._session.post(url, data={"chat_id": self.chat_id, "text": text}) as r:
+                payload = await r.json(content_type=None)
+            if payload.get("ok"):
+                return
+            retry_after = (payload.get("parameters") or {}).get("retry_after")
+            if not retry_after:
+                raise RuntimeError(f"sendMessage: {payload.get('error_code')} {payload.get('description', '')}")
+            await asyncio.sleep(float(retry_after))
+            self._next_send = time.monotonic() + max(self.min_interval, float(retry_after))
+        raise RuntimeError("sendMessage: still rate limited")
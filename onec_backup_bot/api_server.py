@@ -1,15 +1,71 @@
 from __future__ import annotations
 
 import asyncio
+import hmac
 import json
 import os
+import re
+import time
 from dataclasses import asdict
+from datetime import datetime
 from pathlib import Path
 from typing import Any, Dict, Optional
 
 from aiohttp import web
 
+from . import profiler
+from .async_db import AsyncDatabase
+from .collectors import get_registry
+from .downloads import DownloadManager, resolve_archive
+from .events import EVICTED, EventBus
+from .http_cache import ResponseCache
+from .logtail import search as search_log
+from .resources import ResourceProfile
 from .metrics_extended import collect_all_metrics, flatten_metrics_for_prometheus
+from .tracing import get_tracer
+
+# /api/health carries the disk forecast: rebuilt at least this often
+HEALTH_MAX_AGE_SEC = 60
+
+
+def _query_int(request: web.Request, name: str, default: Optional[int] = None,
+               lo: Optional[int] = None, hi: Optional[int] = None) -> Optional[int]:
+    raw = request.query.get(name)
+    if raw is None or raw == "":
+        return default
+    try:
+        value = int(raw)
+    except ValueError:
+        raise web.HTTPBadRequest(text=json.dumps({"error": f"'{name}' must be an integer"}),
+                                 content_type="application/json")
+    if lo is not None:
+        value = max(lo, value)
+    if hi is not None:
+        value = min(hi, value)
+    return value
+
+
+@web.middleware
+async def _timing_middleware(request: web.Request, handler):
+    """Span per matched route (by route template, so /api/backups/{id}/download is one series)"""
+    started = time.perf_counter()
+    try:
+        return await handler(request)
+    finally:
+        resource = request.match_info.route.resource
+        if resource is not None:
+            get_tracer().observe(f"api.{request.method} {resource.canonical}", time.perf_counter() - started)
+
+
+def _query_datetime(request: web.Request, name: str) -> Optional[datetime]:
+    raw = request.query.get(name)
+    if not raw:
+        return None
+    try:
+        return datetime.fromisoformat(raw)
+    except ValueError:
+        raise web.HTTPBadRequest(text=json.dumps({"error": f"'{name}' must be an ISO date/time"}),
+                                 content_type="application/json")
 
 
 class APIServer:
@@ -19,36 +75,329 @@ class APIServer:
                  logger,
                  api_host: str = "0.0.0.0",
                  api_port: int = 8080,
-                 backup_dir: Path):
+                 backup_dir: Path,
+                 log_file: str = "backup.log",
+                 backup_stats=None,
+                 adb: Optional[AsyncDatabase] = None,
+                 api_token: str = "",
+                 max_downloads: int = 2,
+                 download_rate_mb_s: float = 0.0,
+                 events: Optional[EventBus] = None,
+                 events_metrics_interval: float = 5.0,
+                 alerts=None,
+                 snapshot=None,
+                 control_port: Optional[int] = None,
+                 tier_dir: Optional[Path] = None):
         self.backup_service = backup_service
+        # API worker process (see api_workers): bot-only state comes from the published snapshot
+        self.snapshot = snapshot
+        self.control_port = control_port
+        self.alerts = alerts
+        self.events = events
+        self.events_metrics_interval = float(events_metrics_interval)
+        self.api_token = api_token or ""
+        self.downloads = DownloadManager(max_concurrent=max_downloads,
+                                         rate_bytes_per_sec=float(download_rate_mb_s) * 1024 * 1024,
+                                         logger=logger)
+        self.backup_stats = backup_stats
         self.db = db
+        self.adb = adb or AsyncDatabase(db)
+        self.cache = ResponseCache(db)
         self.logger = logger
         self.api_host = api_host
         self.api_port = int(api_port)
         self.backup_dir = backup_dir
+        # Archives are served from either storage tier (see tiering)
+        self.archive_roots = [Path(backup_dir)] + ([Path(tier_dir)] if tier_dir else [])
+        self.log_file = log_file
 
         self._app: Optional[web.Application] = None
         self._runner: Optional[web.AppRunner] = None
         self._site: Optional[web.TCPSite] = None
+        self._collector_stop: Optional[asyncio.Event] = None
+        self._collector_task: Optional[asyncio.Task] = None
+        self._events_task: Optional[asyncio.Task] = None
+
+    def _check_token(self, request: web.Request, what: str):
+        """Require the API token as 'Authorization: Bearer ...' or ?token=; without one the endpoint is closed"""
+        if not self.api_token:
+            # API_HOST defaults to 0.0.0.0: an unset token must not open archives and logs to the network
+            raise web.HTTPForbidden(text=f"{what} needs API_TOKEN to be set")
+        auth = request.headers.get("Authorization", "")
+        supplied = auth[7:] if auth.startswith("Bearer ") else request.query.get("token", "")
+        if not hmac.compare_digest(supplied.encode("utf-8"), self.api_token.encode("utf-8")):
+            raise web.HTTPUnauthorized(text="Invalid or missing API token")
 
     async def handle_health(self, request: web.Request) -> web.Response:
-        last_ok = self.db.last_success()
-        return web.json_response({
+        # The forecast follows free disk space, which the catalog version does not see
+        return await self.cache.json(request, self._produce_health, max_age=HEALTH_MAX_AGE_SEC)
+
+    async def _produce_health(self):
+        try:
+            last_ok = await self.adb.last_success()
+        except asyncio.TimeoutError:
+            return web.json_response({"status": "degraded", "error": "database timeout"}, status=503)
+        health = {
             "status": "ok",
-            "last_backup": last_ok or None
-        })
+            "last_backup": last_ok
+        }
+        if self.snapshot is not None:
+            state = await asyncio.to_thread(self.snapshot.state)
+            if "forecast" in state:
+                health["forecast"] = state["forecast"]
+            return health
+        forecaster = getattr(self.backup_service, "forecaster", None)
+        if forecaster is not None:
+            await asyncio.to_thread(forecaster.refresh)
+            fc = forecaster.forecast()
+            health["forecast"] = fc.as_dict() if fc is not None else None
+        return health
+
+    async def _serve_snapshot(self, name: str, content_type: str) -> web.Response:
+        """A file published by the bot process; 503 if it is missing or the bot stopped publishing"""
+        body, age = await asyncio.to_thread(self.snapshot.read, name)
+        if body is None:
+            return web.json_response({"error": "metric snapshot not published yet"}, status=503)
+        if age > self.snapshot.max_age:
+            return web.json_response({"error": f"metric snapshot is {age:.0f}s old"}, status=503)
+        return web.Response(body=body, headers={"Content-Type": content_type, "X-Snapshot-Age": f"{age:.1f}"})
+
+    def _redirect_to_control(self, request: web.Request):
+        """Live routes need the bot's in-memory state: send the client to its own API"""
+        raise web.HTTPTemporaryRedirect(str(request.url.with_port(self.control_port)))
 
     async def handle_metrics(self, request: web.Request) -> web.Response:
-        metrics = collect_all_metrics(self.backup_dir)
+        if self.snapshot is not None:
+            return await self._serve_snapshot("metrics.json", "application/json; charset=utf-8")
+        metrics = await asyncio.to_thread(collect_all_metrics, self.backup_dir)
         return web.json_response(metrics)
 
     async def handle_backup_last(self, request: web.Request) -> web.Response:
-        rows = self.db.recent_backups(limit=1)
-        return web.json_response(rows[0] if rows else {})
+        return await self.cache.json(request, self._produce_backup_last)
+
+    async def _produce_backup_last(self):
+        try:
+            rows = await self.adb.recent_backups(limit=1)
+        except asyncio.TimeoutError:
+            return web.json_response({"error": "database timeout"}, status=503)
+        return rows[0] if rows else {}
+
+    async def handle_backups_list(self, request: web.Request) -> web.Response:
+        """Backup catalog with keyset pagination: pass next_cursor back as ?cursor="""
+        q = request.query
+        limit = _query_int(request, "limit", 50, 1, 500)
+        filters = dict(
+            before_id=_query_int(request, "cursor"),
+            status=q.get("status") or None,
+            ts_from=q.get("from") or None,
+            ts_to=q.get("to") or None,
+            base=q.get("base") or None,
+            min_size=_query_int(request, "min_size"),
+            max_size=_query_int(request, "max_size"),
+        )
+
+        async def produce():
+            try:
+                rows = await self.adb.run(self.db.list_backups, limit=limit, **filters)
+            except asyncio.TimeoutError:
+                return web.json_response({"error": "database timeout"}, status=503)
+            items = [dict(r) for r in rows]
+            next_cursor = items[-1]["id"] if len(items) == limit else None
+            return {"items": items, "next_cursor": next_cursor}
+
+        return await self.cache.json(request, produce)
+
+    async def handle_backups_daily(self, request: web.Request) -> web.Response:
+        """Per-day counts and bytes from the incrementally maintained summary table"""
+        return await self.cache.json(request, lambda: self._produce_daily(request.query))
+
+    async def _produce_daily(self, q):
+        try:
+            rows = await self.adb.run(self.db.daily_stats, day_from=q.get("from") or None,
+                                      day_to=q.get("to") or None, base=q.get("base"))
+        except asyncio.TimeoutError:
+            return web.json_response({"error": "database timeout"}, status=503)
+        days: Dict[str, Dict[str, Any]] = {}
+        for r in rows:
+            d = days.setdefault(r["day"], {"day": r["day"], "count": 0, "ok": 0, "failed": 0, "skipped": 0,
+                                           "bytes": 0, "max_size_bytes": 0, "duration_sec": 0.0})
+            status = (r["status"] or "").upper()
+            d["count"] += r["count"]
+            if status == "OK":
+                d["ok"] += r["count"]
+                d["bytes"] += r["bytes"]
+                d["max_size_bytes"] = max(d["max_size_bytes"], r["max_size_bytes"])
+                d["duration_sec"] += r["duration_sec"]
+            elif status == "SKIP":
+                d["skipped"] += r["count"]
+            else:
+                d["failed"] += r["count"]
+        return {"days": list(days.values())}
+
+    async def handle_backups_largest(self, request: web.Request) -> web.Response:
+        limit = _query_int(request, "limit", 10, 1, 100)
+
+        async def produce():
+            try:
+                rows = await self.adb.run(self.db.largest_backups, limit)
+            except asyncio.TimeoutError:
+                return web.json_response({"error": "database timeout"}, status=503)
+            return {"items": [dict(r) for r in rows]}
+
+        return await self.cache.json(request, produce)
+
+    async def handle_backup_download(self, request: web.Request) -> web.StreamResponse:
+        """Stream a backup archive (HTTP Range supported, never buffered in memory)"""
+        self._check_token(request, "Archive download")
+        try:
+            backup_id = int(request.match_info["id"])
+        except ValueError:
+            raise web.HTTPBadRequest(text="Invalid backup id")
+        try:
+            row = await self.adb.run(self.db.get_backup, backup_id)
+        except asyncio.TimeoutError:
+            return web.json_response({"error": "database timeout"}, status=503)
+        if row is None:
+            raise web.HTTPNotFound(text="Backup not found")
+        path = resolve_archive(self.archive_roots, row["path"])
+        if path is None:
+            raise web.HTTPGone(text="Archive file is no longer available")
+        return await self.downloads.serve(request, path)
+
+    async def handle_backup_resources(self, request: web.Request) -> web.Response:
+        """Resource profile of one backup's 1C dump: peaks plus the sample series"""
+        try:
+            backup_id = int(request.match_info["id"])
+        except ValueError:
+            raise web.HTTPBadRequest(text="Invalid backup id")
+
+        async def produce():
+            try:
+                row = await self.adb.run(self.db.resource_profile, backup_id)
+            except asyncio.TimeoutError:
+                return web.json_response({"error": "database timeout"}, status=503)
+            if row is None:
+                return web.json_response({"error": "no resource profile for this backup"}, status=404)
+            profile = ResourceProfile.decode(row["interval_sec"], row["data"], row["mem_total_bytes"] or 0)
+            return {"backup_id": backup_id, "interval_sec": row["interval_sec"],
+                    "summary": profile.summary(), "samples": profile.series()}
+
+        return await self.cache.json(request, produce)
+
+    async def handle_alerts(self, request: web.Request) -> web.Response:
+        """Firing and pending alerts (state lives on this loop, no database access)"""
+        if self.snapshot is not None:
+            state = await asyncio.to_thread(self.snapshot.state)
+            return web.json_response(state.get("alerts") or {"enabled": False, "active": []})
+        if self.alerts is None:
+            return web.json_response({"enabled": False, "active": []})
+        return web.json_response({"enabled": True, "rules": len(self.alerts.engine.rules),
+                                  "active": self.alerts.engine.active()})
+
+    async def handle_logs(self, request: web.Request) -> web.Response:
+        """Newest log records, filtered by level/pattern/time range (reads the log backward)"""
+        self._check_token(request, "Log access")
+        limit = _query_int(request, "lines", 100, 1, 1000)
+        since = _query_datetime(request, "since")
+        until = _query_datetime(request, "until")
+        try:
+            records = await asyncio.to_thread(
+                search_log, Path(self.backup_dir), self.log_file, limit=limit,
+                level=request.query.get("level") or None, pattern=request.query.get("pattern") or None,
+                since=since, until=until)
+        except re.error as e:
+            raise web.HTTPBadRequest(text=json.dumps({"error": f"invalid pattern: {e}"}),
+                                     content_type="application/json")
+        return web.json_response({"records": records, "count": len(records)})
+
+    def _subscribe(self, request: web.Request):
+        if self.snapshot is not None:
+            self._redirect_to_control(request)
+        if self.events is None:
+            raise web.HTTPNotFound(text="Event stream disabled")
+        topics = [t.strip() for t in request.query.get("topics", "").split(",") if t.strip()]
+        return self.events.subscribe(topics or None)
+
+    async def handle_events_sse(self, request: web.Request) -> web.StreamResponse:
+        """Server-Sent Events stream; ?topics=backup,metrics filters by topic prefix"""
+        sub = self._subscribe(request)
+        response = web.StreamResponse(headers={
+            "Content-Type": "text/event-stream",
+            "Cache-Control": "no-cache",
+            "X-Accel-Buffering": "no",
+        })
+        try:
+            await response.prepare(request)
+            await response.write(b"retry: 3000\n\n")
+            while True:
+                try:
+                    event = await asyncio.wait_for(sub.queue.get(), timeout=15)
+                except asyncio.TimeoutError:
+                    await response.write(b": keepalive\n\n")
+                    continue
+                if event is EVICTED:
+                    await response.write(b"event: evicted\ndata: {}\n\n")
+                    break
+                await response.write(event.sse())
+        except (ConnectionResetError, asyncio.CancelledError):
+            pass
+        finally:
+            self.events.unsubscribe(sub)
+        return response
+
+    async def handle_events_ws(self, request: web.Request) -> web.WebSocketResponse:
+        """WebSocket variant of the event stream (JSON text frames)"""
+        sub = self._subscribe(request)
+        ws = web.WebSocketResponse(heartbeat=30)
+        await ws.prepare(request)
+
+        async def _drain_incoming():
+            # Consume client frames so close/ping are processed
+            async for _ in ws:
+                pass
+
+        reader = asyncio.create_task(_drain_incoming())
+        try:
+            while not ws.closed:
+                get = asyncio.create_task(sub.queue.get())
+                done, _ = await asyncio.wait({get, reader}, return_when=asyncio.FIRST_COMPLETED)
+                if get not in done:
+                    get.cancel()
+                    break
+                event = get.result()
+                if event is EVICTED:
+                    await ws.close(code=1008, message=b"slow consumer")
+                    break
+                await ws.send_str(event.json())
+        except (ConnectionResetError, asyncio.CancelledError):
+            pass
+        finally:
+            reader.cancel()
+            self.events.unsubscribe(sub)
+        return ws
+
+    async def _publish_metrics(self):
+        """Publish cached metric snapshots while anyone is subscribed"""
+        registry = get_registry(self.backup_dir, self.logger)
+        while True:
+            await asyncio.sleep(self.events_metrics_interval)
+            if self.events is None or not self.events.subscriber_count:
+                continue
+            try:
+                snapshot = registry.snapshot()
+                self.events.publish("metrics.snapshot", **flatten_metrics_for_prometheus(snapshot))
+            except Exception as e:
+                self.logger.warning(f"Metric event publish failed: {e}")
 
     async def handle_metrics_prom(self, request: web.Request) -> web.Response:
         """Prometheus exposition format (text/plain)"""
-        metrics = collect_all_metrics(self.backup_dir)
+        if self.snapshot is not None:
+            return await self._serve_snapshot("metrics.prom", "text/plain; version=0.0.4; charset=utf-8")
+        payload = await self.render_prometheus()
+        return web.Response(text=payload, content_type="text/plain; version=0.0.4; charset=utf-8")
+
+    async def render_prometheus(self) -> str:
+        metrics = await asyncio.to_thread(collect_all_metrics, self.backup_dir)
         flat = flatten_metrics_for_prometheus(metrics)
         # Build simple gauge metrics exposition
         lines = []
@@ -56,30 +405,85 @@ class APIServer:
             prom_name = f"onec_{name}".replace('.', '_').replace('-', '_')
             lines.append(f"# TYPE {prom_name} gauge")
             lines.append(f"{prom_name} {value}")
-        payload = "\n".join(lines) + "\n"
-        return web.Response(text=payload, content_type="text/plain; version=0.0.4; charset=utf-8")
+        # Backup histograms and SLO gauges
+        if self.backup_stats is not None:
+            lines.extend(await asyncio.to_thread(self.backup_stats.prometheus_lines))
+        lines.extend(get_tracer().prometheus_lines())
+        return "\n".join(lines) + "\n"
+
+    async def handle_debug_profile(self, request: web.Request) -> web.Response:
+        """Sample all threads for ?seconds=N; collapsed stacks for flamegraph.pl / speedscope"""
+        if self.snapshot is not None:
+            # Profiling a worker would only show the HTTP loop, not the backup
+            self._redirect_to_control(request)
+        self._check_token(request, "Profiling")
+        seconds = _query_int(request, "seconds", 10, 1, 120)
+        hz = _query_int(request, "hz", 100, 1, 1000)
+        idle = request.query.get("idle", "") in ("1", "true")
+        try:
+            stacks, ticks = await asyncio.to_thread(profiler.sample, seconds, hz, include_idle=idle)
+        except profiler.ProfilerBusy as e:
+            raise web.HTTPConflict(text=str(e))
+        self.logger.info(f"Profile taken: {seconds}s at {hz} Hz, {sum(stacks.values())} samples")
+        return web.Response(text=profiler.collapsed(stacks), content_type="text/plain", headers={
+            "Content-Disposition": f'attachment; filename="profile-{datetime.now():%Y%m%d-%H%M%S}.folded"',
+            "X-Profile-Ticks": str(ticks),
+        })
 
     def _build_app(self) -> web.Application:
-        app = web.Application()
+        app = web.Application(middlewares=[_timing_middleware])
         app.add_routes([
             web.get("/api/health", self.handle_health),
             web.get("/api/metrics", self.handle_metrics),
             web.get("/api/backup/last", self.handle_backup_last),
             web.get("/api/metrics.prom", self.handle_metrics_prom),
+            web.get("/api/backups", self.handle_backups_list),
+            web.get("/api/backups/stats/daily", self.handle_backups_daily),
+            web.get("/api/backups/stats/largest", self.handle_backups_largest),
+            web.get("/api/backups/{id}/download", self.handle_backup_download),
+            web.get("/api/backups/{id}/resources", self.handle_backup_resources),
+            web.get("/api/alerts", self.handle_alerts),
+            web.get("/api/logs", self.handle_logs),
+            web.get("/api/events", self.handle_events_sse),
+            web.get("/api/events/ws", self.handle_events_ws),
+            web.get("/api/debug/profile", self.handle_debug_profile),
         ])
         return app
 
-    async def start(self):
+    async def start(self, reuse_port: bool = False):
         if self._runner:
             return
         self._app = self._build_app()
         self._runner = web.AppRunner(self._app, access_log=None)
         await self._runner.setup()
-        self._site = web.TCPSite(self._runner, host=self.api_host, port=self.api_port)
+        self._site = web.TCPSite(self._runner, host=self.api_host, port=self.api_port,
+                                 reuse_port=reuse_port or None)
         await self._site.start()
         self.logger.info(f"HTTP API started on http://{self.api_host}:{self.api_port}")
+        if self.snapshot is not None:
+            # Collectors and the event bus run in the bot process only
+            return
+
+        # Keep metric collectors warm at their own cadence
+        self._collector_stop = asyncio.Event()
+        registry = get_registry(self.backup_dir, self.logger)
+        self._collector_task = asyncio.create_task(registry.run_scheduler(self._collector_stop))
+
+        if self.events is not None:
+            self.events.bind(asyncio.get_running_loop())
+            self._events_task = asyncio.create_task(self._publish_metrics())
 
     async def stop(self):
+        if self._events_task:
+            self._events_task.cancel()
+            self._events_task = None
+        if self._collector_task:
+            self._collector_stop.set()
+            try:
+                await asyncio.wait_for(self._collector_task, timeout=5)
+            except Exception:
+                self._collector_task.cancel()
+            self._collector_task = None
         if self._site:
             await self._site.stop()
             self._site = None
@@ -0,0 +1,227 @@
+"""
+Multi-process API serving
+With api.workers > 0 the read API is served by that many worker processes
+sharing api.port through SO_REUSEPORT, so scrapers and dashboards are not
+queued behind compression and metric collection on the bot's GIL. The bot
+process keeps its own full API on api.control_port and publishes what only
+it knows into backup_dir/.api every api.snapshot_sec seconds:
+
+    metrics.json   collect_all_metrics() output         -> /api/metrics
+    metrics.prom   full Prometheus exposition           -> /api/metrics.prom
+    state.json     forecast and active alerts           -> /api/health, /api/alerts
+
+Workers read the catalog from app.sqlite3 directly (WAL readers do not block
+the backup's writes) and answer the live routes (event streams, profiler)
+with a redirect to the control port.
+"""
+from __future__ import annotations
+
+import asyncio
+import json
+import logging
+import os
+import socket
+import sys
+import threading
+import time
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+SNAPSHOT_DIR = ".api"
+
+
+def reuse_port_supported() -> bool:
+    return hasattr(socket, "SO_REUSEPORT") and sys.platform != "win32"
+
+
+def _write_atomic(path: Path, data: bytes):
+    partial = path.with_name(f".{path.name}.part")
+    with open(partial, "wb") as f:
+        f.write(data)
+    os.replace(partial, path)
+
+
+class SnapshotPublisher:
+    """Writes the bot's metric snapshot for the workers (runs on the API loop)"""
+
+    def __init__(self, api_server, snapshot_dir: Path, interval: float = 5.0):
+        self.api_server = api_server
+        self.snapshot_dir = Path(snapshot_dir)
+        self.interval = max(1.0, float(interval))
+        self._future = None
+
+    async def publish(self):
+        from .metrics_extended import collect_all_metrics
+
+        server = self.api_server
+        metrics = await asyncio.to_thread(collect_all_metrics, server.backup_dir)
+        prom = await server.render_prometheus()
+        forecaster = getattr(server.backup_service, "forecaster", None)
+        fc = None
+        if forecaster is not None:
+            await asyncio.to_thread(forecaster.refresh)
+            fc = forecaster.forecast()
+        state = {
+            "published_at": time.time(),
+            "forecast": fc.as_dict() if fc is not None else None,
+            "alerts": ({"enabled": True, "rules": len(server.alerts.engine.rules),
+                        "active": server.alerts.engine.active()}
+                       if server.alerts is not None else {"enabled": False, "active": []}),
+        }
+        payloads = {
+            "metrics.json": json.dumps(metrics, ensure_ascii=False, default=str).encode("utf-8"),
+            "metrics.prom": prom.encode("utf-8"),
+            "state.json": json.dumps(state, ensure_ascii=False, default=str).encode("utf-8"),
+        }
+
+        def write():
+            self.snapshot_dir.mkdir(parents=True, exist_ok=True)
+            for name, data in payloads.items():
+                _write_atomic(self.snapshot_dir / name, data)
+
+        await asyncio.to_thread(write)
+
+    async def _run(self):
+        while True:
+            try:
+                await self.publish()
+            except Exception as e:
+                self.api_server.logger.warning(f"API snapshot publish failed: {e}")
+            await asyncio.sleep(self.interval)
+
+    def start(self, loop: asyncio.AbstractEventLoop):
+        """Schedule publishing on a running event loop (thread-safe)"""
+        self._future = asyncio.run_coroutine_threadsafe(self._run(), loop)
+
+    def stop(self):
+        if self._future is not None:
+            self._future.cancel()
+            self._future = None
+
+
+class SnapshotReader:
+    """Snapshot files for a worker, re-read only when they change"""
+
+    def __init__(self, snapshot_dir: Path, max_age: float = 60.0):
+        self.snapshot_dir = Path(snapshot_dir)
+        self.max_age = float(max_age)
+        self._cache: Dict[str, Tuple[Tuple[int, int], bytes, float]] = {}
+
+    def read(self, name: str) -> Tuple[Optional[bytes], Optional[float]]:
+        """(content, age in seconds); (None, None) before the first publish"""
+        path = self.snapshot_dir / name
+        try:
+            st = os.stat(path)
+        except OSError:
+            return None, None
+        key = (st.st_mtime_ns, st.st_size)
+        cached = self._cache.get(name)
+        if cached is None or cached[0] != key:
+            try:
+                with open(path, "rb") as f:
+                    cached = (key, f.read(), st.st_mtime)
+            except OSError:
+                return None, None
+            self._cache[name] = cached
+        return cached[1], max(0.0, time.time() - cached[2])
+
+    def state(self) -> Dict[str, Any]:
+        data, _ = self.read("state.json")
+        try:
+            return json.loads(data) if data else {}
+        except ValueError:
+            return {}
+
+
+def _worker_logger(index: int) -> logging.Logger:
+    # Console only: several processes must not rotate the bot's log file
+    logger = logging.getLogger(f"OneCBackup.api-worker-{index}")
+    logger.setLevel(logging.INFO)
+    logger.propagate = False
+    handler = logging.StreamHandler()
+    handler.setFormatter(logging.Formatter('[%(asctime)s] %(levelname)s %(name)s: %(message)s',
+                                           datefmt='%Y-%m-%d %H:%M:%S'))
+    logger.addHandler(handler)
+    return logger
+
+
+def _worker_main(index: int, options: Dict[str, Any]):
+    """Entry point of one worker process"""
+    from .api_server import APIServer
+    from .db import Database
+
+    logger = _worker_logger(index)
+    backup_dir = Path(options["backup_dir"])
+    db = Database(backup_dir / "app.sqlite3")
+    server = APIServer(
+        backup_service=None, db=db, logger=logger,
+        api_host=options["host"], api_port=options["port"], backup_dir=backup_dir,
+        log_file=options["log_file"], api_token=options["token"],
+        max_downloads=options["max_downloads"], download_rate_mb_s=options["download_rate_mb_s"],
+        snapshot=SnapshotReader(backup_dir / SNAPSHOT_DIR, max_age=options["snapshot_max_age"]),
+        control_port=options["control_port"],
+        tier_dir=options["tier_dir"] or None,
+    )
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    try:
+        loop.run_until_complete(server.start(reuse_port=True))
+        loop.run_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        try:
+            loop.run_until_complete(server.stop())
+        except Exception:
+            pass
+        db.close()
+
+
+class ApiWorkerPool:
+    """Starts the worker processes and restarts any that die"""
+
+    def __init__(self, count: int, options: Dict[str, Any], logger, restart_delay: float = 5.0):
+        import multiprocessing
+
+        self.count = max(1, int(count))
+        self.options = options
+        self.logger = logger
+        self.restart_delay = float(restart_delay)
+        # spawn everywhere: a fork of the bot would inherit its threads and event loop
+        self._ctx = multiprocessing.get_context("spawn")
+        self._procs: List[Any] = [None] * self.count
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def _spawn(self, index: int):
+        proc = self._ctx.Process(target=_worker_main, args=(index, self.options),
+                                 name=f"api-worker-{index}", daemon=True)
+        proc.start()
+        self._procs[index] = proc
+
+    def start(self):
+        for i in range(self.count):
+            self._spawn(i)
+        self.logger.info(f"API workers started: {self.count} on {self.options['host']}:{self.options['port']} "
+                         f"(control API on port {self.options['control_port']})")
+        self._thread = threading.Thread(target=self._supervise, name="api-workers", daemon=True)
+        self._thread.start()
+
+    def _supervise(self):
+        while not self._stop.wait(self.restart_delay):
+            for i, proc in enumerate(self._procs):
+                if proc is not None and not proc.is_alive():
+                    self.logger.warning(f"API worker {i} exited with {proc.exitcode}; restarting")
+                    self._spawn(i)
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+        for proc in self._procs:
+            if proc is not None and proc.is_alive():
+                proc.terminate()
+        for proc in self._procs:
+            if proc is not None:
+                proc.join(timeout=5)
+        self.logger.info("API workers stopped")
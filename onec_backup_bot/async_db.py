@@ -0,0 +1,78 @@
+"""
+Async data-access layer over Database
+Queries run on a dedicated thread pool with bounded concurrency and
+per-query timeouts, so a slow query or a write lock never stalls the event
+loop. Rows are returned as plain dicts ready for JSON serialization.
+"""
+from __future__ import annotations
+
+import asyncio
+import sqlite3
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional
+
+from .tracing import get_tracer
+
+
+def row_to_dict(row: Optional[sqlite3.Row]) -> Optional[Dict[str, Any]]:
+    return dict(row) if row is not None else None
+
+
+class AsyncDatabase:
+    def __init__(self, db, max_workers: int = 4, max_concurrency: int = 16, timeout: float = 5.0):
+        """
+        Args:
+            db: Synchronous Database instance
+            max_workers: Threads dedicated to queries
+            max_concurrency: Max in-flight queries per event loop (the rest wait)
+            timeout: Default per-query timeout in seconds (covers queueing and execution)
+        """
+        self.db = db
+        self.timeout = float(timeout)
+        self.max_concurrency = int(max_concurrency)
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="db")
+        # The API and the Telegram bot run on different loops; a semaphore is per loop
+        self._semaphores: Dict[int, asyncio.Semaphore] = {}
+        self._lock = threading.Lock()
+
+    def _semaphore(self) -> asyncio.Semaphore:
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            sem = self._semaphores.get(id(loop))
+            if sem is None:
+                sem = asyncio.Semaphore(self.max_concurrency)
+                self._semaphores[id(loop)] = sem
+            return sem
+
+    async def run(self, fn: Callable[..., Any], *args, timeout: Optional[float] = None, **kwargs) -> Any:
+        """Run a blocking DB call on the query pool; raises asyncio.TimeoutError on timeout"""
+        loop = asyncio.get_running_loop()
+        name = f"db.{getattr(fn, '__name__', 'query')}"
+
+        def call():
+            # Execution only: time spent queueing for the pool shows up in the API span
+            with get_tracer().span(name):
+                return fn(*args, **kwargs)
+
+        async def _bounded():
+            async with self._semaphore():
+                return await loop.run_in_executor(self._executor, call)
+
+        return await asyncio.wait_for(_bounded(), timeout=timeout or self.timeout)
+
+    async def recent_backups(self, limit: int = 10, **kw) -> List[Dict[str, Any]]:
+        rows = await self.run(self.db.recent_backups, limit, **kw)
+        return [dict(r) for r in rows]
+
+    async def last_success(self, **kw) -> Optional[Dict[str, Any]]:
+        return row_to_dict(await self.run(self.db.last_success, **kw))
+
+    async def last_fingerprint(self, **kw) -> Optional[str]:
+        return await self.run(self.db.last_fingerprint, **kw)
+
+    async def last_metrics(self, **kw) -> Optional[Dict[str, Any]]:
+        return row_to_dict(await self.run(self.db.last_metrics, **kw))
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False)
@@ -4,18 +4,65 @@ import hashlib
 import subprocess
 import datetime as dt
 import os
+import shutil
 from pathlib import Path
 import threading
 from concurrent.futures import ThreadPoolExecutor
-from typing import Optional
-import zipfile
+from typing import Optional, Tuple
 
+from .compression import CodecSpec, get_codec, latest_dictionary
+from .encryption import EXTENSION as ENCRYPTED_SUFFIX
+from .fileio import IOOptions, file_sha256
+from .forecast import spool_fits
+from .manifests import add_to_manifest
+from .resources import start_sampler
+from .tracing import get_tracer, timed
+
+if os.name == "nt":
+    import msvcrt
+else:
+    import fcntl
+
+
+class _ProcessLock:
+    """Non-blocking lock file shared by all processes (daemon, CLI one-shots); the OS drops it if the holder dies"""
+
+    def __init__(self, path: Path):
+        self.path = path
+        self._fh = None
+
+    def acquire(self) -> bool:
+        fh = open(self.path, "a+")
+        try:
+            if os.name == "nt":
+                fh.seek(0)
+                msvcrt.locking(fh.fileno(), msvcrt.LK_NBLCK, 1)
+            else:
+                fcntl.flock(fh.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            fh.close()
+            return False
+        self._fh = fh
+        return True
+
+    def release(self):
+        if self._fh is None:
+            return
+        try:
+            if os.name == "nt":
+                self._fh.seek(0)
+                msvcrt.locking(self._fh.fileno(), msvcrt.LK_UNLCK, 1)
+            else:
+                fcntl.flock(self._fh.fileno(), fcntl.LOCK_UN)
+        finally:
+            self._fh.close()
+            self._fh = None
 
 
 class BackupService:
     def __init__(self, *, onec_exe: str, base_path: str, uc: str, up: str,
                  backup_dir: str, file_prefix: str,
-                 logger, db):
+                 logger, db, events=None):
         self.onec_exe = onec_exe
         self.base_path = base_path
         self.uc = uc or None
@@ -24,15 +71,45 @@ class BackupService:
         self.file_prefix = file_prefix
         self.logger = logger
         self.db = db
+        self.base_name = Path(base_path).name
+        self.events = events
+        self.progress_interval_sec = 2.0
+        # Optional TelegramOffsite; OK archives are handed to it for upload
+        self.offsite = None
+        # Optional KeyRing; with encrypt enabled archives are sealed with its active key
+        self.keyring = None
         
 
         self._lock = threading.Lock()
+        self._process_lock = _ProcessLock(Path(backup_dir) / ".backup.lock")
+        # Outcome of the last make_backup(): OK, SKIP, BUSY, ERR or EXC
+        self.last_status: Optional[str] = None
+        self.last_backup_id: Optional[int] = None
         self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="backup")
         self.dump_timeout_sec = getattr(self, 'dump_timeout_sec', 7200)
+        # psutil sampling of the 1C process tree during the dump (0 = off)
+        self.resource_sample_sec = 1.0
+        self._dump_resources = None
+        # Optional Forecaster; pre-flight (off|warn|refuse|relocate) checks its prediction before the dump
+        self.forecaster = None
+        self.preflight = "off"
+        self.spool_dir = ""
 
         # Ensure main backup directory exists
         self.backup_dir.mkdir(parents=True, exist_ok=True)
 
+    @property
+    def running(self) -> bool:
+        """A backup is in progress in this process"""
+        return self._lock.locked()
+
+    def _emit(self, topic: str, **data):
+        if self.events is not None:
+            try:
+                self.events.publish(topic, base=self.base_name, **data)
+            except Exception:
+                pass
+
     def _onec_dump(self, dt_path: Path) -> subprocess.CompletedProcess:
         out_log = self.backup_dir / "dump_out.log"
         exe_path = Path(self.onec_exe)
@@ -65,7 +142,115 @@ class BackupService:
         except Exception:
             pass
         self.logger.info(f"Running 1C dump: {' '.join(display_args)}")
-        return subprocess.run(args, capture_output=True, text=True, timeout=self.dump_timeout_sec)
+        proc = subprocess.Popen(args, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+        started = dt.datetime.now()
+        sampler = start_sampler(proc.pid, self.resource_sample_sec, self.logger)
+        try:
+            while True:
+                try:
+                    stdout, stderr = proc.communicate(timeout=self.progress_interval_sec)
+                    break
+                except subprocess.TimeoutExpired:
+                    elapsed = (dt.datetime.now() - started).total_seconds()
+                    if elapsed >= self.dump_timeout_sec:
+                        proc.kill()
+                        proc.communicate()
+                        raise subprocess.TimeoutExpired(args, self.dump_timeout_sec)
+                    try:
+                        written = dt_path.stat().st_size
+                    except OSError:
+                        written = 0
+                    self._emit("backup.progress", phase="dump", elapsed_sec=round(elapsed, 1), bytes_done=written)
+        finally:
+            if sampler is not None:
+                self._dump_resources = sampler.stop()
+        return subprocess.CompletedProcess(args, proc.returncode, stdout, stderr)
+
+    def _resources_row(self):
+        profile, self._dump_resources = self._dump_resources, None
+        return profile.row() if profile is not None and profile.samples else None
+
+    def io_options(self) -> IOOptions:
+        return IOOptions(buffer_mb=float(getattr(self, 'io_buffer_mb', 8.0)),
+                         drop_cache=bool(getattr(self, 'drop_cache', True)),
+                         preallocate_mb=float(getattr(self, 'preallocate_mb', 64.0)),
+                         direct=bool(getattr(self, 'direct_io', False)))
+
+    def _compress(self, src: Path, dst_dir: Optional[Path] = None) -> Tuple[Path, CodecSpec, Optional[str]]:
+        """Compress (and optionally encrypt) src into dst_dir (default: next to src); returns (archive path, codec spec, key id)"""
+        codec = get_codec((getattr(self, 'compress', None) or 'none').lower())
+        if not codec.available():
+            raise RuntimeError(f"codec {codec.name} is not installed (pip install "
+                               f"{'zstandard' if codec.name == 'zstd' else codec.name})")
+        level = int(getattr(self, 'compress_level', codec.default_level))
+        spec = CodecSpec(codec.name, level)
+        dictionary = None
+        if codec.name == "zstd" and getattr(self, 'zstd_dict', False):
+            found = latest_dictionary(self.backup_dir)
+            if found is None:
+                self.logger.warning("zstd_dict is enabled but no dictionary is trained yet")
+            else:
+                spec.dict_id, dictionary = found
+        seal = None
+        if getattr(self, 'encrypt', False):
+            if self.keyring is None or self.keyring.active_id is None:
+                raise RuntimeError("encryption is enabled but no keys are configured")
+            seal = (self.keyring.active_id, self.keyring.get(self.keyring.active_id))
+        dst = codec.archive_path(src)
+        if dst_dir is not None:
+            dst = Path(dst_dir) / dst.name
+        if seal is not None:
+            dst = dst.with_name(dst.name + ENCRYPTED_SUFFIX)
+        self.logger.info(f"Compressing to {dst} ({spec}{', key ' + seal[0] if seal else ''})")
+        self._emit("backup.phase", phase="compress", path=str(dst), codec=str(spec))
+
+        total = src.stat().st_size
+        last_tick = dt.datetime.now()
+
+        def progress(done: int):
+            nonlocal last_tick
+            now = dt.datetime.now()
+            if (now - last_tick).total_seconds() >= self.progress_interval_sec:
+                last_tick = now
+                self._emit("backup.progress", phase="compress", bytes_done=done, bytes_total=total)
+
+        try:
+            codec.compress(src, dst, level, dictionary=dictionary,
+                           threads=int(getattr(self, 'compress_threads', 0)), progress=progress,
+                           io_opts=self.io_options(), seal=seal)
+        except BaseException:
+            dst.unlink(missing_ok=True)
+            raise
+        return dst, spec, seal[0] if seal else None
+
+    def _compressing(self) -> bool:
+        return (getattr(self, 'compress', None) or 'none').lower() != 'none' or getattr(self, 'encrypt', False)
+
+    def _preflight(self, backup_folder: Path, phases) -> Tuple[Optional[Path], str]:
+        """(folder for the dump, refusal reason); the folder is None when the backup should not start"""
+        mode = (self.preflight or 'off').lower()
+        if self.forecaster is None or mode == 'off':
+            return backup_folder, ""
+        try:
+            with timed(phases, "preflight"):
+                check = self.forecaster.preflight(self._compressing())
+        except Exception as e:
+            self.logger.warning(f"Pre-flight check failed, backing up anyway: {e}")
+            return backup_folder, ""
+        if check.ok:
+            if check.free_bytes is not None and check.free_bytes < check.needed_upper_bytes:
+                self.logger.warning(f"Pre-flight: tight on space, {check.free_bytes // 2**20} MB free, "
+                                    f"up to {check.needed_upper_bytes // 2**20} MB may be needed")
+            return backup_folder, ""
+        self.logger.warning(f"Pre-flight: backup predicted not to fit into {self.backup_dir}: {check.reason}")
+        if mode == 'warn':
+            return backup_folder, ""
+        if mode == 'relocate' and self.spool_dir and self._compressing() and check.archive_fits:
+            spool = Path(self.spool_dir) / backup_folder.name
+            if spool_fits(spool, check.dump_bytes):
+                self.logger.info(f"Pre-flight: dumping to {spool}, archive goes to {backup_folder}")
+                return spool, ""
+        return None, f"Pre-flight: not enough free space in {self.backup_dir} ({check.reason})"
 
     def _compute_fingerprint(self) -> str:
         base = Path(self.base_path)
@@ -86,94 +271,222 @@ class BackupService:
         return h.hexdigest()
 
     def make_backup(self) -> Optional[Path]:
+        self.last_status, self.last_backup_id = None, None
         if not self._lock.acquire(blocking=False):
-            self.logger.warning("Backup already in progress; skipping new request")
-            try:
-                self.db.insert_backup(ts=dt.datetime.now(), path=None, status="SKIP",
-                                      size_bytes=None, duration_sec=None, rc=None, stderr="In-progress",
-                                      fingerprint=None)
-            except Exception:
-                pass
-            return None
+            return self._skip_busy()
+        if not self._process_lock.acquire():
+            self._lock.release()
+            return self._skip_busy()
         try:
-            start = dt.datetime.now()
-            try:
+            return self._make_backup_locked()
+        finally:
+            self._process_lock.release()
+            self._lock.release()
+
+    def _skip_busy(self) -> None:
+        self.logger.warning("Backup already in progress; skipping new request")
+        self.last_status = "BUSY"
+        try:
+            self.db.insert_backup(ts=dt.datetime.now(), path=None, status="SKIP",
+                                  size_bytes=None, duration_sec=None, rc=None, stderr="In-progress",
+                                  fingerprint=None, base=self.base_name)
+        except Exception:
+            pass
+        return None
+
+    def _unspool(self, dump: Path, backup_folder: Path) -> Optional[Path]:
+        """Move a spooled dump into backup_folder; None (dump deleted) if it does not fit or the move fails"""
+        dst = backup_folder / dump.name
+        try:
+            size = dump.stat().st_size
+            free = shutil.disk_usage(backup_folder).free
+            if size >= free:
+                self.logger.error(f"Spooled dump does not fit into {backup_folder} "
+                                  f"({size // 2**20} MB, {free // 2**20} MB free)")
+            else:
+                shutil.move(str(dump), str(dst))
+                return dst
+        except OSError as e:
+            self.logger.error(f"Could not move the spooled dump to {backup_folder}: {e}")
+            dst.unlink(missing_ok=True)
+        dump.unlink(missing_ok=True)
+        return None
+
+    def _failed_dump_path(self, dt_file: Path, spooled: bool = False) -> Optional[str]:
+        """Path to record for the dump of a failed backup; None once it is deleted"""
+        # Even a partial dump is plaintext; a spooled one would sit outside backup_dir for good
+        if not (getattr(self, 'encrypt', False) or spooled):
+            return str(dt_file)
+        try:
+            dt_file.unlink(missing_ok=True)
+        except OSError as e:
+            self.logger.error(f"Could not delete the failed dump {dt_file}: {e}")
+            return str(dt_file)
+        return None
+
+    def _compress_failed(self, start: dt.datetime, error: Exception, duration: float, fingerprint, phases) -> None:
+        """ERR row for a dump that was made but could not be kept"""
+        stderr = f"compression failed: {error}"
+        self.logger.error(f"ERR: {stderr}; dump deleted")
+        try:
+            self.db.insert_backup(ts=start, path=None, status="ERR", size_bytes=None, duration_sec=duration,
+                                  rc=0, stderr=stderr, fingerprint=fingerprint, base=self.base_name,
+                                  phases=phases, resources=self._resources_row())
+        except Exception as e:
+            self.logger.warning(f"DB insert failed (ERR): {e}")
+        self._emit("backup.completed", status="ERR", reason="compress", error=str(error), duration_sec=duration)
+        self.last_status = "ERR"
+        return None
+
+    def _make_backup_locked(self) -> Optional[Path]:
+        start = dt.datetime.now()
+        # Seconds per phase, stored with the backup row (backups.phases)
+        phases = {}
+        self._emit("backup.phase", phase="fingerprint")
+        try:
+            with timed(phases, "fingerprint"):
                 current_fp = self._compute_fingerprint()
-            except Exception as e:
-                current_fp = None
-                self.logger.warning(f"Fingerprint error: {e}")
-            try:
+        except Exception as e:
+            current_fp = None
+            self.logger.warning(f"Fingerprint error: {e}")
+        try:
+            with timed(phases, "db"):
                 last_fp = self.db.last_fingerprint()
-            except Exception:
-                last_fp = None
-            if current_fp and last_fp and current_fp == last_fp:
-                self.logger.info("No changes detected in 1C base. Skipping backup.")
-                try:
-                    self.db.insert_backup(ts=start, path=None, status="SKIP",
-                                          size_bytes=None, duration_sec=0.0, rc=0, stderr=None, fingerprint=current_fp)
-                except Exception as e:
-                    self.logger.warning(f"DB insert failed (SKIP): {e}")
-                
-                return None
-
-            # Create date-based subfolder (YYYY-MM-DD)
-            date_folder = start.strftime("%Y-%m-%d")
-            backup_folder = self.backup_dir / date_folder
-            backup_folder.mkdir(parents=True, exist_ok=True)
-            
-            ts = start.strftime("%Y-%m-%d_%H-%M-%S")
-            dt_file = backup_folder / f"{self.file_prefix}{ts}.dt"
+        except Exception:
+            last_fp = None
+        if current_fp and last_fp and current_fp == last_fp:
+            self.logger.info("No changes detected in 1C base. Skipping backup.")
+            try:
+                self.db.insert_backup(ts=start, path=None, status="SKIP",
+                                      size_bytes=None, duration_sec=0.0, rc=0, stderr=None, fingerprint=current_fp, base=self.base_name,
+                                      phases=phases)
+            except Exception as e:
+                self.logger.warning(f"DB insert failed (SKIP): {e}")
+            self._emit("backup.completed", status="SKIP", reason="unchanged")
+            self.last_status = "SKIP"
+            return None
 
+        # Create date-based subfolder (YYYY-MM-DD)
+        date_folder = start.strftime("%Y-%m-%d")
+        backup_folder = self.backup_dir / date_folder
+        backup_folder.mkdir(parents=True, exist_ok=True)
+        
+        ts = start.strftime("%Y-%m-%d_%H-%M-%S")
+        dump_folder, refused = self._preflight(backup_folder, phases)
+        if dump_folder is None:
+            self.logger.error(f"ERR: {refused}")
             try:
+                self.db.insert_backup(ts=start, path=None, status="ERR", size_bytes=None, duration_sec=0.0,
+                                      rc=None, stderr=refused, fingerprint=current_fp, base=self.base_name,
+                                      phases=phases)
+            except Exception as e:
+                self.logger.warning(f"DB insert failed (ERR): {e}")
+            self._emit("backup.completed", status="ERR", reason="no_space", error=refused)
+            self.last_status = "ERR"
+            return None
+        # Dump spooled to spool_dir: backup_dir only has to hold the archive
+        spooled = dump_folder != backup_folder
+        dt_file = dump_folder / f"{self.file_prefix}{ts}.dt"
+
+        try:
+            self._emit("backup.phase", phase="dump", path=str(dt_file))
+            self._dump_resources = None
+            with timed(phases, "dump"):
                 res = self._onec_dump(dt_file)
-                duration = (dt.datetime.now() - start).total_seconds()
-                stderr = (res.stderr or "").strip()
-                size_bytes = dt_file.stat().st_size if dt_file.exists() else None
-
-                if res.returncode == 0 and dt_file.exists():
-                    final_path = dt_file
-                    if hasattr(self, 'compress') and (self.compress or '').lower() == 'zip':
-                        zip_path = dt_file.with_suffix('.zip')
-                        self.logger.info(f"Compressing to ZIP: {zip_path} (level={getattr(self, 'compress_level', 6)})")
-                        try:
-                            with zipfile.ZipFile(zip_path, 'w', compression=zipfile.ZIP_DEFLATED, compresslevel=getattr(self, 'compress_level', 6)) as zf:
-                                zf.write(dt_file, arcname=dt_file.name)
-                            if getattr(self, 'delete_dt_after_compress', False):
-                                dt_file.unlink(missing_ok=True)
-                            final_path = zip_path
-                            size_bytes = final_path.stat().st_size
-                        except Exception as e:
-                            self.logger.warning(f"Compression failed, keeping .dt: {e}")
-
-                    self.logger.info(f"OK: backup created {final_path} ({size_bytes} bytes) in {duration:.1f}s")
+            duration = (dt.datetime.now() - start).total_seconds()
+            dump_duration = duration
+            stderr = (res.stderr or "").strip()
+            size_bytes = dt_file.stat().st_size if dt_file.exists() else None
+            raw_size_bytes = size_bytes
+
+            if res.returncode == 0 and dt_file.exists():
+                final_path = dt_file
+                codec_spec, key_id = "none", None
+                if self._compressing():
                     try:
-                        self.db.insert_backup(ts=start, path=str(final_path), status="OK",
-                                              size_bytes=size_bytes, duration_sec=duration, rc=res.returncode, stderr=stderr,
-                                              fingerprint=current_fp)
+                        with timed(phases, "compress"):
+                            final_path, spec, key_id = self._compress(dt_file, backup_folder)
+                        codec_spec = str(spec)
+                        # With encryption the plaintext dump never stays next to the sealed archive
+                        if spooled or getattr(self, 'encrypt', False) or getattr(self, 'delete_dt_after_compress', False):
+                            dt_file.unlink(missing_ok=True)
+                        size_bytes = final_path.stat().st_size
                     except Exception as e:
-                        self.logger.warning(f"DB insert failed: {e}")
-                    
-                    return final_path
-                else:
-                    self.logger.error(f"ERR: 1C returned {res.returncode}. stderr={stderr}")
+                        if getattr(self, 'encrypt', False):
+                            # Never keep or publish the plaintext dump of a base that must be encrypted
+                            dt_file.unlink(missing_ok=True)
+                            return self._compress_failed(start, e, duration, current_fp, phases)
+                        if spooled:
+                            # The catalog, downloads, reconcile and tiering only look under backup_dir
+                            dt_file = self._unspool(dt_file, backup_folder)
+                            if dt_file is None:
+                                return self._compress_failed(start, e, duration, current_fp, phases)
+                        final_path = dt_file
+                        self.logger.warning(f"Compression failed, keeping .dt: {e}")
+                    duration = (dt.datetime.now() - start).total_seconds()
+
+                resources = self._resources_row()
+                sha256 = None
+                self._emit("backup.phase", phase="checksum", path=str(final_path))
+                try:
+                    with timed(phases, "checksum"):
+                        sha256 = file_sha256(final_path, self.io_options())
+                except OSError as e:
+                    self.logger.warning(f"Checksum failed: {e}")
+                self.logger.info(f"OK: backup created {final_path} ({size_bytes} bytes) in {duration:.1f}s")
+                backup_id = None
+                try:
+                    # The row cannot hold its own insert time; it goes to the span histograms
+                    with get_tracer().span("db.insert_backup"):
+                        backup_id = self.db.insert_backup(ts=start, path=str(final_path), status="OK",
+                                                          size_bytes=size_bytes, duration_sec=duration, rc=res.returncode, stderr=stderr,
+                                                          fingerprint=current_fp, raw_size_bytes=raw_size_bytes,
+                                                          dump_duration_sec=dump_duration, base=self.base_name,
+                                                          codec=codec_spec, key_id=key_id, sha256=sha256, phases=phases,
+                                                          resources=resources)
+                except Exception as e:
+                    self.logger.warning(f"DB insert failed: {e}")
+                try:
+                    add_to_manifest(final_path, {
+                        "id": backup_id, "ts": start.isoformat(timespec='seconds'), "base": self.base_name,
+                        "size_bytes": size_bytes, "raw_size_bytes": raw_size_bytes, "sha256": sha256,
+                        "codec": codec_spec, "key_id": key_id, "fingerprint": current_fp,
+                    })
+                except OSError as e:
+                    self.logger.warning(f"Manifest update failed: {e}")
+                self._emit("backup.completed", status="OK", path=str(final_path), size_bytes=size_bytes,
+                           duration_sec=duration, backup_id=backup_id,
+                           phases={k: round(v, 3) for k, v in phases.items()},
+                           bottleneck=resources["bottleneck"] if resources else None)
+                if self.offsite is not None and backup_id is not None:
                     try:
-                        self.db.insert_backup(ts=start, path=str(dt_file), status="ERR",
-                                              size_bytes=size_bytes, duration_sec=duration, rc=res.returncode, stderr=stderr,
-                                              fingerprint=current_fp)
+                        self.offsite.submit(backup_id, final_path)
                     except Exception as e:
-                        self.logger.warning(f"DB insert failed: {e}")
-                    
-                    return None
-            except Exception as e:
-                self.logger.exception("Exception during backup: %s", e)
+                        self.logger.warning(f"Offsite upload not queued: {e}")
+                self.last_status, self.last_backup_id = "OK", backup_id
+                return final_path
+            else:
+                self.logger.error(f"ERR: 1C returned {res.returncode}. stderr={stderr}")
                 try:
-                    self.db.insert_backup(ts=start, path=str(dt_file), status="EXC",
-                                          size_bytes=None, duration_sec=None, rc=None, stderr=str(e),
-                                          fingerprint=current_fp)
-                except Exception:
-                    pass
-                
+                    self.db.insert_backup(ts=start, path=self._failed_dump_path(dt_file, spooled), status="ERR",
+                                          size_bytes=size_bytes, duration_sec=duration, rc=res.returncode, stderr=stderr,
+                                          fingerprint=current_fp, base=self.base_name, phases=phases,
+                                          resources=self._resources_row())
+                except Exception as e:
+                    self.logger.warning(f"DB insert failed: {e}")
+                self._emit("backup.completed", status="ERR", rc=res.returncode, duration_sec=duration)
+                self.last_status = "ERR"
                 return None
-        finally:
-            self._lock.release()
+        except Exception as e:
+            self.logger.exception("Exception during backup: %s", e)
+            try:
+                self.db.insert_backup(ts=start, path=self._failed_dump_path(dt_file, spooled), status="EXC",
+                                      size_bytes=None, duration_sec=None, rc=None, stderr=str(e),
+                                      fingerprint=current_fp, base=self.base_name, phases=phases,
+                                      resources=self._resources_row())
+            except Exception:
+                pass
+            self._emit("backup.completed", status="EXC", error=str(e))
+            self.last_status = "EXC"
+            return None
 
@@ -0,0 +1,247 @@
+"""
+Backup-level histograms and SLO gauges
+Built from the `backups` table and updated incrementally: each refresh only
+reads rows inserted since the previous one.
+"""
+from __future__ import annotations
+
+import bisect
+import copy
+import json
+import re
+import threading
+from collections import deque
+from datetime import datetime, timedelta
+from typing import Deque, Dict, List, Optional, Sequence, Tuple
+
+MB = 1024 * 1024
+GB = 1024 * MB
+
+DURATION_BUCKETS = (30, 60, 120, 300, 600, 900, 1800, 3600, 7200)
+SIZE_BUCKETS = (100 * MB, 500 * MB, 1 * GB, 2 * GB, 5 * GB, 10 * GB, 20 * GB, 50 * GB)
+RATIO_BUCKETS = (1, 1.5, 2, 3, 4, 6, 8, 12, 16)
+THROUGHPUT_BUCKETS = (1 * MB, 5 * MB, 10 * MB, 25 * MB, 50 * MB, 100 * MB, 200 * MB, 500 * MB)
+PHASE_BUCKETS = (0.1, 1, 5, 15, 30, 60, 120, 300, 600, 1800, 3600)
+
+# Gauges of the last 1C dump's resource profile: (metric, backup_resources column)
+DUMP_GAUGES = (
+    ("backup_dump_peak_cpu_percent", "peak_cpu_percent"),
+    ("backup_dump_mean_cpu_percent", "mean_cpu_percent"),
+    ("backup_dump_peak_rss_bytes", "peak_rss_bytes"),
+    ("backup_dump_peak_read_bytes_per_second", "peak_read_bps"),
+    ("backup_dump_peak_write_bytes_per_second", "peak_write_bps"),
+    ("backup_dump_peak_read_iops", "peak_read_iops"),
+    ("backup_dump_peak_write_iops", "peak_write_iops"),
+)
+
+# Statuses that count as an attempt for success ratios (SKIP is neither)
+FAILED_STATUSES = {"ERR", "EXC"}
+DURATION_WINDOW = 100  # OK backups behind backup_duration_p95_seconds
+
+
+def _header(name: str, help_text: str) -> List[str]:
+    lines = [f"# HELP {name} {help_text}"] if help_text else []
+    lines.append(f"# TYPE {name} histogram")
+    return lines
+
+
+class Histogram:
+    """Cumulative Prometheus-style histogram"""
+
+    def __init__(self, name: str, buckets: Sequence[float], help_text: str = "",
+                 labels: Optional[Dict[str, str]] = None):
+        self.name = name
+        self.help = help_text
+        self.labels = dict(labels or {})
+        self.buckets: Tuple[float, ...] = tuple(sorted(buckets))
+        self.counts: List[int] = [0] * (len(self.buckets) + 1)  # last slot is +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def series_lines(self, name: str) -> List[str]:
+        """Sample lines without the HELP/TYPE header"""
+        labels = ",".join(f'{k}="{v}"' for k, v in self.labels.items())
+        bucket_prefix = labels + "," if labels else ""
+        suffix = f"{{{labels}}}" if labels else ""
+        lines = []
+        cumulative = 0
+        for bound, n in zip(self.buckets, self.counts):
+            cumulative += n
+            lines.append(f'{name}_bucket{{{bucket_prefix}le="{bound:g}"}} {cumulative}')
+        lines.append(f'{name}_bucket{{{bucket_prefix}le="+Inf"}} {self.count}')
+        lines.append(f"{name}_sum{suffix} {self.sum}")
+        lines.append(f"{name}_count{suffix} {self.count}")
+        return lines
+
+    def prometheus_lines(self, prefix: str = "onec_") -> List[str]:
+        name = f"{prefix}{self.name}"
+        return _header(name, self.help) + self.series_lines(name)
+
+    def flat(self) -> Dict[str, float]:
+        name = self.name + "".join("_" + re.sub(r"\W+", "_", v).strip("_") for v in self.labels.values())
+        return {f"{name}_sum": float(self.sum), f"{name}_count": float(self.count)}
+
+
+class HistogramFamily:
+    """One histogram metric split by a label (phase, span name); renders a single HELP/TYPE header"""
+
+    def __init__(self, name: str, label: str, buckets: Sequence[float], help_text: str = ""):
+        self.name = name
+        self.label = label
+        self.help = help_text
+        self.buckets = tuple(buckets)
+        self.children: Dict[str, Histogram] = {}
+
+    def observe(self, label_value: str, value: float):
+        child = self.children.get(label_value)
+        if child is None:
+            child = self.children[label_value] = Histogram(self.name, self.buckets, labels={self.label: label_value})
+        child.observe(value)
+
+    def prometheus_lines(self, prefix: str = "onec_") -> List[str]:
+        if not self.children:
+            return []
+        name = f"{prefix}{self.name}"
+        lines = _header(name, self.help)
+        for key in sorted(self.children):
+            lines.extend(self.children[key].series_lines(name))
+        return lines
+
+    def flat(self) -> Dict[str, float]:
+        out: Dict[str, float] = {}
+        for child in self.children.values():
+            out.update(child.flat())
+        return out
+
+
+def _parse_ts(value: Optional[str]) -> Optional[datetime]:
+    if not value:
+        return None
+    try:
+        return datetime.fromisoformat(value)
+    except ValueError:
+        return None
+
+
+class BackupStats:
+    """Incrementally maintained backup histograms and SLO state"""
+
+    def __init__(self, db, rpo_hours: float = 24.0, forecaster=None):
+        self.db = db
+        # Optional Forecaster: its gauges are exported with the SLO ones
+        self.forecaster = forecaster
+        self.rpo_seconds = float(rpo_hours) * 3600
+        self._lock = threading.Lock()
+        self._last_id = 0
+        self._last_ok: Optional[datetime] = None
+        # (ts, ok) attempts within the longest SLO window
+        self._attempts: Deque[Tuple[datetime, bool]] = deque()
+        # Peaks of the newest profiled 1C dump (backup_resources)
+        self._last_dump: Dict[str, float] = {}
+        # Recent OK durations: the last one against the p95 of those before it (slow-backup alert)
+        self._durations: Deque[float] = deque(maxlen=DURATION_WINDOW)
+
+        self.duration = Histogram("backups_duration_seconds", DURATION_BUCKETS, "Total backup duration")
+        self.size = Histogram("backups_size_bytes", SIZE_BUCKETS, "Final archive size")
+        self.compression_ratio = Histogram("backups_compression_ratio", RATIO_BUCKETS, "Raw .dt size / archive size")
+        self.throughput = Histogram("backups_dump_throughput_bytes_per_second", THROUGHPUT_BUCKETS,
+                                    "1C dump throughput")
+        self.phases = HistogramFamily("backups_phase_seconds", "phase", PHASE_BUCKETS,
+                                      "Time per make_backup phase (fingerprint, db, preflight, dump, compress, checksum)")
+
+    def _ingest(self, row):
+        status = (row["status"] or "").upper()
+        ts = _parse_ts(row["ts"])
+        if status == "OK":
+            if ts and (self._last_ok is None or ts > self._last_ok):
+                self._last_ok = ts
+            if row["duration_sec"] is not None:
+                self.duration.observe(float(row["duration_sec"]))
+                self._durations.append(float(row["duration_sec"]))
+            size = row["size_bytes"]
+            raw = row["raw_size_bytes"]
+            if size:
+                self.size.observe(float(size))
+                if raw:
+                    self.compression_ratio.observe(float(raw) / float(size))
+            dump_sec = row["dump_duration_sec"]
+            if raw and dump_sec:
+                self.throughput.observe(float(raw) / float(dump_sec))
+        if row["peak_cpu_percent"] is not None:
+            self._last_dump = {name: float(row[column]) for name, column in DUMP_GAUGES if row[column] is not None}
+        if row["phases"]:
+            try:
+                for phase, seconds in json.loads(row["phases"]).items():
+                    self.phases.observe(phase, float(seconds))
+            except (ValueError, TypeError, AttributeError):
+                pass
+        if ts and (status == "OK" or status in FAILED_STATUSES):
+            self._attempts.append((ts, status == "OK"))
+
+    def refresh(self):
+        """Fold in backups inserted since the last refresh"""
+        if self.forecaster is not None:
+            self.forecaster.refresh()
+        with self._lock:
+            for row in self.db.backups_since(self._last_id):
+                self._ingest(row)
+                self._last_id = row["id"]
+            cutoff = datetime.now() - timedelta(days=7)
+            while self._attempts and self._attempts[0][0] < cutoff:
+                self._attempts.popleft()
+
+    def _success_ratio(self, window: timedelta, now: datetime) -> Optional[float]:
+        cutoff = now - window
+        total = ok = 0
+        for ts, success in reversed(self._attempts):
+            if ts < cutoff:
+                break
+            total += 1
+            ok += success
+        return (ok / total) if total else None
+
+    def slo(self) -> Dict[str, float]:
+        with self._lock:
+            now = datetime.now()
+            gauges: Dict[str, float] = {"backup_rpo_seconds": self.rpo_seconds}
+            if self._last_ok is not None:
+                since = max(0.0, (now - self._last_ok).total_seconds())
+                gauges["backup_seconds_since_last_ok"] = since
+                gauges["backup_rpo_breach"] = 1.0 if since > self.rpo_seconds else 0.0
+            else:
+                gauges["backup_rpo_breach"] = 1.0
+            gauges.update(self._last_dump)
+            if self._durations:
+                gauges["backup_last_duration_seconds"] = self._durations[-1]
+            if len(self._durations) > 5:
+                previous = sorted(list(self._durations)[:-1])
+                gauges["backup_duration_p95_seconds"] = previous[min(len(previous) - 1, int(0.95 * len(previous)))]
+            for label, window in (("24h", timedelta(hours=24)), ("7d", timedelta(days=7))):
+                ratio = self._success_ratio(window, now)
+                if ratio is not None:
+                    gauges[f"backup_success_ratio_{label}"] = ratio
+        if self.forecaster is not None:
+            gauges.update(self.forecaster.gauges())
+        return gauges
+
+    def histograms(self) -> List[Histogram]:
+        """Consistent copies of the histograms (safe to render outside the lock)"""
+        with self._lock:
+            return [copy.deepcopy(h) for h in (self.duration, self.size, self.compression_ratio, self.throughput,
+                                               self.phases)]
+
+    def prometheus_lines(self) -> List[str]:
+        """Exposition lines for SLO gauges and histograms"""
+        self.refresh()
+        lines = []
+        for name, value in self.slo().items():
+            lines.append(f"# TYPE onec_{name} gauge")
+            lines.append(f"onec_{name} {value}")
+        for hist in self.histograms():
+            lines.extend(hist.prometheus_lines())
+        return lines
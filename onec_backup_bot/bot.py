@@ -2,29 +2,64 @@ from __future__ import annotations
 
 import asyncio
 import io
+import re
 import textwrap
+from datetime import datetime
 from pathlib import Path
-from typing import List
+from typing import List, Optional, Tuple
 
 from telegram import Update
 from telegram.ext import Application, CommandHandler, ContextTypes
 
+from .async_db import AsyncDatabase
+from .logtail import level_value, search as search_log
 from .metrics import collect_system_metrics
 
+LASTLOG_MAX_LINES = 1000
+
 
 def _is_allowed(user_id: int, allowed: List[int]) -> bool:
     return (not allowed) or (user_id in allowed)
 
 
+def _parse_lastlog_args(args: List[str]) -> Tuple[int, Optional[str], Optional[str]]:
+    """/lastlog [N] [level] [pattern...]"""
+    args = list(args or [])
+    limit = 100
+    level = None
+    if args and args[0].isdigit():
+        limit = max(1, min(int(args.pop(0)), LASTLOG_MAX_LINES))
+    if args and level_value(args[0]):
+        level = args.pop(0).upper()
+    pattern = " ".join(args) or None
+    return limit, level, pattern
+
+
+def _forecast_lines(fc, horizon_days: int) -> List[str]:
+    if fc is None:
+        return ["Прогноз: мало истории (нужно 3+ успешных бэкапа)"]
+    gb = 1024 ** 3
+    lines = [f"Следующий бэкап: ~{fc.size_bytes / gb:.2f} ГБ (до {fc.size_upper_bytes / gb:.2f})"
+             + (f", ~{fc.duration_sec / 60:.0f} мин" if fc.duration_sec is not None else "")]
+    if fc.disk_full_at is not None:
+        days = max(0, (fc.disk_full_at - datetime.now()).days)
+        lines.append(f"Диск заполнится: ~{fc.disk_full_at:%Y-%m-%d} (через {days} дн.)")
+    elif fc.disk_free_bytes is not None:
+        lines.append(f"Диск: места хватит больше чем на {horizon_days} дн.")
+    return lines
+
+
 class BotService:
     def __init__(self, *, application: Application, allowed_user_ids: List[int],
-                 backup_service, db, logger, cfg):
+                 backup_service, db, logger, cfg, adb: Optional[AsyncDatabase] = None, offsite=None):
         self.app = application
         self.allowed = allowed_user_ids
         self.backup_service = backup_service
         self.db = db
+        self.adb = adb or AsyncDatabase(db)
         self.logger = logger
         self.cfg = cfg
+        self.offsite = offsite
 
         self.app.add_handler(CommandHandler("start", self.cmd_start))
         self.app.add_handler(CommandHandler("help", self.cmd_help))
@@ -32,6 +67,7 @@ class BotService:
         self.app.add_handler(CommandHandler("status", self.cmd_status))
         self.app.add_handler(CommandHandler("health", self.cmd_health))
         self.app.add_handler(CommandHandler("lastlog", self.cmd_lastlog))
+        self.app.add_handler(CommandHandler("offsite_restore", self.cmd_offsite_restore))
 
     async def cmd_start(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         await self.cmd_help(update, context)
@@ -48,8 +84,9 @@ class BotService:
             Команды:
             /backup — выполнить резервное копирование
             /status — последние результаты бэкапов
-            /health — состояние системы (CPU, RAM, Disk)
-            /lastlog — последние строки лога
+            /health — состояние системы (CPU, RAM, Disk) и прогноз места
+            /lastlog [N] [уровень] [шаблон] — последние записи лога
+            /offsite_restore <id> — собрать архив из копии в Telegram
             
             Режим работы: только ручные резервные копии через бота
             """
@@ -81,7 +118,11 @@ class BotService:
         if not _is_allowed(user.id, self.allowed):
             await update.effective_message.reply_text("Access denied")
             return
-        rows = self.db.recent_backups(limit=20)
+        try:
+            rows = await self.adb.recent_backups(limit=20)
+        except asyncio.TimeoutError:
+            await update.effective_message.reply_text("База данных занята, попробуйте позже")
+            return
         if not rows:
             await update.effective_message.reply_text("Данных пока нет")
             return
@@ -110,8 +151,11 @@ class BotService:
         if not _is_allowed(user.id, self.allowed):
             await update.effective_message.reply_text("Access denied")
             return
-        m = collect_system_metrics(Path(self.cfg.backup.backup_dir))
-        last_b = self.db.last_success()
+        m = await asyncio.to_thread(collect_system_metrics, Path(self.cfg.backup.backup_dir))
+        try:
+            last_b = await self.adb.last_success()
+        except asyncio.TimeoutError:
+            last_b = None
         last_b_text = f"{last_b['ts']} size={last_b['size_bytes']}" if last_b else "нет"
         text = (
             f"CPU: {m['cpu_percent']:.1f}%\n"
@@ -119,6 +163,10 @@ class BotService:
             f"Disk: {m['disk_percent']:.1f}%\n"
             f"Последний успешный бэкап: {last_b_text}"
         )
+        forecaster = getattr(self.backup_service, "forecaster", None)
+        if forecaster is not None:
+            await asyncio.to_thread(forecaster.refresh)
+            text += "\n" + "\n".join(_forecast_lines(forecaster.forecast(), forecaster.horizon_days))
         await update.effective_message.reply_text(text)
 
     async def cmd_lastlog(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -128,17 +176,48 @@ class BotService:
         if not _is_allowed(user.id, self.allowed):
             await update.effective_message.reply_text("Access denied")
             return
-        log_path = Path(self.cfg.backup.backup_dir) / self.cfg.backup.log_file
-        if not log_path.exists():
+        log_dir = Path(self.cfg.backup.backup_dir)
+        if not (log_dir / self.cfg.backup.log_file).exists():
             await update.effective_message.reply_text("Лог пока отсутствует")
             return
+        limit, level, pattern = _parse_lastlog_args(context.args)
         try:
-            with open(log_path, "r", encoding="utf-8", errors="replace") as f:
-                lines = f.readlines()[-100:]
-            text = "".join(lines)
-            bio = io.BytesIO(text.encode("utf-8"))
-            bio.name = "backup.log.txt"
-            await update.effective_message.reply_document(bio)
+            records = await asyncio.to_thread(search_log, log_dir, self.cfg.backup.log_file,
+                                              limit=limit, level=level, pattern=pattern)
+        except re.error as e:
+            await update.effective_message.reply_text(f"Некорректный шаблон: {e}")
+            return
         except Exception as e:
             await update.effective_message.reply_text(f"Ошибка чтения лога: {e}")
+            return
+        if not records:
+            await update.effective_message.reply_text("Подходящих записей нет")
+            return
+        bio = io.BytesIO(("\n".join(records) + "\n").encode("utf-8"))
+        bio.name = "backup.log.txt"
+        await update.effective_message.reply_document(bio)
 
+    async def cmd_offsite_restore(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        user = update.effective_user
+        if user is None:
+            return
+        if not _is_allowed(user.id, self.allowed):
+            await update.effective_message.reply_text("Access denied")
+            return
+        if self.offsite is None:
+            await update.effective_message.reply_text("Внешние копии в Telegram не включены (telegram.offsite_upload)")
+            return
+        if not context.args or not context.args[0].isdigit():
+            await update.effective_message.reply_text("Использование: /offsite_restore <id бэкапа>")
+            return
+        backup_id = int(context.args[0])
+        dest = Path(self.cfg.backup.backup_dir) / "restored"
+        await update.effective_message.reply_text(f"Собираю архив бэкапа #{backup_id}...")
+        try:
+            # Uploader's HTTP session lives on the API loop
+            path = await asyncio.wrap_future(self.offsite.submit_reassemble(dest, backup_id))
+        except Exception as e:
+            self.logger.warning(f"/offsite_restore {backup_id} failed: {e}")
+            await update.effective_message.reply_text(f"❌ Не удалось собрать архив: {e}")
+            return
+        await update.effective_message.reply_text(f"✅ Архив восстановлен: {path}")
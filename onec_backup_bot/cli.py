@@ -0,0 +1,1028 @@
+"""
+Command-line entry point
+    python main.py [run]      bot + API daemon (API-only if BOT_TOKEN is unset)
+    python main.py serve-api  API/scheduler daemon without Telegram
+    python main.py backup     one-shot backup for Task Scheduler / cron
+    python main.py verify     check archives of recent backups
+    python main.py status     last backups and RPO state
+    python main.py resources  CPU/RAM/disk profile of recent 1C dumps
+    python main.py forecast   next backup size/duration, disk-full date, pre-flight
+    python main.py restore    decode an archive back to .dt
+    python main.py reconcile  compare backup folders with the catalog, repair drift
+    python main.py offsite-restore  rebuild an archive from its Telegram volumes
+    python main.py migrate    move finished archives to the slow storage tier
+    python main.py autotune   benchmark codecs on a recent dump
+    python main.py train-dict train a zstd dictionary on recent dumps
+    python main.py io-bench   page-cache footprint and speed of archive I/O
+    python main.py gen-key    new archive encryption key
+    python main.py fleet      fleet aggregator
+Heavy dependencies (telegram, aiohttp, psutil) are imported only by the
+subcommands that need them, so one-shot commands start quickly.
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import logging
+import sys
+from pathlib import Path
+from typing import List, Optional
+
+# Exit codes
+EXIT_OK = 0
+EXIT_FAILED = 1  # backup failed / verification failed / RPO breached
+EXIT_USAGE = 2  # argparse errors, bad configuration
+EXIT_BUSY = 75  # another backup is running (EX_TEMPFAIL)
+
+
+def _logger(cfg, backup_dir: Path) -> logging.Logger:
+    from .logger import setup_logger
+
+    return setup_logger("OneCBackup", backup_dir, cfg.backup.log_file, level=logging.INFO,
+                        max_mb=cfg.logging.max_mb, daily=cfg.logging.daily,
+                        backup_count=cfg.logging.backup_count, compress=cfg.logging.compress,
+                        json_lines=cfg.logging.json_lines)
+
+
+def _backup_service(cfg, backup_dir: Path, db, logger, events=None):
+    from .backup import BackupService
+
+    service = BackupService(
+        onec_exe=cfg.onec.exe,
+        base_path=cfg.onec.base_path,
+        uc=cfg.onec.uc,
+        up=cfg.onec.up,
+        backup_dir=str(backup_dir),
+        file_prefix=cfg.backup.file_prefix,
+        logger=logger,
+        db=db,
+        events=events,
+    )
+    # Pass compression settings to the service
+    setattr(service, 'compress', cfg.backup.compress)
+    setattr(service, 'compress_level', cfg.backup.compress_level)
+    setattr(service, 'compress_threads', cfg.backup.compress_threads)
+    setattr(service, 'zstd_dict', cfg.backup.zstd_dict)
+    setattr(service, 'io_buffer_mb', cfg.backup.io_buffer_mb)
+    setattr(service, 'drop_cache', cfg.backup.drop_cache)
+    setattr(service, 'preallocate_mb', cfg.backup.preallocate_mb)
+    setattr(service, 'direct_io', cfg.backup.direct_io)
+    setattr(service, 'encrypt', cfg.backup.encrypt)
+    if cfg.backup.encrypt:
+        service.keyring = _keyring(cfg)
+    setattr(service, 'delete_dt_after_compress', cfg.backup.delete_dt_after_compress)
+    setattr(service, 'resource_sample_sec', cfg.backup.resource_sample_sec)
+    setattr(service, 'preflight', cfg.backup.preflight)
+    setattr(service, 'spool_dir', cfg.backup.spool_dir)
+    service.forecaster = _forecaster(cfg, backup_dir, db)
+    return service
+
+
+def _forecaster(cfg, backup_dir: Path, db):
+    from .forecast import Forecaster
+
+    compressing = cfg.backup.compress != "none" or cfg.backup.encrypt
+    return Forecaster(
+        db, backup_dir, base=Path(cfg.onec.base_path).name, window=cfg.backup.forecast_window,
+        retention_days=cfg.backup.retention_days, reserve_mb=cfg.backup.free_space_reserve_mb,
+        keep_dump=compressing and not (cfg.backup.delete_dt_after_compress or cfg.backup.encrypt),
+        # Archives leave backup_dir after tier_min_age_hours, plus up to one migration pass
+        tier_hold_hours=(cfg.backup.tier_min_age_hours + cfg.backup.tier_interval_sec / 3600
+                         if cfg.backup.tier_dir else None),
+    )
+
+
+def _migrator(cfg, backup_dir: Path, db, logger, *, backup_service=None, offsite=None, events=None):
+    """TierMigrator for backup.tier_dir, or None with a single tier"""
+    if not cfg.backup.tier_dir:
+        return None
+    from .tiering import TierMigrator
+
+    return TierMigrator(
+        db, backup_dir, Path(cfg.backup.tier_dir), logger,
+        min_age_hours=cfg.backup.tier_min_age_hours, min_free_mb=cfg.backup.tier_min_free_mb,
+        rate_mb_s=cfg.backup.tier_rate_mb_s, interval_sec=cfg.backup.tier_interval_sec,
+        io_opts=_io_options(cfg), backup_service=backup_service, offsite=offsite, events=events,
+    )
+
+
+def _io_options(cfg):
+    from .fileio import IOOptions
+
+    return IOOptions(buffer_mb=cfg.backup.io_buffer_mb, drop_cache=cfg.backup.drop_cache,
+                     preallocate_mb=cfg.backup.preallocate_mb, direct=cfg.backup.direct_io)
+
+
+def _keyring(cfg):
+    from .encryption import KeyRing
+
+    return KeyRing.load(cfg.backup.encryption_keys, cfg.backup.encryption_keys_file,
+                        cfg.backup.encryption_key_id)
+
+
+def _check_encryption(cfg):
+    """backup.encrypt must be able to seal: a backup never falls back to a plaintext dump"""
+    from .encryption import available
+
+    keyring = _keyring(cfg)  # malformed keys are a configuration error
+    if keyring.active_id is None:
+        raise ValueError("backup.encrypt is on but no keys are configured "
+                         "(BACKUP_ENCRYPTION_KEYS or backup.encryption_keys_file)")
+    if not available():
+        raise ValueError("backup.encrypt needs the cryptography package (pip install cryptography)")
+
+
+def _offsite(cfg, db, logger):
+    if not cfg.telegram.offsite_upload:
+        return None
+    if not (cfg.telegram.bot_token and cfg.telegram.broadcast_chat_id):
+        logger.warning("telegram.offsite_upload needs BOT_TOKEN and telegram.broadcast_chat_id; disabled")
+        return None
+    from .offsite import TelegramOffsite
+
+    return TelegramOffsite(
+        bot_token=cfg.telegram.bot_token,
+        chat_id=cfg.telegram.broadcast_chat_id,
+        db=db,
+        logger=logger,
+        api_base=cfg.telegram.api_base,
+        volume_mb=cfg.telegram.volume_mb,
+        concurrency=cfg.telegram.upload_concurrency,
+        rate_per_min=cfg.telegram.upload_rate_per_min,
+    )
+
+
+def _alerts(cfg, logger):
+    if not cfg.alerts.enabled:
+        return None
+    from .alerts import AlertDispatcher, AlertEngine, parse_rules
+
+    rules = parse_rules(cfg.alerts.rules, logger, rpo_hours=cfg.backup.rpo_hours)
+    if not (cfg.telegram.bot_token and cfg.telegram.broadcast_chat_id):
+        logger.info("Alerts go to the log only (set BOT_TOKEN and telegram.broadcast_chat_id to deliver them)")
+    return AlertDispatcher(
+        AlertEngine(rules, repeat_min=cfg.alerts.repeat_min),
+        logger,
+        bot_token=cfg.telegram.bot_token,
+        chat_id=cfg.telegram.broadcast_chat_id,
+        api_base=cfg.telegram.api_base,
+        rate_per_min=cfg.alerts.rate_per_min,
+        group_wait_sec=cfg.alerts.group_wait_sec,
+    )
+
+
+class _Daemon:
+    """API server, metrics worker, alerts, scheduler and offsite uploads on one background loop"""
+
+    def __init__(self, cfg, logger, backup_dir: Path):
+        from .async_db import AsyncDatabase
+        from .backup_stats import BackupStats
+        from .db import Database
+        from .events import EventBus
+
+        self.cfg = cfg
+        self.logger = logger
+        self.backup_dir = backup_dir
+        # SQLite database in backup_dir
+        self.db = Database(backup_dir / "app.sqlite3")
+        self.adb = AsyncDatabase(self.db)
+        # Pub/sub for /api/events (bound to the API loop when it starts)
+        self.events = EventBus(logger=logger)
+        self.backup_service = _backup_service(cfg, backup_dir, self.db, logger, events=self.events)
+        self.backup_stats = BackupStats(self.db, rpo_hours=cfg.backup.rpo_hours,
+                                        forecaster=self.backup_service.forecaster)
+        self.offsite = None
+        self.scheduler = None
+        self.metrics_worker = None
+        self.alerts = _alerts(cfg, logger)
+        self.api_server = None
+        self.api_loop = None
+        self.api_thread = None
+        self.api_workers = None
+        self.snapshot_publisher = None
+        self.migrator = None
+
+    def _api_port(self) -> int:
+        """Port of the in-process API: api.port, or the control port when worker processes serve api.port"""
+        from .api_workers import reuse_port_supported
+
+        api = self.cfg.api
+        if api.workers <= 0:
+            return api.port
+        if not reuse_port_supported():
+            self.logger.warning("api.workers needs SO_REUSEPORT (Linux/BSD); serving the API from the bot process")
+            return api.port
+        return api.control_port or api.port + 1
+
+    def _start_api_workers(self, control_port: int):
+        from .api_workers import SNAPSHOT_DIR, ApiWorkerPool, SnapshotPublisher
+
+        api = self.cfg.api
+        self.snapshot_publisher = SnapshotPublisher(self.api_server, self.backup_dir / SNAPSHOT_DIR,
+                                                    interval=api.snapshot_sec)
+        self.snapshot_publisher.start(self.api_loop)
+        self.api_workers = ApiWorkerPool(api.workers, {
+            "backup_dir": str(self.backup_dir),
+            "host": api.host,
+            "port": api.port,
+            "control_port": control_port,
+            "token": api.token,
+            "log_file": self.cfg.backup.log_file,
+            "max_downloads": api.max_downloads,
+            "download_rate_mb_s": api.download_rate_mb_s,
+            "tier_dir": self.cfg.backup.tier_dir,
+            # Workers answer 503 once the bot has stopped publishing for this long
+            "snapshot_max_age": max(60.0, api.snapshot_sec * 6),
+        }, self.logger)
+        self.api_workers.start()
+
+    def start(self):
+        import asyncio
+        import threading
+
+        from .api_server import APIServer
+        from .metrics_worker import MetricsWorker
+
+        cfg = self.cfg
+        api_port = self._api_port()
+        # HTTP API server (pull model)
+        self.api_server = APIServer(
+            backup_service=self.backup_service,
+            db=self.db,
+            logger=self.logger,
+            api_host=cfg.api.host,
+            api_port=api_port,
+            backup_dir=self.backup_dir,
+            log_file=cfg.backup.log_file,
+            backup_stats=self.backup_stats,
+            adb=self.adb,
+            api_token=cfg.api.token,
+            max_downloads=cfg.api.max_downloads,
+            download_rate_mb_s=cfg.api.download_rate_mb_s,
+            events=self.events,
+            alerts=self.alerts,
+            tier_dir=cfg.backup.tier_dir or None,
+        )
+        self.api_loop = asyncio.new_event_loop()
+        loop, server = self.api_loop, self.api_server
+        self.api_thread = threading.Thread(target=lambda: (loop.run_until_complete(server.start()), loop.run_forever()),
+                                           name="APIServer", daemon=True)
+        self.api_thread.start()
+        # Read API in worker processes sharing api.port; this process keeps the control port
+        if api_port != cfg.api.port:
+            self._start_api_workers(api_port)
+
+        # Metrics worker on the shared API loop (auto-disables if no endpoints set and alerts are off)
+        if self.alerts is not None:
+            self.alerts.start(self.api_loop)
+        self.metrics_worker = MetricsWorker(self.backup_dir, self.logger, backup_stats=self.backup_stats,
+                                            alerts=self.alerts)
+        self.metrics_worker.start(self.api_loop)
+
+        # Offsite copies in the broadcast chat (uploads run on the API loop)
+        self.offsite = _offsite(cfg, self.db, self.logger)
+        if self.offsite is not None:
+            self.offsite.start(self.api_loop)
+            self.backup_service.offsite = self.offsite
+
+        # Finished archives move from backup_dir to the slow tier in the background
+        self.migrator = _migrator(cfg, self.backup_dir, self.db, self.logger, backup_service=self.backup_service,
+                                  offsite=self.offsite, events=self.events)
+        if self.migrator is not None:
+            self.migrator.start(self.api_loop)
+
+        # Built-in schedule (jobs wait for a quiet host, up to a deadline)
+        if cfg.schedule.enabled:
+            from .scheduler import BackupScheduler
+
+            self.scheduler = BackupScheduler(
+                services={self.backup_service.base_name: self.backup_service},
+                jobs=cfg.schedule.jobs,
+                db=self.db,
+                logger=self.logger,
+                backup_dir=self.backup_dir,
+                default_base=self.backup_service.base_name,
+                jitter_sec=cfg.schedule.jitter_sec,
+                deadline_min=cfg.schedule.deadline_min,
+                catch_up=cfg.schedule.catch_up,
+                max_cpu_percent=cfg.schedule.max_cpu_percent,
+                max_mem_percent=cfg.schedule.max_mem_percent,
+                max_disk_percent=cfg.schedule.max_disk_percent,
+                max_onec_clients=cfg.schedule.max_onec_clients,
+                check_interval_sec=cfg.schedule.check_interval_sec,
+            )
+            self.scheduler.start(self.api_loop)
+
+    def stop(self):
+        import asyncio
+
+        self.logger.info("Shutting down...")
+        # Stop workers while the shared loop is still running
+        if self.metrics_worker is not None:
+            self.metrics_worker.stop()
+        if self.scheduler is not None:
+            self.scheduler.stop()
+        if self.migrator is not None:
+            self.migrator.stop()
+        if self.api_workers is not None:
+            self.api_workers.stop()
+        if self.snapshot_publisher is not None:
+            self.snapshot_publisher.stop()
+        if self.api_loop is not None:
+            for closing in (self.offsite, self.alerts):
+                if closing is None:
+                    continue
+                try:
+                    asyncio.run_coroutine_threadsafe(closing.close(), self.api_loop).result(timeout=5)
+                except Exception:
+                    pass
+            try:
+                asyncio.run_coroutine_threadsafe(self.api_server.stop(), self.api_loop).result(timeout=5)
+            except Exception:
+                pass
+            self.api_loop.call_soon_threadsafe(self.api_loop.stop)
+            if self.api_thread is not None and self.api_thread.is_alive():
+                self.api_thread.join(timeout=5)
+        self.logger.info("Stopped")
+
+
+def _wait_for_shutdown():
+    """Block until Ctrl+C or SIGTERM"""
+    import signal
+    import threading
+
+    stop = threading.Event()
+    if hasattr(signal, "SIGTERM"):
+        signal.signal(signal.SIGTERM, lambda *_: stop.set())
+    try:
+        while not stop.wait(1.0):
+            pass
+    except KeyboardInterrupt:
+        pass
+
+
+def cmd_run(cfg, args) -> int:
+    backup_dir = Path(cfg.backup.backup_dir)
+    logger = _logger(cfg, backup_dir)
+    logger.info("Starting application")
+    if cfg.fleet.enabled:
+        return _run_fleet(cfg, logger)
+
+    daemon = _Daemon(cfg, logger, backup_dir)
+    daemon.start()
+    try:
+        if args.no_telegram or not cfg.telegram.bot_token:
+            if not args.no_telegram:
+                logger.warning("BOT_TOKEN is not set; running API-only (no Telegram bot)")
+            mode = "scheduled backups" if daemon.scheduler else "API only"
+            logger.info(f"Daemon started - {mode}")
+            _wait_for_shutdown()
+            return EXIT_OK
+
+        from telegram.ext import Application
+
+        from .bot import BotService
+
+        application = Application.builder().token(cfg.telegram.bot_token).build()
+        BotService(
+            application=application,
+            allowed_user_ids=cfg.security.allowed_user_ids,
+            backup_service=daemon.backup_service,
+            db=daemon.db,
+            logger=logger,
+            cfg=cfg,
+            adb=daemon.adb,
+            offsite=daemon.offsite,
+        )
+        logger.info("Bot started - " + ("scheduled and manual backups" if daemon.scheduler else "manual backup mode"))
+        application.run_polling(drop_pending_updates=True)
+        return EXIT_OK
+    finally:
+        daemon.stop()
+
+
+def cmd_serve_api(cfg, args) -> int:
+    args.no_telegram = True
+    return cmd_run(cfg, args)
+
+
+def _run_fleet(cfg, logger) -> int:
+    """Aggregator mode: poll other instances, no Telegram bot or local backups"""
+    import asyncio
+
+    from .fleet import FleetAggregator
+
+    aggregator = FleetAggregator(
+        nodes=cfg.fleet.nodes,
+        logger=logger,
+        interval=cfg.fleet.interval,
+        timeout=cfg.fleet.timeout,
+        concurrency=cfg.fleet.concurrency,
+        host=cfg.api.host,
+        port=cfg.api.port,
+    )
+    try:
+        asyncio.run(aggregator.run_forever())
+    except KeyboardInterrupt:
+        logger.info("Stopped")
+    return EXIT_OK
+
+
+def cmd_fleet(cfg, args) -> int:
+    if not cfg.fleet.nodes:
+        print("fleet.nodes is empty in config.yaml", file=sys.stderr)
+        return EXIT_USAGE
+    return _run_fleet(cfg, _logger(cfg, Path(cfg.backup.backup_dir)))
+
+
+def cmd_backup(cfg, args) -> int:
+    from .db import Database
+
+    backup_dir = Path(cfg.backup.backup_dir)
+    logger = _logger(cfg, backup_dir)
+    db = Database(backup_dir / "app.sqlite3")
+    service = _backup_service(cfg, backup_dir, db, logger)
+    path = service.make_backup()
+    status = service.last_status
+    print(f"{status}: {path}" if path else f"{status}: no archive created")
+
+    if status == "OK" and not args.no_offsite:
+        offsite = _offsite(cfg, db, logger)
+        if offsite is not None and service.last_backup_id is not None:
+            import asyncio
+
+            async def _upload():
+                try:
+                    return await offsite.upload(service.last_backup_id, path)
+                finally:
+                    await offsite.close()
+
+            if not asyncio.run(_upload()):
+                print("Offsite upload failed (archive kept locally)", file=sys.stderr)
+
+    if status == "OK" or (status == "SKIP" and not args.strict):
+        return EXIT_OK
+    if status == "BUSY":
+        return EXIT_BUSY
+    return EXIT_FAILED
+
+
+def _verify_archive(path: Path, expected_size: Optional[int], codec: Optional[str] = None,
+                    backup_dir: Optional[Path] = None, raw_size: Optional[int] = None,
+                    io_opts=None, keyring=None) -> Optional[str]:
+    """None if the archive looks intact, else the problem"""
+    if not path.is_file():
+        return "file missing"
+    size = path.stat().st_size
+    if expected_size is not None and size != expected_size:
+        return f"size {size} != catalog {expected_size}"
+    from .compression import CodecSpec, decompress_archive, infer_spec
+
+    spec = CodecSpec.parse(codec) if codec else infer_spec(str(path))
+    from .encryption import is_encrypted
+
+    if is_encrypted(path):
+        # Every chunk is authenticated: a full decode is the check
+        try:
+            decoded = decompress_archive(path, spec, backup_dir or path.parent, None, io_opts, keyring)
+        except Exception as e:
+            return f"decrypt/decode failed: {e}"
+        if raw_size is not None and decoded != raw_size:
+            return f"decoded {decoded} bytes != dump {raw_size}"
+    elif spec.name == "zip":
+        import zipfile
+
+        try:
+            with zipfile.ZipFile(path) as zf:
+                bad = zf.testzip()
+        except zipfile.BadZipFile as e:
+            return f"bad zip: {e}"
+        if bad is not None:
+            return f"CRC error in {bad}"
+    elif spec.name != "none":
+        # zstd/lz4/xz frames carry checksums; a full decode verifies them
+        try:
+            decoded = decompress_archive(path, spec, backup_dir or path.parent, None, io_opts)
+        except Exception as e:
+            return f"{spec.name} decode failed: {e}"
+        if raw_size is not None and decoded != raw_size:
+            return f"decoded {decoded} bytes != dump {raw_size}"
+    return None
+
+
+def cmd_verify(cfg, args) -> int:
+    from .db import Database
+
+    backup_dir = Path(cfg.backup.backup_dir)
+    db = Database(backup_dir / "app.sqlite3")
+    if args.id is not None:
+        row = db.get_backup(args.id)
+        rows = [row] if row is not None else []
+        if not rows:
+            print(f"Backup {args.id} not found", file=sys.stderr)
+            return EXIT_FAILED
+    else:
+        rows = db.list_backups(limit=args.last, status="OK")
+    keyring = _keyring(cfg)
+    failed = 0
+    for row in rows:
+        problem = _verify_archive(Path(row["path"] or ""), row["size_bytes"], row["codec"], backup_dir,
+                                  row["raw_size_bytes"], _io_options(cfg), keyring)
+        failed += problem is not None
+        print(f"#{row['id']} {row['ts']} {row['path']}: {problem or 'OK'}")
+    if not rows:
+        print("No successful backups in the catalog")
+    return EXIT_FAILED if failed else EXIT_OK
+
+
+def cmd_restore(cfg, args) -> int:
+    """Decode an archive with the codec recorded in the catalog"""
+    from .compression import CodecSpec, decompress_archive, infer_spec
+    from .db import Database
+    from .encryption import EXTENSION as ENCRYPTED_SUFFIX
+
+    backup_dir = Path(cfg.backup.backup_dir)
+    db = Database(backup_dir / "app.sqlite3")
+    row = db.get_backup(args.id)
+    if row is None or not row["path"]:
+        print(f"Backup {args.id} not found", file=sys.stderr)
+        return EXIT_FAILED
+    src = Path(row["path"])
+    spec = CodecSpec.parse(row["codec"]) if row["codec"] else infer_spec(row["path"])
+    out_dir = args.out or backup_dir / "restored"
+    out_dir.mkdir(parents=True, exist_ok=True)
+    name = src.name
+    if name.endswith(ENCRYPTED_SUFFIX):
+        name = name[:-len(ENCRYPTED_SUFFIX)]
+    if spec.name == "zip":
+        name = Path(name).with_suffix(".dt").name
+    elif spec.name != "none" and name.endswith(".dt" + Path(name).suffix):
+        name = name[:-len(Path(name).suffix)]
+    dst = out_dir / name
+    partial = dst.with_name(dst.name + ".part")
+    try:
+        written = decompress_archive(src, spec, backup_dir, partial, _io_options(cfg), _keyring(cfg))
+    except Exception as e:
+        partial.unlink(missing_ok=True)
+        print(f"Restore of #{args.id} ({spec}) failed: {e}", file=sys.stderr)
+        return EXIT_FAILED
+    partial.replace(dst)
+    print(f"Restored #{args.id} ({spec}) to {dst} ({written} bytes)")
+    return EXIT_OK
+
+
+def cmd_offsite_restore(cfg, args) -> int:
+    """Rebuild an archive from its volumes in the Telegram chat, by catalog id or from its manifest"""
+    import asyncio
+
+    from .db import Database
+    from .offsite import TelegramOffsite, load_manifest
+
+    if not cfg.telegram.bot_token:
+        print("BOT_TOKEN is not set: the volumes can only be fetched by the bot that sent them", file=sys.stderr)
+        return EXIT_USAGE
+    backup_dir = Path(cfg.backup.backup_dir)
+    manifest = None
+    if args.manifest is not None:
+        try:
+            manifest = load_manifest(args.manifest)
+        except (OSError, ValueError) as e:
+            print(f"Cannot read {args.manifest}: {e}", file=sys.stderr)
+            return EXIT_USAGE
+    # A manifest needs no catalog: this is the path for a lost or new server
+    db = Database(backup_dir / "app.sqlite3") if manifest is None else None
+    offsite = TelegramOffsite(bot_token=cfg.telegram.bot_token, chat_id=cfg.telegram.broadcast_chat_id, db=db,
+                              logger=_logger(cfg, backup_dir), api_base=cfg.telegram.api_base)
+
+    async def _restore():
+        try:
+            return await offsite.reassemble(args.out or backup_dir / "restored", backup_id=args.id,
+                                            manifest=manifest)
+        finally:
+            await offsite.close()
+
+    try:
+        path = asyncio.run(_restore())
+    except Exception as e:
+        print(f"Offsite restore failed: {e}", file=sys.stderr)
+        return EXIT_FAILED
+    print(f"Reassembled {path} ({path.stat().st_size} bytes)")
+    return EXIT_OK
+
+
+def cmd_reconcile(cfg, args) -> int:
+    """Folders vs catalog: moved, missing and unknown archives, stale manifests"""
+    from .db import Database
+    from .manifests import reconcile
+
+    backup_dir = Path(cfg.backup.backup_dir)
+    db = Database(backup_dir / "app.sqlite3")
+    try:
+        report = reconcile(db, backup_dir, tier_dir=cfg.backup.tier_dir or None, repair=args.repair,
+                           checksums=args.checksums, workers=args.workers, io_opts=_io_options(cfg))
+    except OSError as e:
+        print(f"Reconcile failed: {e}", file=sys.stderr)
+        return EXIT_FAILED
+    if args.json:
+        print(json.dumps({
+            "folders": report.folders, "archives": report.archives, "rows": report.rows,
+            "repaired": report.repaired, "seconds": round(report.seconds, 3), "problems": report.problems,
+            "findings": [vars(f) for f in report.findings],
+        }, ensure_ascii=False, indent=2))
+    else:
+        for f in report.findings:
+            ref = f"#{f.backup_id}" if f.backup_id is not None else "-"
+            print(f"{f.kind:<9} {ref:<7} {f.path}" + (f"  ({f.detail})" if f.detail else ""))
+        kinds = ("moved", "missing", "returned", "orphan", "size", "checksum", "manifest", "duplicate")
+        summary = ", ".join(f"{k} {report.count(k)}" for k in kinds if report.count(k))
+        print(f"{report.archives} archives in {report.folders} folders, {report.rows} catalog rows, "
+              f"{report.seconds:.2f}s: {summary or 'in sync'}" + (" - repaired" if report.repaired else ""))
+    return EXIT_FAILED if report.problems else EXIT_OK
+
+
+def cmd_gen_key(cfg, args) -> int:
+    import datetime as dt
+
+    from .encryption import new_key
+
+    key_id = args.id or dt.date.today().strftime("k%Y%m%d")
+    print(f"{key_id}:{new_key()}")
+    print("Append it to BACKUP_ENCRYPTION_KEYS in .env (keep old keys for restores) and keep a copy offline;"
+          " archives cannot be restored without it.", file=sys.stderr)
+    return EXIT_OK
+
+
+def _recent_dumps(backup_dir: Path, count: int) -> List[Path]:
+    dumps = sorted(backup_dir.glob("*/*.dt"), key=lambda p: p.stat().st_mtime, reverse=True)
+    return dumps[:count]
+
+
+def cmd_train_dict(cfg, args) -> int:
+    from .compression import CODECS, train_dictionary
+
+    backup_dir = Path(cfg.backup.backup_dir)
+    if not CODECS["zstd"].available():
+        print("zstd is not installed: pip install zstandard", file=sys.stderr)
+        return EXIT_USAGE
+    dumps = args.files or _recent_dumps(backup_dir, args.dumps)
+    if not dumps:
+        print("No .dt dumps to train on (set delete_dt_after_compress: false or pass --file)", file=sys.stderr)
+        return EXIT_FAILED
+    try:
+        dict_id, path = train_dictionary(backup_dir, dumps, dict_size=args.size_kb * 1024)
+    except ValueError as e:
+        print(f"Training failed: {e}", file=sys.stderr)
+        return EXIT_FAILED
+    print(f"Dictionary {dict_id} trained on {len(dumps)} dumps: {path}")
+    print("Enable it with backup.zstd_dict: true (compress: zstd)")
+    return EXIT_OK
+
+
+def cmd_autotune(cfg, args) -> int:
+    import tempfile
+
+    from .compression import autotune, latest_dictionary, pareto_front, pick_best, write_sample
+
+    backup_dir = Path(cfg.backup.backup_dir)
+    dumps = [args.file] if args.file else _recent_dumps(backup_dir, 1)
+    if not dumps or not dumps[0].is_file():
+        print("No .dt dump to benchmark on (pass --file)", file=sys.stderr)
+        return EXIT_FAILED
+    found = latest_dictionary(backup_dir)
+    with tempfile.TemporaryDirectory(dir=backup_dir) as work:
+        work = Path(work)
+        sample = work / "sample.dt"
+        size = write_sample(dumps, sample, args.sample_mb)
+        print(f"Sample: {size / 1024 / 1024:.0f} MB from {dumps[0]}")
+        results = autotune(sample, work, dictionary=found[1] if found else None,
+                           codecs=args.codecs, log=print)
+    if not results:
+        print("No codec could be benchmarked", file=sys.stderr)
+        return EXIT_FAILED
+    print("Pareto front (ratio vs compression speed):")
+    for r in pareto_front(results):
+        print(f"  {r.spec:<14} ratio {r.ratio:6.2f}  {r.compress_mb_s:8.1f} MB/s")
+    best = pick_best(results, args.min_speed_mb_s)
+    print(f"Best with >= {args.min_speed_mb_s:g} MB/s: {best.spec}")
+    if args.write:
+        from .config import DEFAULT_CONFIG_PATH, update_config_values
+
+        path = args.config or DEFAULT_CONFIG_PATH
+        update_config_values(path, "backup", {"compress": best.codec, "compress_level": best.level,
+                                              "zstd_dict": best.dictionary})
+        print(f"Written to {path}")
+    return EXIT_OK
+
+
+def _synthetic_dump(path: Path, size_mb: float):
+    """Roughly dump-like data: repeated records with random noise, ~3-5x compressible"""
+    import os
+    import random
+
+    rng = random.Random(0)
+    records = [os.urandom(64) + bytes(rng.randrange(40, 90) for _ in range(448)) for _ in range(512)]
+    left = int(size_mb * 1024 * 1024)
+    with open(path, "wb") as f:
+        while left > 0:
+            block = b"".join(rng.choice(records) for _ in range(2048))[:left]
+            f.write(block)
+            left -= len(block)
+
+
+def cmd_io_bench(cfg, args) -> int:
+    """Compress one dump with plain and cache-friendly I/O; report speed and page-cache footprint"""
+    import dataclasses
+    import os
+    import tempfile
+    import time
+
+    from .compression import get_codec
+    from .fileio import LEGACY, cached_fraction, drop_cache
+
+    backup_dir = Path(cfg.backup.backup_dir)
+    name = args.codec or (cfg.backup.compress if cfg.backup.compress != "none" else "zip")
+    codec = get_codec(name)
+    if not codec.available():
+        print(f"{name} is not installed", file=sys.stderr)
+        return EXIT_USAGE
+    level = args.level if args.level is not None else cfg.backup.compress_level
+    hot = args.hot_file or Path(cfg.onec.base_path) / "1Cv8.1CD"
+    hot = hot if hot.is_file() else None
+
+    tuned = dataclasses.replace(_io_options(cfg), drop_cache=True, direct=False)
+    modes = [("plain", LEGACY), ("fadvise", tuned)]
+    if hasattr(os, "O_DIRECT"):
+        modes.append(("O_DIRECT", dataclasses.replace(tuned, direct=True)))
+
+    with tempfile.TemporaryDirectory(dir=backup_dir) as work:
+        work = Path(work)
+        src = args.file
+        if src is None:
+            src = work / "synthetic.dt"
+            _synthetic_dump(src, args.size_mb)
+        size = src.stat().st_size
+        print(f"Source {src} ({size / 1024 / 1024:.0f} MB), codec {name}:{level}"
+              + (f", hot file {hot}" if hot else ""))
+        print(f"{'mode':<9} {'MB/s':>8} {'src cached':>11} {'dst cached':>11} {'hot cached':>16}")
+        for label, opts in modes:
+            dst = work / f"bench-{label}{codec.extension}"
+            drop_cache(src)
+            hot_before = None
+            if hot is not None:
+                with open(hot, "rb") as f:
+                    while f.read(8 * 1024 * 1024):
+                        pass
+                hot_before = cached_fraction(hot)
+            started = time.perf_counter()
+            codec.compress(src, dst, level, io_opts=opts)
+            seconds = max(time.perf_counter() - started, 1e-9)
+
+            def pct(value):
+                return f"{value * 100:.0f}%" if value is not None else "n/a"
+
+            hot_text = f"{pct(hot_before)} -> {pct(cached_fraction(hot))}" if hot else "-"
+            print(f"{label:<9} {size / seconds / 1e6:8.1f} {pct(cached_fraction(src)):>11} "
+                  f"{pct(cached_fraction(dst)):>11} {hot_text:>16}")
+            dst.unlink()
+    print("src/dst cached: how much of the dump and archive the backup left in the page cache")
+    return EXIT_OK
+
+
+def cmd_status(cfg, args) -> int:
+    import datetime as dt
+
+    from .db import Database
+
+    db = Database(Path(cfg.backup.backup_dir) / "app.sqlite3")
+    rows = db.recent_backups(limit=args.limit)
+    last_ok = db.last_success()
+    age_hours = None
+    if last_ok is not None:
+        age_hours = (dt.datetime.now() - dt.datetime.fromisoformat(last_ok["ts"])).total_seconds() / 3600
+    breach = age_hours is None or age_hours > cfg.backup.rpo_hours
+    if args.json:
+        print(json.dumps({
+            "last_success": dict(last_ok) if last_ok else None,
+            "last_success_age_hours": round(age_hours, 2) if age_hours is not None else None,
+            "rpo_hours": cfg.backup.rpo_hours,
+            "rpo_breach": breach,
+            "recent": [{k: r[k] for k in ("id", "ts", "status", "path", "size_bytes", "duration_sec")} for r in rows],
+        }, ensure_ascii=False, default=str, indent=2))
+    else:
+        for r in rows:
+            size = f"{r['size_bytes'] / 1024 / 1024:.1f} MB" if r["size_bytes"] else "-"
+            print(f"#{r['id']:<6} {r['ts']}  {r['status']:<4} {size:>10}  {r['path'] or ''}")
+        if age_hours is None:
+            print(f"No successful backup yet (RPO {cfg.backup.rpo_hours:g} h)")
+        else:
+            print(f"Last success {age_hours:.1f} h ago (RPO {cfg.backup.rpo_hours:g} h)"
+                  + (" - BREACHED" if breach else ""))
+    return EXIT_FAILED if breach else EXIT_OK
+
+
+def cmd_resources(cfg, args) -> int:
+    """Per-dump resource peaks, or one dump's samples as CSV"""
+    from .db import Database
+    from .resources import ResourceProfile
+
+    db = Database(Path(cfg.backup.backup_dir) / "app.sqlite3")
+    if args.id is not None:
+        row = db.resource_profile(args.id)
+        if row is None:
+            print(f"No resource profile for backup {args.id}", file=sys.stderr)
+            return EXIT_FAILED
+        profile = ResourceProfile.decode(row["interval_sec"], row["data"], row["mem_total_bytes"] or 0)
+        series = profile.series()
+        if args.json:
+            print(json.dumps({"summary": profile.summary(), "samples": series}, indent=2))
+        else:
+            print("t,cpu_percent,rss_bytes,read_bytes_per_sec,write_bytes_per_sec,read_iops,write_iops")
+            for s in series:
+                print(",".join(f"{v:.3f}".rstrip("0").rstrip(".") for v in s.values()))
+        return EXIT_OK
+    rows = db.resource_summaries(limit=args.limit, base=args.base)
+    if args.json:
+        print(json.dumps([{k: r[k] for k in r.keys()} for r in rows], ensure_ascii=False, indent=2))
+        return EXIT_OK
+    mb = 1024 * 1024
+    print(f"{'id':<7} {'ts':<19} {'dump':>7} {'cpu avg/peak %':>15} {'rss MB':>8} {'read MB':>9} {'write MB':>9} "
+          f"{'MB/s r/w':>11} {'IOPS r/w':>13}  bottleneck")
+    for r in rows:
+        sec = r["dump_duration_sec"]
+        dump = "-" if not sec else f"{sec / 60:.0f}m" if sec >= 60 else f"{sec:.0f}s"
+        print(f"#{r['id']:<6} {r['ts']:<19} {dump:>7} {r['mean_cpu_percent']:>7.0f}/{r['peak_cpu_percent']:<7.0f} "
+              f"{r['peak_rss_bytes'] / mb:>8.0f} {r['read_bytes'] / mb:>9.0f} {r['write_bytes'] / mb:>9.0f} "
+              f"{r['peak_read_bps'] / mb:>5.0f}/{r['peak_write_bps'] / mb:<5.0f} "
+              f"{r['peak_read_iops']:>6.0f}/{r['peak_write_iops']:<6.0f}  {r['bottleneck']}")
+    if not rows:
+        print("No profiled dumps yet (backup.resource_sample_sec > 0 records them)")
+    return EXIT_OK
+
+
+def cmd_forecast(cfg, args) -> int:
+    """Trend forecast; exit 1 if the next backup is predicted not to fit"""
+    from .db import Database
+
+    backup_dir = Path(cfg.backup.backup_dir)
+    forecaster = _forecaster(cfg, backup_dir, Database(backup_dir / "app.sqlite3"))
+    check = forecaster.preflight(cfg.backup.compress != "none" or cfg.backup.encrypt)
+    fc = forecaster.forecast()
+    if args.json:
+        print(json.dumps({"forecast": fc.as_dict() if fc else None, "fits": check.ok,
+                          "needed_bytes": check.needed_bytes, "free_bytes": check.free_bytes}, indent=2))
+        return EXIT_OK if check.ok else EXIT_FAILED
+    if fc is None:
+        print("Not enough history: the forecast needs at least 3 OK backups")
+        return EXIT_OK
+    mb = 1024 * 1024
+    print(f"History:        {fc.history} OK backups, one every {fc.interval_sec / 3600:.1f}h")
+    print(f"Next backup:    ~{fc.next_at:%Y-%m-%d %H:%M}")
+    if fc.raw_size_bytes:
+        print(f"  dump          {fc.raw_size_bytes / mb:.0f} MB (up to {fc.raw_size_upper_bytes / mb:.0f})")
+        print(f"  ratio         {fc.compression_ratio:.2f}")
+    print(f"  archive       {fc.size_bytes / mb:.0f} MB (up to {fc.size_upper_bytes / mb:.0f}), "
+          f"trend {fc.size_trend_bytes_per_day / mb:+.1f} MB/day")
+    if fc.duration_sec is not None:
+        print(f"  duration      {fc.duration_sec / 60:.1f} min")
+    if fc.disk_free_bytes is not None:
+        full = f"{fc.disk_full_at:%Y-%m-%d}" if fc.disk_full_at else f"not within {forecaster.horizon_days} days"
+        print(f"Disk:           {fc.disk_free_bytes / mb:.0f} MB free, full: {full}")
+    print(f"Pre-flight:     {'fits' if check.ok else 'DOES NOT FIT'} "
+          f"(needs {check.needed_bytes / mb:.0f} MB incl. {check.reserve_bytes / mb:.0f} MB reserve)")
+    return EXIT_OK if check.ok else EXIT_FAILED
+
+
+def cmd_migrate(cfg, args) -> int:
+    """One migration pass to backup.tier_dir (for setups without the daemon)"""
+    from .db import Database
+
+    backup_dir = Path(cfg.backup.backup_dir)
+    db = Database(backup_dir / "app.sqlite3")
+    migrator = _migrator(cfg, backup_dir, db, _logger(cfg, backup_dir))
+    if migrator is None:
+        print("backup.tier_dir is not set in config.yaml", file=sys.stderr)
+        return EXIT_USAGE
+    if args.dry_run:
+        mb = 1024 * 1024
+        due = migrator.plan()
+        for row in due:
+            print(f"#{row['id']:<6} {row['ts']}  {(row['size_bytes'] or 0) / mb:>10.1f} MB  {row['path']}")
+        print(f"{len(due)} archives ({sum(r['size_bytes'] or 0 for r in due) / mb:.1f} MB) due for {migrator.tier_dir}")
+        return EXIT_OK
+    result = migrator.run_once()
+    print(f"{result.moved} moved ({result.bytes / 2**20:.1f} MB), {result.failed} failed, "
+          f"{result.held} held, {result.seconds:.1f}s")
+    return EXIT_FAILED if result.failed else EXIT_OK
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(prog="main.py", description="OneC Backup Bot")
+    parser.add_argument("--config", type=Path, default=None, help="path to config.yaml")
+    sub = parser.add_subparsers(dest="command")
+
+    p = sub.add_parser("run", help="bot + API daemon (default)")
+    p.add_argument("--no-telegram", action="store_true", help="do not start the Telegram bot")
+    p.set_defaults(func=cmd_run)
+
+    p = sub.add_parser("serve-api", help="API/scheduler daemon without Telegram")
+    p.set_defaults(func=cmd_serve_api)
+
+    p = sub.add_parser("backup", help="run one backup and exit")
+    p.add_argument("--strict", action="store_true", help="exit 1 when skipped because nothing changed")
+    p.add_argument("--no-offsite", action="store_true", help="skip the Telegram offsite upload")
+    p.set_defaults(func=cmd_backup)
+
+    p = sub.add_parser("verify", help="check archives of recent successful backups")
+    p.add_argument("--id", type=int, default=None, help="verify one backup by id")
+    p.add_argument("--last", type=int, default=1, help="number of recent OK backups to check")
+    p.set_defaults(func=cmd_verify)
+
+    p = sub.add_parser("restore", help="decode an archive to .dt with its recorded codec")
+    p.add_argument("--id", type=int, required=True)
+    p.add_argument("--out", type=Path, default=None, help="target folder (default: <backup_dir>/restored)")
+    p.set_defaults(func=cmd_restore)
+
+    p = sub.add_parser("offsite-restore", help="rebuild an archive from its volumes in the Telegram chat")
+    src = p.add_mutually_exclusive_group(required=True)
+    src.add_argument("--id", type=int, help="backup id (volumes looked up in the catalog)")
+    src.add_argument("--manifest", type=Path, help="*.manifest.json saved from the chat (no catalog needed)")
+    p.add_argument("--out", type=Path, default=None, help="target folder (default: <backup_dir>/restored)")
+    p.set_defaults(func=cmd_offsite_restore)
+
+    p = sub.add_parser("reconcile", help="compare backup folders with the catalog")
+    p.add_argument("--repair", action="store_true", help="update the catalog and rewrite manifests")
+    p.add_argument("--checksums", action="store_true", help="also re-hash archives (reads every file)")
+    p.add_argument("--workers", type=int, default=16, help="parallel folder scans")
+    p.add_argument("--json", action="store_true")
+    p.set_defaults(func=cmd_reconcile)
+
+    p = sub.add_parser("migrate", help="move finished archives to backup.tier_dir")
+    p.add_argument("--dry-run", action="store_true", help="only list the archives that are due")
+    p.set_defaults(func=cmd_migrate)
+
+    p = sub.add_parser("autotune", help="benchmark codecs and levels on a recent dump")
+    p.add_argument("--file", type=Path, default=None, help=".dt to sample (default: newest in backup_dir)")
+    p.add_argument("--sample-mb", type=float, default=256.0)
+    p.add_argument("--min-speed-mb-s", type=float, default=50.0,
+                   help="slowest acceptable compression speed")
+    p.add_argument("--codecs", nargs="*", default=None, help="limit to these codecs")
+    p.add_argument("--write", action="store_true", help="store the choice in config.yaml")
+    p.set_defaults(func=cmd_autotune)
+
+    p = sub.add_parser("train-dict", help="train a zstd dictionary on recent dumps")
+    p.add_argument("--file", dest="files", type=Path, action="append", default=None)
+    p.add_argument("--dumps", type=int, default=5, help="number of recent .dt dumps to sample")
+    p.add_argument("--size-kb", type=int, default=110)
+    p.set_defaults(func=cmd_train_dict)
+
+    p = sub.add_parser("gen-key", help="print a new archive encryption key")
+    p.add_argument("--id", default=None, help="key id (default: kYYYYMMDD)")
+    p.set_defaults(func=cmd_gen_key)
+
+    p = sub.add_parser("io-bench", help="compare plain and page-cache-friendly archive I/O")
+    p.add_argument("--file", type=Path, default=None, help=".dt to compress (default: synthetic)")
+    p.add_argument("--size-mb", type=float, default=1024.0, help="size of the synthetic dump")
+    p.add_argument("--codec", default=None)
+    p.add_argument("--level", type=int, default=None)
+    p.add_argument("--hot-file", type=Path, default=None,
+                   help="file whose cache residency to watch (default: the base's 1Cv8.1CD)")
+    p.set_defaults(func=cmd_io_bench)
+
+    p = sub.add_parser("status", help="recent backups; exit 1 if RPO is breached")
+    p.add_argument("--limit", type=int, default=10)
+    p.add_argument("--json", action="store_true")
+    p.set_defaults(func=cmd_status)
+
+    p = sub.add_parser("resources", help="CPU, memory and disk profile of recent 1C dumps")
+    p.add_argument("--id", type=int, default=None, help="samples of one backup (CSV)")
+    p.add_argument("--limit", type=int, default=20)
+    p.add_argument("--base", default=None)
+    p.add_argument("--json", action="store_true")
+    p.set_defaults(func=cmd_resources)
+
+    p = sub.add_parser("forecast", help="next backup size/duration and disk-full date; exit 1 if it won't fit")
+    p.add_argument("--json", action="store_true", help="machine-readable output")
+    p.set_defaults(func=cmd_forecast)
+
+    p = sub.add_parser("fleet", help="fleet aggregator over fleet.nodes")
+    p.set_defaults(func=cmd_fleet)
+    return parser
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = build_parser()
+    args = parser.parse_args(argv)
+    if args.command is None:
+        args.func, args.no_telegram = cmd_run, False
+
+    from .config import load_config
+
+    try:
+        cfg = load_config(args.config)
+        if cfg.backup.encrypt:
+            _check_encryption(cfg)
+    except Exception as e:
+        print(f"Config error: {e}", file=sys.stderr)
+        return EXIT_USAGE
+    Path(cfg.backup.backup_dir).mkdir(parents=True, exist_ok=True)
+    return args.func(cfg, args)
@@ -0,0 +1,252 @@
+"""
+Pluggable metric collector registry
+Each collector declares its own interval, cost and timeout; the registry runs
+only the collectors that are due and merges their cached results into one
+snapshot, so cheap metrics can be sampled often without paying for the
+expensive ones every time.
+"""
+from __future__ import annotations
+
+import asyncio
+import math
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional
+
+from .tracing import get_tracer
+
+# Collector intervals (seconds)
+STATIC = math.inf  # collected once per process
+
+
+@dataclass
+class Collector:
+    name: str
+    func: Callable[[], Dict[str, Any]]
+    interval: float = 60.0
+    cost: str = "cheap"  # cheap|expensive
+    timeout: float = 5.0
+
+    # Runtime state
+    last_run: float = field(default=-math.inf, repr=False)
+    result: Optional[Dict[str, Any]] = field(default=None, repr=False)
+    in_flight: bool = field(default=False, repr=False)
+
+    def due(self, now: float) -> bool:
+        if self.in_flight:
+            return False
+        if self.result is None:
+            return True
+        return now - self.last_run >= self.interval
+
+    def next_due(self) -> float:
+        if self.result is None:
+            return -math.inf
+        return self.last_run + self.interval
+
+
+def _deep_merge(dst: Dict[str, Any], src: Dict[str, Any]):
+    for key, value in src.items():
+        if isinstance(value, dict) and isinstance(dst.get(key), dict):
+            _deep_merge(dst[key], value)
+        elif isinstance(value, dict):
+            dst[key] = dict(value)
+        else:
+            dst[key] = value
+
+
+def _parse_interval_overrides(raw: str) -> Dict[str, float]:
+    """Parse METRICS_COLLECTOR_INTERVALS, e.g. 'cpu=5,network_connections=300'"""
+    overrides = {}
+    for part in (raw or "").split(','):
+        if '=' not in part:
+            continue
+        name, value = part.split('=', 1)
+        try:
+            overrides[name.strip()] = float(value)
+        except ValueError:
+            continue
+    return overrides
+
+
+class CollectorRegistry:
+    """Thread-safe registry of collectors with cached, merged results"""
+
+    def __init__(self, logger=None, max_workers: int = 4):
+        self.logger = logger
+        self._collectors: Dict[str, Collector] = {}
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="collector")
+        self._overrides = _parse_interval_overrides(os.getenv("METRICS_COLLECTOR_INTERVALS", ""))
+
+    def register(self, name: str, func: Callable[[], Dict[str, Any]], *, interval: float = 60.0,
+                 cost: str = "cheap", timeout: float = 5.0) -> Collector:
+        collector = Collector(
+            name=name,
+            func=func,
+            interval=self._overrides.get(name, interval),
+            cost=cost,
+            timeout=timeout,
+        )
+        with self._lock:
+            self._collectors[name] = collector
+        return collector
+
+    def unregister(self, name: str):
+        with self._lock:
+            self._collectors.pop(name, None)
+
+    def collectors(self) -> List[Collector]:
+        with self._lock:
+            return list(self._collectors.values())
+
+    def _run_collector(self, collector: Collector):
+        try:
+            with get_tracer().span(f"collector.{collector.name}"):
+                result = collector.func()
+        except Exception as e:
+            result = None
+            if self.logger:
+                self.logger.warning(f"Collector '{collector.name}' failed: {e}")
+        with self._lock:
+            if isinstance(result, dict):
+                collector.result = result
+            elif collector.result is None:
+                collector.result = {}
+            collector.last_run = time.monotonic()
+            collector.in_flight = False
+
+    def collect_due(self, force: bool = False) -> List[str]:
+        """Run every due collector concurrently, waiting at most each one's timeout"""
+        now = time.monotonic()
+        started = []
+        with self._lock:
+            for collector in self._collectors.values():
+                if collector.in_flight or not (force or collector.due(now)):
+                    continue
+                collector.in_flight = True
+                started.append(collector)
+
+        futures = [(c, self._executor.submit(self._run_collector, c)) for c in started]
+
+        for collector, fut in futures:
+            remaining = collector.timeout - (time.monotonic() - now)
+            try:
+                fut.result(timeout=max(0.0, remaining))
+            except Exception:
+                if not fut.done() and self.logger:
+                    # Keep the stale value; the late result is stored when it arrives
+                    self.logger.warning(f"Collector '{collector.name}' exceeded {collector.timeout}s timeout")
+        return [c.name for c in started]
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Merge cached collector results into one metrics dict"""
+        now = datetime.now()
+        metrics: Dict[str, Any] = {
+            "timestamp": now.isoformat(),
+            "timestamp_unix": int(now.timestamp()),
+        }
+        with self._lock:
+            for collector in self._collectors.values():
+                if collector.result:
+                    _deep_merge(metrics, collector.result)
+        return metrics
+
+    def collect(self) -> Dict[str, Any]:
+        """Run due collectors, then return the merged snapshot"""
+        self.collect_due()
+        return self.snapshot()
+
+    def next_due_in(self) -> float:
+        """Seconds until the next collector becomes due"""
+        with self._lock:
+            pending = [c.next_due() for c in self._collectors.values() if not c.in_flight]
+        if not pending:
+            return 1.0
+        return max(0.0, min(pending) - time.monotonic())
+
+    async def run_scheduler(self, stop: asyncio.Event, min_sleep: float = 0.5):
+        """Keep collectors warm at their own cadence on an asyncio loop"""
+        while not stop.is_set():
+            try:
+                await asyncio.to_thread(self.collect_due)
+            except Exception as e:
+                if self.logger:
+                    self.logger.error(f"Collector scheduler error: {e}")
+            delay = max(min_sleep, self.next_due_in())
+            try:
+                await asyncio.wait_for(stop.wait(), timeout=min(delay, 3600))
+            except asyncio.TimeoutError:
+                pass
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False)
+
+
+def build_default_registry(backup_dir: Optional[Path] = None, logger=None) -> CollectorRegistry:
+    """Registry with the built-in system collectors"""
+    # Imported here to avoid a circular import with metrics_extended
+    from . import metrics_extended as mx
+    import platform
+
+    registry = CollectorRegistry(logger=logger)
+
+    def _cpu():
+        data = mx.get_cpu_detailed()
+        return {"cpu_percent": data.get("percent", 0), "cpu": data}
+
+    def _memory():
+        data = mx.get_memory_detailed()
+        return {"memory_percent": data.get("percent", 0), "memory": data}
+
+    def _disk():
+        data = mx.get_disk_detailed(backup_dir)
+        return {"disk_percent": data.get("backup_disk_percent", 0), "disk": data}
+
+    def _users():
+        users = mx.get_logged_in_users()
+        return {"logged_users": users, "logged_users_count": len(users)}
+
+    registry.register("system", lambda: {"system": mx.get_system_info()}, interval=STATIC)
+    registry.register("uptime", lambda: {"uptime_seconds": mx.get_system_uptime()}, interval=60)
+    registry.register("cpu", _cpu, interval=5)
+    registry.register("memory", _memory, interval=5)
+    registry.register("disk", _disk, interval=60, cost="expensive")
+    registry.register("disk_io", lambda: {"disk_io": mx.get_disk_io_stats()}, interval=5)
+    registry.register("network", lambda: {"network": mx.get_network_io()}, interval=5)
+    registry.register("network_connections",
+                      lambda: {"network": {"active_connections": mx.get_network_connections_count()}},
+                      interval=60, cost="expensive")
+    registry.register("processes", lambda: {"processes": mx.get_process_stats()}, interval=30, cost="expensive")
+    registry.register("users", _users, interval=30)
+
+    # RDP Sessions (Windows only)
+    if platform.system() == "Windows":
+        def _rdp():
+            sessions = mx.get_rdp_sessions()
+            return {"rdp_sessions": sessions, "rdp_active_count": len(sessions)}
+        registry.register("rdp", _rdp, interval=60, cost="expensive", timeout=10)
+
+    return registry
+
+
+_registries: Dict[str, CollectorRegistry] = {}
+_registries_lock = threading.Lock()
+
+
+def get_registry(backup_dir: Optional[Path] = None, logger=None) -> CollectorRegistry:
+    """Process-wide default registry per backup_dir"""
+    key = str(backup_dir) if backup_dir else ""
+    with _registries_lock:
+        registry = _registries.get(key)
+        if registry is None:
+            registry = build_default_registry(backup_dir, logger)
+            _registries[key] = registry
+        elif logger is not None and registry.logger is None:
+            registry.logger = logger
+        return registry
@@ -0,0 +1,443 @@
+"""
+Archive codecs
+Streaming compressors for the archive step: zip (deflate, default), zstd
+(optionally with a dictionary trained on previous dumps), lz4 for speed and
+xz for cold storage. zstd and lz4 are optional dependencies (`zstandard`,
+`lz4`). Every backup records a codec spec such as "zstd:9:dict=1234567" so
+the matching decoder (and dictionary) is used on restore. Any codec's output
+can additionally be sealed by the chunked encryption layer (encryption.py).
+"""
+from __future__ import annotations
+
+import io
+import lzma
+import random
+import time
+import zipfile
+from dataclasses import dataclass, replace
+from pathlib import Path
+from typing import BinaryIO, Callable, Dict, Iterator, List, Optional, Tuple
+
+from .encryption import EXTENSION as ENCRYPTED_SUFFIX
+from .encryption import DecryptingReader, DecryptionError, EncryptingWriter, KeyRing, is_encrypted
+from .fileio import IOOptions, open_input, open_output
+
+CHUNK_SIZE = 1024 * 1024
+DICT_DIR = "dicts"
+
+Progress = Optional[Callable[[int], None]]
+Seal = Optional[Tuple[str, bytes]]  # (key id, key) to encrypt the archive with
+
+
+@dataclass
+class CodecSpec:
+    name: str
+    level: int
+    dict_id: Optional[int] = None
+
+    def __str__(self) -> str:
+        spec = f"{self.name}:{self.level}"
+        if self.dict_id is not None:
+            spec += f":dict={self.dict_id}"
+        return spec
+
+    @classmethod
+    def parse(cls, text: Optional[str]) -> "CodecSpec":
+        """Parse a recorded spec such as "zstd:9:dict=123" """
+        parts = (text or "none").split(":")
+        dict_id = None
+        for extra in parts[2:]:
+            if extra.startswith("dict="):
+                dict_id = int(extra[5:])
+        return cls(name=parts[0], level=int(parts[1]) if len(parts) > 1 and parts[1] else 0, dict_id=dict_id)
+
+
+def _copy(fin: BinaryIO, fout, progress: Progress, chunk_size: int = CHUNK_SIZE):
+    # One reused buffer: no per-chunk allocation on multi-gigabyte dumps
+    buf = bytearray(chunk_size)
+    view = memoryview(buf)
+    done = 0
+    while True:
+        n = fin.readinto(buf)
+        if not n:
+            break
+        fout.write(view[:n])
+        done += n
+        if progress:
+            progress(done)
+
+
+def _sink(dst: Path, io_opts: Optional[IOOptions], seal: Seal) -> BinaryIO:
+    raw = open_output(dst, io_opts)
+    if seal is None:
+        return raw
+    return EncryptingWriter(raw, seal[0], seal[1])
+
+
+def _source(src: Path, io_opts: Optional[IOOptions], keyring: Optional[KeyRing]) -> BinaryIO:
+    if not is_encrypted(src):
+        return open_input(src, io_opts)
+    if keyring is None:
+        raise DecryptionError(f"{src.name} is encrypted but no keys are configured")
+    # Decryption seeks to the tail to find the last chunk: no O_DIRECT stream here
+    raw = open_input(src, replace(io_opts or IOOptions(), direct=False))
+    try:
+        return io.BufferedReader(DecryptingReader(raw, keyring), buffer_size=CHUNK_SIZE)
+    except Exception:
+        raw.close()
+        raise
+
+
+class _OwnedReader(io.RawIOBase):
+    """Decoded stream that also closes the file and container it reads through"""
+
+    def __init__(self, reader, *owned):
+        self._reader = reader
+        self._owned = owned
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, b) -> int:
+        return self._reader.readinto(b)
+
+    def close(self):
+        if not self.closed:
+            for obj in (self._reader, *self._owned):
+                obj.close()
+        super().close()
+
+
+class Codec:
+    name = "none"
+    extension = ""
+    levels: Tuple[int, ...] = (0,)
+    default_level = 0
+
+    def available(self) -> bool:
+        return True
+
+    def archive_path(self, src: Path) -> Path:
+        return src.with_name(src.name + self.extension)
+
+    def compress(self, src: Path, dst: Path, level: int, *, dictionary: Optional[bytes] = None,
+                 threads: int = 0, progress: Progress = None, io_opts: Optional[IOOptions] = None,
+                 seal: Seal = None):
+        raise NotImplementedError
+
+    def open_reader(self, src: Path, *, dictionary: Optional[bytes] = None,
+                    io_opts: Optional[IOOptions] = None, keyring: Optional[KeyRing] = None) -> BinaryIO:
+        """Readable stream of the original .dt bytes"""
+        raise NotImplementedError
+
+
+class StoreCodec(Codec):
+    """No compression: a plain copy, used when only encryption is wanted"""
+
+    def compress(self, src, dst, level, *, dictionary=None, threads=0, progress=None, io_opts=None,
+                 seal=None):
+        if dst == src:
+            raise ValueError("store codec needs a distinct output path")
+        with open_input(src, io_opts) as fin, _sink(dst, io_opts, seal) as fout:
+            _copy(fin, fout, progress)
+
+    def open_reader(self, src, *, dictionary=None, io_opts=None, keyring=None):
+        return _source(src, io_opts, keyring)
+
+
+class ZipCodec(Codec):
+    name = "zip"
+    extension = ".zip"
+    levels = (1, 3, 6, 9)
+    default_level = 6
+
+    def archive_path(self, src: Path) -> Path:
+        return src.with_suffix(".zip")
+
+    def compress(self, src, dst, level, *, dictionary=None, threads=0, progress=None, io_opts=None,
+                 seal=None):
+        with _sink(dst, io_opts, seal) as raw, \
+                zipfile.ZipFile(raw, 'w', compression=zipfile.ZIP_DEFLATED, compresslevel=level) as zf:
+            with open_input(src, io_opts) as fin, zf.open(src.name, 'w', force_zip64=True) as fout:
+                _copy(fin, fout, progress)
+
+    def open_reader(self, src, *, dictionary=None, io_opts=None, keyring=None):
+        # zipfile seeks in its source, so no O_DIRECT here
+        raw = _source(src, replace(io_opts or IOOptions(), direct=False), keyring)
+        zf = zipfile.ZipFile(raw)
+        names = zf.namelist()
+        if len(names) != 1:
+            zf.close()
+            raw.close()
+            raise ValueError(f"expected a single-entry zip, found {len(names)} entries")
+        return _OwnedReader(zf.open(names[0]), zf, raw)
+
+
+class ZstdCodec(Codec):
+    name = "zstd"
+    extension = ".zst"
+    levels = (1, 3, 6, 9, 12, 15, 19)
+    default_level = 9
+
+    def available(self) -> bool:
+        try:
+            import zstandard  # noqa: F401
+        except ImportError:
+            return False
+        return True
+
+    def compress(self, src, dst, level, *, dictionary=None, threads=0, progress=None, io_opts=None,
+                 seal=None):
+        import zstandard
+
+        dict_data = zstandard.ZstdCompressionDict(dictionary) if dictionary else None
+        cctx = zstandard.ZstdCompressor(level=level, dict_data=dict_data, write_checksum=True,
+                                        threads=threads or 0)
+        with open_input(src, io_opts) as fin, _sink(dst, io_opts, seal) as raw:
+            with cctx.stream_writer(raw, size=src.stat().st_size, closefd=False) as fout:
+                _copy(fin, fout, progress)
+
+    def open_reader(self, src, *, dictionary=None, io_opts=None, keyring=None):
+        import zstandard
+
+        dict_data = zstandard.ZstdCompressionDict(dictionary) if dictionary else None
+        dctx = zstandard.ZstdDecompressor(dict_data=dict_data)
+        return dctx.stream_reader(_source(src, io_opts, keyring), closefd=True)
+
+
+class Lz4Codec(Codec):
+    name = "lz4"
+    extension = ".lz4"
+    levels = (0, 3, 9)
+    default_level = 0
+
+    def available(self) -> bool:
+        try:
+            import lz4.frame  # noqa: F401
+        except ImportError:
+            return False
+        return True
+
+    def compress(self, src, dst, level, *, dictionary=None, threads=0, progress=None, io_opts=None,
+                 seal=None):
+        import lz4.frame
+
+        with open_input(src, io_opts) as fin, _sink(dst, io_opts, seal) as raw, \
+                lz4.frame.open(raw, 'wb', compression_level=level, content_checksum=True) as fout:
+            _copy(fin, fout, progress)
+
+    def open_reader(self, src, *, dictionary=None, io_opts=None, keyring=None):
+        import lz4.frame
+
+        raw = _source(src, io_opts, keyring)
+        return _OwnedReader(lz4.frame.open(raw, 'rb'), raw)
+
+
+class XzCodec(Codec):
+    name = "xz"
+    extension = ".xz"
+    levels = (1, 3, 6, 9)
+    default_level = 6
+
+    def compress(self, src, dst, level, *, dictionary=None, threads=0, progress=None, io_opts=None,
+                 seal=None):
+        with open_input(src, io_opts) as fin, _sink(dst, io_opts, seal) as raw, \
+                lzma.open(raw, 'wb', preset=level, check=lzma.CHECK_CRC64) as fout:
+            _copy(fin, fout, progress)
+
+    def open_reader(self, src, *, dictionary=None, io_opts=None, keyring=None):
+        raw = _source(src, io_opts, keyring)
+        return _OwnedReader(lzma.open(raw, 'rb'), raw)
+
+
+CODECS: Dict[str, Codec] = {c.name: c for c in (ZipCodec(), ZstdCodec(), Lz4Codec(), XzCodec())}
+STORE = StoreCodec()
+
+
+def get_codec(name: str) -> Codec:
+    if name == STORE.name:
+        return STORE
+    try:
+        return CODECS[name]
+    except KeyError:
+        raise ValueError(f"unknown codec {name!r} (expected one of: none, {', '.join(CODECS)})")
+
+
+def infer_spec(path: Optional[str]) -> CodecSpec:
+    """Codec of an archive recorded before codecs were stored (by extension)"""
+    name = Path(path or "")
+    if name.suffix.lower() == ENCRYPTED_SUFFIX:
+        name = name.with_suffix("")
+    suffix = name.suffix.lower()
+    for codec in CODECS.values():
+        if suffix == codec.extension:
+            return CodecSpec(codec.name, codec.default_level)
+    return CodecSpec("none", 0)
+
+
+# --- zstd dictionaries -----------------------------------------------------
+
+def dictionary_path(backup_dir: Path, dict_id: int) -> Path:
+    return Path(backup_dir) / DICT_DIR / f"zstd-{dict_id}.dict"
+
+
+def load_dictionary(backup_dir: Path, dict_id: int) -> bytes:
+    path = dictionary_path(backup_dir, dict_id)
+    if not path.is_file():
+        raise FileNotFoundError(f"zstd dictionary {dict_id} not found at {path}")
+    return path.read_bytes()
+
+
+def latest_dictionary(backup_dir: Path) -> Optional[Tuple[int, bytes]]:
+    folder = Path(backup_dir) / DICT_DIR
+    files = sorted(folder.glob("zstd-*.dict"), key=lambda p: p.stat().st_mtime, reverse=True)
+    if not files:
+        return None
+    return int(files[0].stem.split("-", 1)[1]), files[0].read_bytes()
+
+
+def sample_chunks(paths: List[Path], count: int, size: int, seed: int = 0) -> Iterator[bytes]:
+    """Chunks from evenly spread offsets of the given files (for training and autotune)"""
+    rng = random.Random(seed)
+    paths = [p for p in paths if p.is_file() and p.stat().st_size > 0]
+    if not paths:
+        return
+    per_file = max(1, count // len(paths))
+    for path in paths:
+        total = path.stat().st_size
+        with open(path, 'rb') as f:
+            for i in range(per_file):
+                span = max(0, total - size)
+                offset = int(span * (i + rng.random()) / per_file) if span else 0
+                f.seek(offset)
+                chunk = f.read(size)
+                if chunk:
+                    yield chunk
+
+
+def train_dictionary(backup_dir: Path, dumps: List[Path], dict_size: int = 112640,
+                     samples: int = 2000, sample_size: int = 16 * 1024) -> Tuple[int, Path]:
+    """Train a zstd dictionary on previous dumps; dictionaries are never overwritten"""
+    import zstandard
+
+    chunks = list(sample_chunks(dumps, samples, sample_size))
+    if len(chunks) < 8:
+        raise ValueError("not enough sample data to train a dictionary")
+    trained = zstandard.train_dictionary(dict_size, chunks)
+    dict_id = trained.dict_id()
+    path = dictionary_path(backup_dir, dict_id)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    if not path.exists():
+        path.write_bytes(trained.as_bytes())
+    return dict_id, path
+
+
+# --- decoding --------------------------------------------------------------
+
+def open_archive(path: Path, spec: CodecSpec, backup_dir: Path, io_opts: Optional[IOOptions] = None,
+                 keyring: Optional[KeyRing] = None) -> BinaryIO:
+    dictionary = load_dictionary(backup_dir, spec.dict_id) if spec.dict_id is not None else None
+    return get_codec(spec.name).open_reader(path, dictionary=dictionary, io_opts=io_opts, keyring=keyring)
+
+
+def decompress_archive(path: Path, spec: CodecSpec, backup_dir: Path, dst: Optional[Path],
+                       io_opts: Optional[IOOptions] = None, keyring: Optional[KeyRing] = None) -> int:
+    """Decode to dst (or just read through, verifying checksums, when dst is None); returns raw bytes"""
+    total = 0
+    with open_archive(path, spec, backup_dir, io_opts, keyring) as reader:
+        out = open_output(dst, io_opts) if dst is not None else None
+        try:
+            while True:
+                chunk = reader.read(CHUNK_SIZE)
+                if not chunk:
+                    break
+                total += len(chunk)
+                if out is not None:
+                    out.write(chunk)
+        finally:
+            if out is not None:
+                out.close()
+    return total
+
+
+# --- autotune --------------------------------------------------------------
+
+@dataclass
+class TuneResult:
+    codec: str
+    level: int
+    dictionary: bool
+    ratio: float
+    compress_mb_s: float
+    decompress_mb_s: float
+
+    @property
+    def spec(self) -> str:
+        return f"{self.codec}:{self.level}" + (":dict" if self.dictionary else "")
+
+
+def _bench_one(codec: Codec, level: int, sample: Path, work: Path, dictionary: Optional[bytes]) -> TuneResult:
+    dst = work / f"bench{codec.extension or '.raw'}"
+    raw = sample.stat().st_size
+    started = time.perf_counter()
+    codec.compress(sample, dst, level, dictionary=dictionary)
+    c_sec = max(time.perf_counter() - started, 1e-9)
+    started = time.perf_counter()
+    with codec.open_reader(dst, dictionary=dictionary) as reader:
+        while reader.read(CHUNK_SIZE):
+            pass
+    d_sec = max(time.perf_counter() - started, 1e-9)
+    size = dst.stat().st_size
+    dst.unlink()
+    return TuneResult(codec.name, level, dictionary is not None, raw / max(size, 1),
+                      raw / c_sec / 1e6, raw / d_sec / 1e6)
+
+
+def autotune(sample: Path, work: Path, dictionary: Optional[bytes] = None,
+             codecs: Optional[List[str]] = None, log: Optional[Callable[[str], None]] = None) -> List[TuneResult]:
+    results = []
+    for codec in CODECS.values():
+        if codecs and codec.name not in codecs:
+            continue
+        if not codec.available():
+            if log:
+                log(f"{codec.name}: not installed, skipped")
+            continue
+        variants = [None, dictionary] if (codec.name == "zstd" and dictionary) else [None]
+        for level in codec.levels:
+            for d in variants:
+                r = _bench_one(codec, level, sample, work, d)
+                results.append(r)
+                if log:
+                    log(f"{r.spec:<14} ratio {r.ratio:6.2f}  compress {r.compress_mb_s:8.1f} MB/s  "
+                        f"decompress {r.decompress_mb_s:8.1f} MB/s")
+    return results
+
+
+def pareto_front(results: List[TuneResult]) -> List[TuneResult]:
+    """Results not beaten on both ratio and compression speed, fastest first"""
+    front = [r for r in results
+             if not any(o.ratio >= r.ratio and o.compress_mb_s >= r.compress_mb_s
+                        and (o.ratio > r.ratio or o.compress_mb_s > r.compress_mb_s) for o in results)]
+    return sorted(front, key=lambda r: -r.compress_mb_s)
+
+
+def pick_best(results: List[TuneResult], min_mb_s: float) -> Optional[TuneResult]:
+    """Best ratio on the Pareto front that still compresses at least min_mb_s"""
+    front = pareto_front(results)
+    fast_enough = [r for r in front if r.compress_mb_s >= min_mb_s]
+    if fast_enough:
+        return max(fast_enough, key=lambda r: r.ratio)
+    return front[0] if front else None
+
+
+def write_sample(paths: List[Path], dst: Path, sample_mb: float, chunk_mb: float = 4.0) -> int:
+    """Concatenate chunks spread across the dumps into one sample file"""
+    chunk = int(chunk_mb * 1024 * 1024)
+    count = max(1, int(sample_mb / chunk_mb))
+    written = 0
+    with open(dst, 'wb') as out:
+        for data in sample_chunks(paths, count, chunk):
+            out.write(data)
+            written += len(data)
+    return written
@@ -1,9 +1,10 @@
 from __future__ import annotations
 
+import json
 import os
 from pathlib import Path
 from dataclasses import dataclass, field
-from typing import List, Optional
+from typing import Any, List, Optional
 
 import yaml
 from dotenv import load_dotenv
@@ -33,15 +34,51 @@ class BackupConfig:
     backup_dir: str = r"D:\\1C_Backups"
     log_file: str = "backup.log"
     file_prefix: str = "Zernosbyt_"
-    compress: str = "none"  # none|zip
-    compress_level: int = 6  # 0-9 for zip
+    compress: str = "none"  # none|zip|zstd|lz4|xz
+    compress_level: int = 6  # codec level: zip/xz 0-9, zstd 1-22, lz4 0-16
+    compress_threads: int = 0  # zstd worker threads (0 = single-threaded)
+    zstd_dict: bool = False  # use the newest trained dictionary (cli train-dict)
     delete_dt_after_compress: bool = False
+    io_buffer_mb: float = 8.0  # read/write buffer for dump and archive streams
+    drop_cache: bool = True  # keep the dump out of the page cache (posix_fadvise)
+    preallocate_mb: float = 64.0  # archive grows in preallocated extents (0 = off)
+    direct_io: bool = False  # read the dump with O_DIRECT (Linux)
+    encrypt: bool = False  # seal archives with AES-256-GCM (needs `cryptography`)
+    encryption_key_id: str = ""  # key for new archives (default: the first configured)
+    encryption_keys_file: str = ""  # "id key" per line
+    encryption_keys: str = ""  # "id:key,id:key", only from env BACKUP_ENCRYPTION_KEYS
+    rpo_hours: float = 24.0  # max acceptable age of the last OK backup
+    resource_sample_sec: float = 1.0  # psutil sampling of the 1C dump process tree (0 = off)
+    retention_days: float = 0.0  # archives are pruned after this many days by an outside job (0 = kept)
+    forecast_window: int = 60  # recent OK backups the trends are fitted on
+    preflight: str = "refuse"  # off|warn|refuse|relocate when the next backup is predicted not to fit
+    free_space_reserve_mb: float = 1024.0  # space kept free on the backup disk
+    spool_dir: str = ""  # relocate: write the .dt here and only the archive to backup_dir
+    tier_dir: str = ""  # slow tier (NAS) finished archives are moved to from backup_dir ("" = single tier)
+    tier_min_age_hours: float = 0.0  # archives stay in backup_dir at least this long
+    tier_min_free_mb: float = 0.0  # below this free space in backup_dir the oldest move regardless of age
+    tier_rate_mb_s: float = 0.0  # migration bandwidth cap, MB/s (0 = unlimited)
+    tier_interval_sec: float = 300.0  # how often the migrator looks for archives to move
+
+
+@dataclass
+class LoggingConfig:
+    max_mb: float = 10.0  # rotate when the log reaches this size
+    daily: bool = True  # also rotate at midnight
+    backup_count: int = 14  # rotated segments to keep
+    compress: bool = True  # gzip rotated segments in the background
+    json_lines: bool = False  # structured JSON lines instead of text
 
 
 @dataclass
 class TelegramConfig:
     bot_token: str = ""
     broadcast_chat_id: str = ""
+    offsite_upload: bool = False  # ship finished archives to broadcast_chat_id
+    api_base: str = "https://api.telegram.org"  # or a local Bot API server
+    volume_mb: float = 19.0  # <= 20 so the cloud Bot API can hand volumes back
+    upload_concurrency: int = 3
+    upload_rate_per_min: float = 20.0  # group chats allow ~20 messages per minute
 
 
 @dataclass
@@ -49,6 +86,43 @@ class ApiConfig:
     host: str = "0.0.0.0"
     port: int = 8080
     token: str = ""
+    max_downloads: int = 2  # concurrent archive downloads
+    download_rate_mb_s: float = 0.0  # per-client bandwidth limit, MB/s (0 = unlimited, zero-copy)
+    workers: int = 0  # worker processes sharing port via SO_REUSEPORT (0 = serve from the bot process)
+    control_port: int = 0  # bot's own API when workers > 0 (0 = port + 1)
+    snapshot_sec: float = 5.0  # how often the bot publishes metrics for the workers
+
+
+@dataclass
+class ScheduleConfig:
+    enabled: bool = False
+    jobs: List[Any] = field(default_factory=list)  # cron strings or {cron, base, jitter_sec, deadline_min}
+    jitter_sec: float = 300.0  # random delay added to every run
+    deadline_min: float = 120.0  # run anyway this long after the slot, even if busy
+    catch_up: bool = True  # run once at startup if a slot was missed while down
+    max_cpu_percent: float = 70.0
+    max_mem_percent: float = 90.0
+    max_disk_percent: float = 100.0  # backup_dir volume usage (100 = ignore)
+    max_onec_clients: int = -1  # defer while more local 1C clients of the base run (-1 = ignore)
+    check_interval_sec: float = 60.0
+
+
+@dataclass
+class AlertsConfig:
+    enabled: bool = True
+    rules: List[Any] = field(default_factory=list)  # {name, metric, op, threshold|ref+factor, clear, for_sec, ...}
+    repeat_min: float = 240.0  # remind about a still-firing alert (0 = never)
+    rate_per_min: float = 6.0  # Telegram messages per minute to broadcast_chat_id
+    group_wait_sec: float = 10.0  # collect a burst of transitions into one message
+
+
+@dataclass
+class FleetConfig:
+    enabled: bool = False  # run as fleet aggregator instead of the bot
+    nodes: List[Any] = field(default_factory=list)  # URLs or {name, url, token}
+    interval: float = 30.0
+    timeout: float = 5.0
+    concurrency: int = 100
 
 
 @dataclass
@@ -57,8 +131,47 @@ class Config:
     security: SecurityConfig = field(default_factory=SecurityConfig)
     onec: OneCConfig = field(default_factory=OneCConfig)
     backup: BackupConfig = field(default_factory=BackupConfig)
+    logging: LoggingConfig = field(default_factory=LoggingConfig)
     telegram: TelegramConfig = field(default_factory=TelegramConfig)
     api: ApiConfig = field(default_factory=ApiConfig)
+    schedule: ScheduleConfig = field(default_factory=ScheduleConfig)
+    fleet: FleetConfig = field(default_factory=FleetConfig)
+    alerts: AlertsConfig = field(default_factory=AlertsConfig)
+
+
+DEFAULT_CONFIG_PATH = Path(__file__).resolve().parent.parent / "config.yaml"
+
+
+def update_config_values(config_path: Path, section: str, values: dict):
+    """Rewrite `key: value` lines of a top-level section in place, keeping comments and layout"""
+    lines = config_path.read_text(encoding="utf-8").splitlines(keepends=True)
+    if lines and not lines[-1].endswith("\n"):
+        lines[-1] += "\n"
+    pending = dict(values)
+    found = in_section = False
+    insert_at = len(lines)
+    for i, line in enumerate(lines):
+        stripped = line.strip()
+        if not stripped or stripped.startswith("#"):
+            continue
+        if not line[0].isspace():
+            if in_section:
+                break
+            in_section = found = stripped == f"{section}:"
+            insert_at = i + 1 if found else insert_at
+            continue
+        if in_section:
+            insert_at = i + 1
+        key = stripped.split(":", 1)[0].strip()
+        if in_section and key in pending:
+            indent = line[:len(line) - len(line.lstrip())]
+            lines[i] = f"{indent}{key}: {json.dumps(pending.pop(key), ensure_ascii=False)}\n"
+    if pending:
+        new = [f"  {k}: {json.dumps(v, ensure_ascii=False)}\n" for k, v in pending.items()]
+        if not found:
+            new.insert(0, f"\n{section}:\n")
+        lines[insert_at:insert_at] = new
+    config_path.write_text("".join(lines), encoding="utf-8")
 
 
 def load_config(config_path: Optional[Path] = None) -> Config:
@@ -68,7 +181,7 @@ def load_config(config_path: Optional[Path] = None) -> Config:
     # Load YAML
     data = {}
     if config_path is None:
-        config_path = Path(__file__).resolve().parent.parent / "config.yaml"
+        config_path = DEFAULT_CONFIG_PATH
     if config_path.exists():
         with open(config_path, "r", encoding="utf-8") as f:
             data = yaml.safe_load(f) or {}
@@ -102,16 +215,82 @@ def load_config(config_path: Optional[Path] = None) -> Config:
             file_prefix=_get("backup.file_prefix", BackupConfig.file_prefix),
             compress=str(_get("backup.compress", BackupConfig.compress)).lower(),
             compress_level=int(_get("backup.compress_level", BackupConfig.compress_level)),
+            compress_threads=int(_get("backup.compress_threads", BackupConfig.compress_threads)),
+            zstd_dict=bool(_get("backup.zstd_dict", BackupConfig.zstd_dict)),
             delete_dt_after_compress=bool(_get("backup.delete_dt_after_compress", BackupConfig.delete_dt_after_compress)),
+            io_buffer_mb=float(_get("backup.io_buffer_mb", BackupConfig.io_buffer_mb)),
+            drop_cache=bool(_get("backup.drop_cache", BackupConfig.drop_cache)),
+            preallocate_mb=float(_get("backup.preallocate_mb", BackupConfig.preallocate_mb)),
+            direct_io=bool(_get("backup.direct_io", BackupConfig.direct_io)),
+            encrypt=str(os.getenv("BACKUP_ENCRYPT", _get("backup.encrypt", False))).lower() in ("1", "true", "yes"),
+            encryption_key_id=os.getenv("BACKUP_ENCRYPTION_KEY_ID",
+                                        _get("backup.encryption_key_id", BackupConfig.encryption_key_id)) or "",
+            encryption_keys_file=_get("backup.encryption_keys_file", BackupConfig.encryption_keys_file) or "",
+            encryption_keys=os.getenv("BACKUP_ENCRYPTION_KEYS", ""),
+            rpo_hours=float(_get("backup.rpo_hours", BackupConfig.rpo_hours)),
+            resource_sample_sec=float(_get("backup.resource_sample_sec", BackupConfig.resource_sample_sec)),
+            retention_days=float(_get("backup.retention_days", BackupConfig.retention_days)),
+            forecast_window=int(_get("backup.forecast_window", BackupConfig.forecast_window)),
+            preflight=str(_get("backup.preflight", BackupConfig.preflight)).lower(),
+            free_space_reserve_mb=float(_get("backup.free_space_reserve_mb", BackupConfig.free_space_reserve_mb)),
+            spool_dir=_get("backup.spool_dir", BackupConfig.spool_dir) or "",
+            tier_dir=os.getenv("BACKUP_TIER_DIR", _get("backup.tier_dir", BackupConfig.tier_dir)) or "",
+            tier_min_age_hours=float(_get("backup.tier_min_age_hours", BackupConfig.tier_min_age_hours)),
+            tier_min_free_mb=float(_get("backup.tier_min_free_mb", BackupConfig.tier_min_free_mb)),
+            tier_rate_mb_s=float(_get("backup.tier_rate_mb_s", BackupConfig.tier_rate_mb_s)),
+            tier_interval_sec=float(_get("backup.tier_interval_sec", BackupConfig.tier_interval_sec)),
+        ),
+        logging=LoggingConfig(
+            max_mb=float(_get("logging.max_mb", LoggingConfig.max_mb)),
+            daily=bool(_get("logging.daily", LoggingConfig.daily)),
+            backup_count=int(_get("logging.backup_count", LoggingConfig.backup_count)),
+            compress=bool(_get("logging.compress", LoggingConfig.compress)),
+            json_lines=str(os.getenv("LOG_JSON", _get("logging.json_lines", False))).lower() in ("1", "true", "yes"),
         ),
         telegram=TelegramConfig(
             bot_token=os.getenv("BOT_TOKEN", _get("telegram.bot_token", "")),
-            broadcast_chat_id=_get("telegram.broadcast_chat_id", ""),
+            broadcast_chat_id=str(_get("telegram.broadcast_chat_id", "") or ""),
+            offsite_upload=bool(_get("telegram.offsite_upload", TelegramConfig.offsite_upload)),
+            api_base=os.getenv("TELEGRAM_API_BASE", _get("telegram.api_base", TelegramConfig.api_base)),
+            volume_mb=float(_get("telegram.volume_mb", TelegramConfig.volume_mb)),
+            upload_concurrency=int(_get("telegram.upload_concurrency", TelegramConfig.upload_concurrency)),
+            upload_rate_per_min=float(_get("telegram.upload_rate_per_min", TelegramConfig.upload_rate_per_min)),
         ),
         api=ApiConfig(
             host=os.getenv("API_HOST", _get("api.host", ApiConfig.host)),
             port=int(os.getenv("API_PORT", _get("api.port", ApiConfig.port))),
             token=os.getenv("API_TOKEN", _get("api.token", ApiConfig.token)),
+            max_downloads=int(_get("api.max_downloads", ApiConfig.max_downloads)),
+            download_rate_mb_s=float(_get("api.download_rate_mb_s", ApiConfig.download_rate_mb_s)),
+            workers=int(os.getenv("API_WORKERS", _get("api.workers", ApiConfig.workers))),
+            control_port=int(_get("api.control_port", ApiConfig.control_port)),
+            snapshot_sec=float(_get("api.snapshot_sec", ApiConfig.snapshot_sec)),
+        ),
+        schedule=ScheduleConfig(
+            enabled=bool(_get("schedule.enabled", ScheduleConfig.enabled)),
+            jobs=_get("schedule.jobs", []) or [],
+            jitter_sec=float(_get("schedule.jitter_sec", ScheduleConfig.jitter_sec)),
+            deadline_min=float(_get("schedule.deadline_min", ScheduleConfig.deadline_min)),
+            catch_up=bool(_get("schedule.catch_up", ScheduleConfig.catch_up)),
+            max_cpu_percent=float(_get("schedule.max_cpu_percent", ScheduleConfig.max_cpu_percent)),
+            max_mem_percent=float(_get("schedule.max_mem_percent", ScheduleConfig.max_mem_percent)),
+            max_disk_percent=float(_get("schedule.max_disk_percent", ScheduleConfig.max_disk_percent)),
+            max_onec_clients=int(_get("schedule.max_onec_clients", ScheduleConfig.max_onec_clients)),
+            check_interval_sec=float(_get("schedule.check_interval_sec", ScheduleConfig.check_interval_sec)),
+        ),
+        fleet=FleetConfig(
+            enabled=str(os.getenv("FLEET_MODE", _get("fleet.enabled", False))).lower() in ("1", "true", "yes"),
+            nodes=_get("fleet.nodes", []) or [],
+            interval=float(_get("fleet.interval", FleetConfig.interval)),
+            timeout=float(_get("fleet.timeout", FleetConfig.timeout)),
+            concurrency=int(_get("fleet.concurrency", FleetConfig.concurrency)),
+        ),
+        alerts=AlertsConfig(
+            enabled=bool(_get("alerts.enabled", AlertsConfig.enabled)),
+            rules=_get("alerts.rules", []) or [],
+            repeat_min=float(_get("alerts.repeat_min", AlertsConfig.repeat_min)),
+            rate_per_min=float(_get("alerts.rate_per_min", AlertsConfig.rate_per_min)),
+            group_wait_sec=float(_get("alerts.group_wait_sec", AlertsConfig.group_wait_sec)),
         ),
     )
 
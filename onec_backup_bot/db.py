@@ -1,62 +1,548 @@
 from __future__ import annotations
 
+import json
+import queue
 import sqlite3
+import threading
+import time
+from contextlib import contextmanager
 from pathlib import Path
-from typing import Optional, Iterable
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Tuple
 import datetime as dt
 
+
+def _migration_1(c: sqlite3.Cursor):
+    c.execute(
+        """
+        CREATE TABLE IF NOT EXISTS backups (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            ts TEXT NOT NULL,
+            path TEXT,
+            status TEXT NOT NULL,
+            size_bytes INTEGER,
+            duration_sec REAL,
+            rc INTEGER,
+            stderr TEXT,
+            fingerprint TEXT
+        )
+        """
+    )
+    c.execute(
+        """
+        CREATE TABLE IF NOT EXISTS metrics (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            ts TEXT NOT NULL,
+            cpu_percent REAL,
+            mem_percent REAL,
+            disk_percent REAL
+        )
+        """
+    )
+
+
+def _add_columns(c: sqlite3.Cursor, table: str, columns):
+    existing = {r[1] for r in c.execute(f"PRAGMA table_info({table})").fetchall()}
+    for name, decl in columns:
+        if name not in existing:
+            c.execute(f"ALTER TABLE {table} ADD COLUMN {name} {decl}")
+
+
+def _migration_2(c: sqlite3.Cursor):
+    # raw dump size / dump phase duration for backup histograms
+    _add_columns(c, "backups", (("raw_size_bytes", "INTEGER"), ("dump_duration_sec", "REAL")))
+
+
+def _migration_3(c: sqlite3.Cursor):
+    # last_success: newest row per status via (status, rowid)
+    c.execute("CREATE INDEX IF NOT EXISTS idx_backups_status ON backups(status)")
+    # last_fingerprint: partial covering index ordered by id
+    c.execute(
+        "CREATE INDEX IF NOT EXISTS idx_backups_fingerprint ON backups(id, fingerprint) "
+        "WHERE fingerprint IS NOT NULL AND status IN ('OK','SKIP')"
+    )
+    # time-range queries
+    c.execute("CREATE INDEX IF NOT EXISTS idx_backups_ts ON backups(ts)")
+
+
+def _migration_4(c: sqlite3.Cursor):
+    # base name for multi-base catalogs, size index for "largest archives"
+    _add_columns(c, "backups", (("base", "TEXT"),))
+    c.execute("CREATE INDEX IF NOT EXISTS idx_backups_size ON backups(size_bytes)")
+    # per-day summary maintained incrementally by trigger
+    c.execute(
+        """
+        CREATE TABLE IF NOT EXISTS backup_daily (
+            day TEXT NOT NULL,
+            base TEXT NOT NULL DEFAULT '',
+            status TEXT NOT NULL,
+            count INTEGER NOT NULL DEFAULT 0,
+            bytes INTEGER NOT NULL DEFAULT 0,
+            max_size_bytes INTEGER NOT NULL DEFAULT 0,
+            duration_sec REAL NOT NULL DEFAULT 0,
+            PRIMARY KEY (day, base, status)
+        ) WITHOUT ROWID
+        """
+    )
+    c.execute(
+        """
+        CREATE TRIGGER IF NOT EXISTS trg_backups_daily AFTER INSERT ON backups
+        BEGIN
+            INSERT INTO backup_daily(day, base, status, count, bytes, max_size_bytes, duration_sec)
+            VALUES (substr(NEW.ts, 1, 10), COALESCE(NEW.base, ''), NEW.status, 1,
+                    COALESCE(NEW.size_bytes, 0), COALESCE(NEW.size_bytes, 0), COALESCE(NEW.duration_sec, 0))
+            ON CONFLICT(day, base, status) DO UPDATE SET
+                count = count + 1,
+                bytes = bytes + excluded.bytes,
+                max_size_bytes = max(max_size_bytes, excluded.max_size_bytes),
+                duration_sec = duration_sec + excluded.duration_sec;
+        END
+        """
+    )
+    _rebuild_backup_daily(c)
+
+
+def _rebuild_backup_daily(c: sqlite3.Cursor):
+    # backfill from existing history
+    c.execute("DELETE FROM backup_daily")
+    c.execute(
+        """
+        INSERT INTO backup_daily(day, base, status, count, bytes, max_size_bytes, duration_sec)
+        SELECT substr(ts, 1, 10), COALESCE(base, ''), status, COUNT(*),
+               COALESCE(SUM(size_bytes), 0), COALESCE(MAX(size_bytes), 0), COALESCE(SUM(duration_sec), 0)
+        FROM backups GROUP BY 1, 2, 3
+        """
+    )
+
+
+def _migration_5(c: sqlite3.Cursor):
+    # offsite copies in a Telegram chat: one row per upload, one per volume
+    c.execute(
+        """
+        CREATE TABLE IF NOT EXISTS offsite_uploads (
+            backup_id INTEGER PRIMARY KEY,
+            chat_id TEXT NOT NULL,
+            file_name TEXT NOT NULL,
+            parts INTEGER NOT NULL,
+            size_bytes INTEGER NOT NULL,
+            sha256 TEXT,
+            status TEXT NOT NULL,
+            manifest_message_id INTEGER,
+            started_at TEXT NOT NULL,
+            finished_at TEXT
+        )
+        """
+    )
+    c.execute(
+        """
+        CREATE TABLE IF NOT EXISTS offsite_parts (
+            backup_id INTEGER NOT NULL,
+            part INTEGER NOT NULL,
+            message_id INTEGER NOT NULL,
+            file_id TEXT NOT NULL,
+            offset INTEGER NOT NULL,
+            size_bytes INTEGER NOT NULL,
+            sha256 TEXT NOT NULL,
+            uploaded_at TEXT NOT NULL,
+            PRIMARY KEY (backup_id, part)
+        ) WITHOUT ROWID
+        """
+    )
+
+
+def _migration_6(c: sqlite3.Cursor):
+    # last fire time per scheduler job, for missed-run catch-up
+    c.execute(
+        """
+        CREATE TABLE IF NOT EXISTS schedule_state (
+            job TEXT PRIMARY KEY,
+            last_fire TEXT NOT NULL
+        ) WITHOUT ROWID
+        """
+    )
+
+
+def _migration_7(c: sqlite3.Cursor):
+    # codec spec of the archive ("zstd:9:dict=123", "zip:6", "none") for restores
+    _add_columns(c, "backups", (("codec", "TEXT"),))
+
+
+def _migration_8(c: sqlite3.Cursor):
+    # ID of the key an archive is encrypted with (NULL = plaintext)
+    _add_columns(c, "backups", (("key_id", "TEXT"),))
+
+
+def _migration_9(c: sqlite3.Cursor):
+    # archive checksum, mirrored in the per-date manifest.json for reconciliation
+    _add_columns(c, "backups", (("sha256", "TEXT"),))
+
+
+def _migration_10(c: sqlite3.Cursor):
+    # seconds per make_backup phase as compact JSON ({"dump": 812.4, "compress": 95.1, ...})
+    _add_columns(c, "backups", (("phases", "TEXT"),))
+
+
+def _migration_11(c: sqlite3.Cursor):
+    # psutil profile of the 1C dump process tree: zlib-packed samples plus peaks for queries
+    c.execute(
+        """
+        CREATE TABLE IF NOT EXISTS backup_resources (
+            backup_id INTEGER PRIMARY KEY,
+            interval_sec REAL NOT NULL,
+            samples INTEGER NOT NULL,
+            mem_total_bytes INTEGER,
+            data BLOB,
+            peak_cpu_percent REAL,
+            mean_cpu_percent REAL,
+            peak_rss_bytes INTEGER,
+            read_bytes INTEGER,
+            write_bytes INTEGER,
+            peak_read_bps REAL,
+            peak_write_bps REAL,
+            peak_read_iops REAL,
+            peak_write_iops REAL,
+            bottleneck TEXT
+        )
+        """
+    )
+
+
+def _migration_12(c: sqlite3.Cursor):
+    # storage tier holding the archive ('fast' = backup_dir, 'slow' = tier_dir) and when it moved there
+    _add_columns(c, "backups", (("tier", "TEXT NOT NULL DEFAULT 'fast'"), ("migrated_at", "TEXT")))
+    # tier_candidates: OK archives still on the landing tier, oldest first
+    c.execute("CREATE INDEX IF NOT EXISTS idx_backups_fast_tier ON backups(id) WHERE status = 'OK' AND tier = 'fast'")
+
+
+def _migration_13(c: sqlite3.Cursor):
+    # reconcile flips OK <-> MISSING and fixes sizes with UPDATEs: move the row between daily buckets.
+    # The old bucket's max is recomputed over its day (idx_backups_ts); an emptied bucket is dropped.
+    c.execute(
+        """
+        CREATE TRIGGER IF NOT EXISTS trg_backups_daily_update AFTER UPDATE OF status, size_bytes ON backups
+        WHEN OLD.status IS NOT NEW.status OR OLD.size_bytes IS NOT NEW.size_bytes
+        BEGIN
+            UPDATE backup_daily SET
+                count = count - 1,
+                bytes = bytes - COALESCE(OLD.size_bytes, 0),
+                duration_sec = duration_sec - COALESCE(OLD.duration_sec, 0),
+                max_size_bytes = COALESCE((
+                    SELECT MAX(size_bytes) FROM backups
+                    WHERE ts >= substr(OLD.ts, 1, 10) AND ts < date(substr(OLD.ts, 1, 10), '+1 day')
+                      AND COALESCE(base, '') = COALESCE(OLD.base, '') AND status = OLD.status
+                      AND id != OLD.id
+                ), 0)
+            WHERE day = substr(OLD.ts, 1, 10) AND base = COALESCE(OLD.base, '') AND status = OLD.status;
+            DELETE FROM backup_daily
+            WHERE day = substr(OLD.ts, 1, 10) AND base = COALESCE(OLD.base, '') AND status = OLD.status
+              AND count <= 0;
+            INSERT INTO backup_daily(day, base, status, count, bytes, max_size_bytes, duration_sec)
+            VALUES (substr(NEW.ts, 1, 10), COALESCE(NEW.base, ''), NEW.status, 1,
+                    COALESCE(NEW.size_bytes, 0), COALESCE(NEW.size_bytes, 0), COALESCE(NEW.duration_sec, 0))
+            ON CONFLICT(day, base, status) DO UPDATE SET
+                count = count + 1,
+                bytes = bytes + excluded.bytes,
+                max_size_bytes = max(max_size_bytes, excluded.max_size_bytes),
+                duration_sec = duration_sec + excluded.duration_sec;
+        END
+        """
+    )
+    # summaries already skewed by earlier reconciles
+    _rebuild_backup_daily(c)
+
+
+# Ordered schema migrations; PRAGMA user_version records the last applied one
+MIGRATIONS: List[Callable[[sqlite3.Cursor], None]] = [
+    _migration_1,
+    _migration_2,
+    _migration_3,
+    _migration_4,
+    _migration_5,
+    _migration_6,
+    _migration_7,
+    _migration_8,
+    _migration_9,
+    _migration_10,
+    _migration_11,
+    _migration_12,
+    _migration_13,
+]
+
+RESOURCE_COLUMNS = ("interval_sec", "samples", "mem_total_bytes", "data", "peak_cpu_percent", "mean_cpu_percent",
+                    "peak_rss_bytes", "read_bytes", "write_bytes", "peak_read_bps", "peak_write_bps",
+                    "peak_read_iops", "peak_write_iops", "bottleneck")
+# Summary columns without the sample blob
+RESOURCE_SUMMARY = ", ".join(c for c in RESOURCE_COLUMNS if c != "data")
+
+# Catalog columns returned by list queries (stderr can be large)
+CATALOG_COLUMNS = "id, ts, base, path, status, size_bytes, raw_size_bytes, duration_sec, dump_duration_sec, rc, fingerprint, codec, key_id, sha256, phases, tier, migrated_at"
+
+
 class Database:
-    def __init__(self, db_path: Path):
+    def __init__(self, db_path: Path, pool_size: int = 4, synchronous: str = "NORMAL"):
         self.db_path = db_path
         self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        self.synchronous = synchronous
+        self._pool: "queue.LifoQueue[sqlite3.Connection]" = queue.LifoQueue()
+        self._pool_size = max(1, int(pool_size))
+        self._created = 0
+        self._pool_lock = threading.Lock()
+        # Bumped on every catalog write; read endpoints use it as a cache key
+        self.version = 0
+        self.version_changed_at = time.time()
+        # Dedicated connection whose PRAGMA data_version moves on commits by any other connection or process
+        self._probe: Optional[sqlite3.Connection] = None
+        self._probe_lock = threading.Lock()
+        self._data_version: Optional[int] = None
         self._init()
 
-    def _connect(self) -> sqlite3.Connection:
-        conn = sqlite3.connect(self.db_path)
+    def _bump_version(self):
+        with self._pool_lock:
+            self.version += 1
+            self.version_changed_at = time.time()
+
+    def poll_version(self) -> int:
+        """version, bumped first if anything (e.g. a CLI backup in another process) committed since the last poll"""
+        with self._probe_lock:
+            if self._probe is None:
+                self._probe = self._new_connection()
+            current = self._probe.execute("PRAGMA data_version").fetchone()[0]
+            if current != self._data_version:
+                if self._data_version is not None:
+                    self._bump_version()
+                self._data_version = current
+        return self.version
+
+    def _new_connection(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.db_path, timeout=30, check_same_thread=False, cached_statements=256)
         conn.row_factory = sqlite3.Row
+        # WAL lets readers (API, bot) proceed while the backup thread writes;
+        # NORMAL is durable across application crashes in WAL mode
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute(f"PRAGMA synchronous={self.synchronous}")
+        conn.execute("PRAGMA temp_store=MEMORY")
+        conn.execute("PRAGMA busy_timeout=30000")
         return conn
 
+    @contextmanager
+    def _connect(self) -> Iterator[sqlite3.Connection]:
+        """Check out a pooled connection; commits on success, rolls back on error"""
+        try:
+            conn = self._pool.get_nowait()
+        except queue.Empty:
+            with self._pool_lock:
+                can_create = self._created < self._pool_size
+                if can_create:
+                    self._created += 1
+            if can_create:
+                try:
+                    conn = self._new_connection()
+                except Exception:
+                    with self._pool_lock:
+                        self._created -= 1
+                    raise
+            else:
+                conn = self._pool.get()
+        try:
+            yield conn
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            self._pool.put(conn)
+
+    def close(self):
+        with self._probe_lock:
+            if self._probe is not None:
+                self._probe.close()
+                self._probe = None
+        while True:
+            try:
+                conn = self._pool.get_nowait()
+            except queue.Empty:
+                break
+            conn.close()
+            with self._pool_lock:
+                self._created -= 1
+
     def _init(self):
         with self._connect() as conn:
             c = conn.cursor()
-            c.execute(
-                """
-                CREATE TABLE IF NOT EXISTS backups (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    ts TEXT NOT NULL,
-                    path TEXT,
-                    status TEXT NOT NULL,
-                    size_bytes INTEGER,
-                    duration_sec REAL,
-                    rc INTEGER,
-                    stderr TEXT,
-                    fingerprint TEXT
-                )
-                """
-            )
-            # ensure metrics table
-            c.execute(
-                """
-                CREATE TABLE IF NOT EXISTS metrics (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    ts TEXT NOT NULL,
-                    cpu_percent REAL,
-                    mem_percent REAL,
-                    disk_percent REAL
-                )
-                """
-            )
+            version = c.execute("PRAGMA user_version").fetchone()[0]
+            for number, migration in enumerate(MIGRATIONS, start=1):
+                if number <= version:
+                    continue
+                migration(c)
+                c.execute(f"PRAGMA user_version={number}")
             conn.commit()
+            c.execute("PRAGMA optimize")
 
     def insert_backup(self, *, ts: dt.datetime, path: Optional[str], status: str,
                       size_bytes: Optional[int], duration_sec: Optional[float], rc: Optional[int], stderr: Optional[str],
-                      fingerprint: Optional[str] = None):
+                      fingerprint: Optional[str] = None, raw_size_bytes: Optional[int] = None,
+                      dump_duration_sec: Optional[float] = None, base: Optional[str] = None,
+                      codec: Optional[str] = None, key_id: Optional[str] = None,
+                      sha256: Optional[str] = None, phases: Optional[Dict[str, float]] = None,
+                      resources: Optional[Dict[str, Any]] = None) -> int:
+        """resources: ResourceProfile.row() of the dump, stored in the same transaction"""
+        phases_json = json.dumps({k: round(v, 3) for k, v in phases.items()}, separators=(",", ":")) if phases else None
         with self._connect() as conn:
-            conn.execute(
-                "INSERT INTO backups(ts, path, status, size_bytes, duration_sec, rc, stderr, fingerprint) VALUES(?,?,?,?,?,?,?,?)",
-                (ts.isoformat(timespec='seconds'), path, status, size_bytes, duration_sec, rc, stderr, fingerprint)
+            cur = conn.execute(
+                "INSERT INTO backups(ts, path, status, size_bytes, duration_sec, rc, stderr, fingerprint, raw_size_bytes, dump_duration_sec, base, codec, key_id, sha256, phases) "
+                "VALUES(?,?,?,?,?,?,?,?,?,?,?,?,?,?,?)",
+                (ts.isoformat(timespec='seconds'), path, status, size_bytes, duration_sec, rc, stderr, fingerprint,
+                 raw_size_bytes, dump_duration_sec, base, codec, key_id, sha256, phases_json)
             )
-            conn.commit()
+            backup_id = cur.lastrowid
+            if resources:
+                conn.execute(
+                    f"INSERT INTO backup_resources(backup_id, {', '.join(RESOURCE_COLUMNS)}) "
+                    f"VALUES(?, {', '.join('?' * len(RESOURCE_COLUMNS))})",
+                    (backup_id, *(resources.get(c) for c in RESOURCE_COLUMNS)))
+        self._bump_version()
+        return backup_id
+
+    def archive_rows(self) -> List[sqlite3.Row]:
+        """Every row that points at an archive (OK, or MISSING after reconciliation)"""
+        with self._connect() as conn:
+            return list(conn.execute(
+                f"SELECT {CATALOG_COLUMNS} FROM backups WHERE path IS NOT NULL AND status IN ('OK', 'MISSING') "
+                "ORDER BY id"
+            ).fetchall())
+
+    def failed_paths(self) -> List[str]:
+        """Paths recorded by rows that are not backups (ERR/EXC dumps): never adopted by reconcile"""
+        with self._connect() as conn:
+            return [r[0] for r in conn.execute(
+                "SELECT path FROM backups WHERE path IS NOT NULL AND status NOT IN ('OK', 'MISSING')"
+            ).fetchall()]
+
+    def apply_reconciliation(self, *, paths: Iterable[Tuple[int, str, str]] = (),
+                             statuses: Iterable[Tuple[int, str]] = (),
+                             inserts: Iterable[Dict[str, Any]] = ()) -> None:
+        """Path moves (id, path, tier), status flips and rows for adopted archives in one transaction"""
+        with self._connect() as conn:
+            conn.executemany("UPDATE backups SET path = ?, tier = ? WHERE id = ?", [(p, t, i) for i, p, t in paths])
+            conn.executemany("UPDATE backups SET status = ? WHERE id = ?", [(st, i) for i, st in statuses])
+            conn.executemany(
+                "INSERT INTO backups(ts, path, status, size_bytes, raw_size_bytes, duration_sec, rc, stderr, "
+                "fingerprint, base, codec, key_id, sha256, tier) "
+                "VALUES(:ts, :path, 'OK', :size_bytes, :raw_size_bytes, NULL, NULL, :stderr, "
+                ":fingerprint, :base, :codec, :key_id, :sha256, :tier)",
+                list(inserts))
+        self._bump_version()
+
+    def tier_candidates(self) -> List[sqlite3.Row]:
+        """OK archives still on the landing tier, oldest first"""
+        with self._connect() as conn:
+            return list(conn.execute(
+                f"SELECT {CATALOG_COLUMNS} FROM backups INDEXED BY idx_backups_fast_tier "
+                "WHERE status = 'OK' AND tier = 'fast' AND path IS NOT NULL ORDER BY id"
+            ).fetchall())
+
+    def set_tier(self, backup_id: int, path: str, tier: str):
+        """Record an archive's new location after a verified migration"""
+        with self._connect() as conn:
+            conn.execute("UPDATE backups SET path = ?, tier = ?, migrated_at = ? WHERE id = ?",
+                         (path, tier, dt.datetime.now().isoformat(timespec='seconds'), backup_id))
+        self._bump_version()
+
+    def backups_since(self, last_id: int = 0) -> Iterable[sqlite3.Row]:
+        """Backups with id > last_id in insertion order (for incremental consumers)"""
+        with self._connect() as conn:
+            cur = conn.execute(
+                "SELECT b.id, b.ts, b.status, b.base, b.size_bytes, b.duration_sec, b.raw_size_bytes, b.dump_duration_sec, "
+                "b.phases, r.peak_cpu_percent, r.mean_cpu_percent, r.peak_rss_bytes, r.peak_read_bps, "
+                "r.peak_write_bps, r.peak_read_iops, r.peak_write_iops "
+                "FROM backups b LEFT JOIN backup_resources r ON r.backup_id = b.id WHERE b.id > ? ORDER BY b.id",
+                (last_id,)
+            )
+            return list(cur.fetchall())
+
+    def list_backups(self, *, limit: int = 50, before_id: Optional[int] = None, status: Optional[str] = None,
+                     ts_from: Optional[str] = None, ts_to: Optional[str] = None, base: Optional[str] = None,
+                     min_size: Optional[int] = None, max_size: Optional[int] = None) -> List[sqlite3.Row]:
+        """Keyset-paginated catalog, newest first; ts_from inclusive, ts_to exclusive (ISO prefixes)"""
+        where, params = [], []
+        if before_id is not None:
+            where.append("id < ?")
+            params.append(before_id)
+        if status:
+            where.append("status = ?")
+            params.append(status.upper())
+        if ts_from:
+            where.append("ts >= ?")
+            params.append(ts_from)
+        if ts_to:
+            where.append("ts < ?")
+            params.append(ts_to)
+        if base:
+            where.append("base = ?")
+            params.append(base)
+        if min_size is not None:
+            where.append("size_bytes >= ?")
+            params.append(min_size)
+        if max_size is not None:
+            where.append("size_bytes <= ?")
+            params.append(max_size)
+        sql = f"SELECT {CATALOG_COLUMNS} FROM backups"
+        if where:
+            sql += " WHERE " + " AND ".join(where)
+        sql += " ORDER BY id DESC LIMIT ?"
+        params.append(limit)
+        with self._connect() as conn:
+            return list(conn.execute(sql, params).fetchall())
+
+    def get_backup(self, backup_id: int) -> Optional[sqlite3.Row]:
+        with self._connect() as conn:
+            return conn.execute(f"SELECT {CATALOG_COLUMNS} FROM backups WHERE id = ?", (backup_id,)).fetchone()
+
+    def largest_backups(self, limit: int = 10, status: str = "OK") -> List[sqlite3.Row]:
+        with self._connect() as conn:
+            cur = conn.execute(
+                f"SELECT {CATALOG_COLUMNS} FROM backups WHERE status = ? AND size_bytes IS NOT NULL "
+                "ORDER BY size_bytes DESC LIMIT ?", (status, limit)
+            )
+            return list(cur.fetchall())
+
+    def daily_stats(self, *, day_from: Optional[str] = None, day_to: Optional[str] = None,
+                    base: Optional[str] = None) -> List[sqlite3.Row]:
+        """Per-day, per-status rows from the backup_daily summary table"""
+        where, params = [], []
+        if day_from:
+            where.append("day >= ?")
+            params.append(day_from[:10])
+        if day_to:
+            where.append("day < ?")
+            params.append(day_to[:10])
+        if base is not None:
+            where.append("base = ?")
+            params.append(base)
+        sql = ("SELECT day, status, SUM(count) AS count, SUM(bytes) AS bytes, "
+               "MAX(max_size_bytes) AS max_size_bytes, SUM(duration_sec) AS duration_sec FROM backup_daily")
+        if where:
+            sql += " WHERE " + " AND ".join(where)
+        sql += " GROUP BY day, status ORDER BY day"
+        with self._connect() as conn:
+            return list(conn.execute(sql, params).fetchall())
+
+    def resource_profile(self, backup_id: int) -> Optional[sqlite3.Row]:
+        with self._connect() as conn:
+            return conn.execute(f"SELECT backup_id, {', '.join(RESOURCE_COLUMNS)} FROM backup_resources "
+                                "WHERE backup_id = ?", (backup_id,)).fetchone()
+
+    def resource_summaries(self, limit: int = 20, base: Optional[str] = None) -> List[sqlite3.Row]:
+        """Newest dump profiles (without samples) joined with their backups"""
+        sql = (f"SELECT b.id, b.ts, b.base, b.status, b.raw_size_bytes, b.dump_duration_sec, {RESOURCE_SUMMARY} "
+               "FROM backup_resources r JOIN backups b ON b.id = r.backup_id")
+        params: List[Any] = []
+        if base:
+            sql += " WHERE b.base = ?"
+            params.append(base)
+        sql += " ORDER BY r.backup_id DESC LIMIT ?"
+        params.append(limit)
+        with self._connect() as conn:
+            return list(conn.execute(sql, params).fetchall())
 
     def recent_backups(self, limit: int = 10) -> Iterable[sqlite3.Row]:
         with self._connect() as conn:
@@ -70,17 +556,78 @@ class Database:
 
     def last_fingerprint(self) -> Optional[str]:
         with self._connect() as conn:
-            cur = conn.execute("SELECT fingerprint FROM backups WHERE fingerprint IS NOT NULL AND status IN ('OK','SKIP') ORDER BY id DESC LIMIT 1")
+            # The planner otherwise prefers idx_backups_status plus a sort over all OK/SKIP rows
+            cur = conn.execute(
+                "SELECT fingerprint FROM backups INDEXED BY idx_backups_fingerprint "
+                "WHERE fingerprint IS NOT NULL AND status IN ('OK','SKIP') ORDER BY id DESC LIMIT 1"
+            )
             row = cur.fetchone()
             return row[0] if row else None
 
+    def offsite_start(self, *, backup_id: int, chat_id: str, file_name: str, parts: int, size_bytes: int):
+        """Create (or reopen, keeping uploaded parts) the offsite upload record"""
+        now = dt.datetime.now().isoformat(timespec='seconds')
+        with self._connect() as conn:
+            row = conn.execute("SELECT parts, size_bytes FROM offsite_uploads WHERE backup_id = ?", (backup_id,)).fetchone()
+            if row is not None and (row["parts"], row["size_bytes"]) != (parts, size_bytes):
+                # Volume size or archive changed: earlier volumes don't line up any more
+                conn.execute("DELETE FROM offsite_uploads WHERE backup_id = ?", (backup_id,))
+                conn.execute("DELETE FROM offsite_parts WHERE backup_id = ?", (backup_id,))
+            conn.execute(
+                "INSERT INTO offsite_uploads(backup_id, chat_id, file_name, parts, size_bytes, status, started_at) "
+                "VALUES(?,?,?,?,?,'UPLOADING',?) "
+                "ON CONFLICT(backup_id) DO UPDATE SET status='UPLOADING', finished_at=NULL",
+                (backup_id, chat_id, file_name, parts, size_bytes, now)
+            )
+
+    def offsite_record_part(self, *, backup_id: int, part: int, message_id: int, file_id: str,
+                            offset: int, size_bytes: int, sha256: str):
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO offsite_parts(backup_id, part, message_id, file_id, offset, size_bytes, sha256, uploaded_at) "
+                "VALUES(?,?,?,?,?,?,?,?)",
+                (backup_id, part, message_id, file_id, offset, size_bytes, sha256,
+                 dt.datetime.now().isoformat(timespec='seconds'))
+            )
+
+    def offsite_finish(self, *, backup_id: int, status: str, sha256: Optional[str] = None,
+                       manifest_message_id: Optional[int] = None):
+        with self._connect() as conn:
+            conn.execute(
+                "UPDATE offsite_uploads SET status=?, sha256=COALESCE(?, sha256), "
+                "manifest_message_id=COALESCE(?, manifest_message_id), finished_at=? WHERE backup_id=?",
+                (status, sha256, manifest_message_id, dt.datetime.now().isoformat(timespec='seconds'), backup_id)
+            )
+
+    def offsite_upload(self, backup_id: int) -> Optional[sqlite3.Row]:
+        with self._connect() as conn:
+            return conn.execute("SELECT * FROM offsite_uploads WHERE backup_id = ?", (backup_id,)).fetchone()
+
+    def offsite_parts(self, backup_id: int) -> List[sqlite3.Row]:
+        with self._connect() as conn:
+            return list(conn.execute(
+                "SELECT * FROM offsite_parts WHERE backup_id = ? ORDER BY part", (backup_id,)
+            ).fetchall())
+
+    def schedule_last_fire(self, job: str) -> Optional[dt.datetime]:
+        with self._connect() as conn:
+            row = conn.execute("SELECT last_fire FROM schedule_state WHERE job = ?", (job,)).fetchone()
+        return dt.datetime.fromisoformat(row[0]) if row else None
+
+    def schedule_set_last_fire(self, job: str, when: dt.datetime):
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT INTO schedule_state(job, last_fire) VALUES(?, ?) "
+                "ON CONFLICT(job) DO UPDATE SET last_fire = excluded.last_fire",
+                (job, when.isoformat(timespec='seconds'))
+            )
+
     def insert_metrics(self, *, ts: dt.datetime, cpu_percent: float, mem_percent: float, disk_percent: float):
         with self._connect() as conn:
             conn.execute(
                 "INSERT INTO metrics(ts, cpu_percent, mem_percent, disk_percent) VALUES(?,?,?,?)",
                 (ts.isoformat(timespec='seconds'), cpu_percent, mem_percent, disk_percent)
             )
-            conn.commit()
 
     def last_metrics(self) -> Optional[sqlite3.Row]:
         with self._connect() as conn:
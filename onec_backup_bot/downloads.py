@@ -0,0 +1,146 @@
+"""
+Backup archive downloads
+Without a bandwidth limit archives are served by aiohttp's FileResponse
+(sendfile, zero-copy, Range/If-Range aware). With a per-client limit they are
+streamed in fixed-size chunks through a token bucket shared by all of that
+client's connections, so parallel-segment downloads can't bypass the cap.
+Either way the file is never buffered whole in memory.
+"""
+from __future__ import annotations
+
+import asyncio
+import mimetypes
+import time
+from pathlib import Path
+from typing import Dict, Optional, Sequence
+
+from aiohttp import web
+
+CHUNK_SIZE = 256 * 1024
+
+
+class TokenBucket:
+    """Async token bucket (bytes per second) with one second of burst"""
+
+    def __init__(self, rate: float):
+        self.rate = float(rate)
+        self.capacity = max(self.rate, CHUNK_SIZE)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def consume(self, n: int):
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= n:
+                    self.tokens -= n
+                    return
+                await asyncio.sleep((n - self.tokens) / self.rate)
+
+
+class DownloadManager:
+    def __init__(self, *, max_concurrent: int = 2, rate_bytes_per_sec: float = 0.0, logger=None):
+        self.max_concurrent = max(1, int(max_concurrent))
+        self.rate = float(rate_bytes_per_sec)
+        self.logger = logger
+        self._active = 0
+        self._buckets: Dict[str, TokenBucket] = {}
+        self._client_refs: Dict[str, int] = {}
+
+    def _acquire(self, client: str) -> bool:
+        # Single event loop: plain counters are race-free
+        if self._active >= self.max_concurrent:
+            return False
+        self._active += 1
+        self._client_refs[client] = self._client_refs.get(client, 0) + 1
+        if self.rate > 0 and client not in self._buckets:
+            self._buckets[client] = TokenBucket(self.rate)
+        return True
+
+    def _release(self, client: str):
+        self._active -= 1
+        refs = self._client_refs.get(client, 1) - 1
+        if refs <= 0:
+            self._client_refs.pop(client, None)
+            self._buckets.pop(client, None)
+        else:
+            self._client_refs[client] = refs
+
+    async def serve(self, request: web.Request, path: Path) -> web.StreamResponse:
+        client = request.remote or "unknown"
+        if not self._acquire(client):
+            raise web.HTTPTooManyRequests(headers={"Retry-After": "30"}, text="Too many concurrent downloads")
+        try:
+            if self.logger:
+                self.logger.info(f"Download started: {path.name} -> {client} (range={request.headers.get('Range', '-')})")
+            if self.rate <= 0:
+                response: web.StreamResponse = web.FileResponse(path, chunk_size=CHUNK_SIZE)
+                response.headers["Content-Disposition"] = f'attachment; filename="{path.name}"'
+                # FileResponse sends the body in prepare(); hold the slot until it is done
+                await response.prepare(request)
+                await response.write_eof()
+                return response
+            return await self._serve_throttled(request, path, self._buckets[client])
+        finally:
+            self._release(client)
+
+    async def _serve_throttled(self, request: web.Request, path: Path, bucket: TokenBucket) -> web.StreamResponse:
+        size = path.stat().st_size
+        start, end = 0, size  # end is exclusive
+        status = 200
+        if "Range" in request.headers:
+            try:
+                rng = request.http_range
+            except ValueError:
+                rng = None
+            if rng is None or (rng.start is None and rng.stop is None):
+                raise web.HTTPRequestRangeNotSatisfiable(headers={"Content-Range": f"bytes */{size}"})
+            if rng.start is not None and rng.start < 0:
+                start = max(0, size + rng.start)  # suffix range: last N bytes
+            else:
+                start = rng.start or 0
+                end = min(size, rng.stop) if rng.stop is not None else size
+            if start >= end:
+                raise web.HTTPRequestRangeNotSatisfiable(headers={"Content-Range": f"bytes */{size}"})
+            status = 206
+
+        response = web.StreamResponse(status=status)
+        response.content_type = mimetypes.guess_type(path.name)[0] or "application/octet-stream"
+        response.content_length = end - start
+        response.headers["Accept-Ranges"] = "bytes"
+        response.headers["Content-Disposition"] = f'attachment; filename="{path.name}"'
+        if status == 206:
+            response.headers["Content-Range"] = f"bytes {start}-{end - 1}/{size}"
+        await response.prepare(request)
+
+        loop = asyncio.get_running_loop()
+        with open(path, "rb") as f:
+            await loop.run_in_executor(None, f.seek, start)
+            remaining = end - start
+            while remaining > 0:
+                n = min(CHUNK_SIZE, remaining)
+                await bucket.consume(n)
+                chunk = await loop.run_in_executor(None, f.read, n)
+                if not chunk:
+                    break
+                await response.write(chunk)
+                remaining -= len(chunk)
+        await response.write_eof()
+        return response
+
+
+def resolve_archive(roots: Sequence[Path], stored_path: Optional[str]) -> Optional[Path]:
+    """Resolve a catalog path, refusing anything outside the storage tiers (backup_dir, tier_dir)"""
+    if not stored_path:
+        return None
+    path = Path(stored_path).resolve()
+    for root in roots:
+        try:
+            path.relative_to(Path(root).resolve())
+        except ValueError:
+            continue
+        return path if path.is_file() else None
+    return None
@@ -0,0 +1,276 @@
+"""
+Chunked authenticated encryption of archive streams
+The codec output is cut into fixed-size chunks, each sealed with AES-256-GCM
+under its own nonce (random per-file prefix + chunk counter). Chunks are
+encrypted on a thread pool while compression continues, and because every
+chunk has a fixed on-disk size a reader can seek straight to any offset.
+The header (key ID, chunk size, nonce prefix) and a final-chunk flag are
+authenticated with every chunk, so reordering, truncation and key mix-ups
+are all detected. Needs the optional `cryptography` package.
+
+Layout: header | chunk 0 | chunk 1 | ... where each chunk is ciphertext + 16-byte tag
+"""
+from __future__ import annotations
+
+import base64
+import binascii
+import io
+import os
+import struct
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from pathlib import Path
+from typing import BinaryIO, Deque, Dict, Optional, Tuple
+
+MAGIC = b"OCBE\x00\x01"
+EXTENSION = ".enc"
+TAG_SIZE = 16
+DEFAULT_CHUNK_SIZE = 1024 * 1024
+DEFAULT_WORKERS = min(8, os.cpu_count() or 1)
+_HEADER = struct.Struct(">6sI8sB")  # magic, chunk size, nonce prefix, key id length
+
+
+class DecryptionError(Exception):
+    pass
+
+
+def available() -> bool:
+    try:
+        import cryptography.hazmat.primitives.ciphers.aead  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+def _aead(key: bytes):
+    try:
+        from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+    except ImportError:
+        raise RuntimeError("encryption needs the cryptography package (pip install cryptography)")
+    return AESGCM(key)
+
+
+def parse_key(text: str) -> bytes:
+    """32-byte key as base64 or 64 hex digits"""
+    text = text.strip()
+    try:
+        key = bytes.fromhex(text) if len(text) == 64 else base64.b64decode(text, validate=True)
+    except (ValueError, binascii.Error):
+        key = b""
+    if len(key) != 32:
+        raise ValueError("encryption key must be 32 bytes (base64 or 64 hex digits)")
+    return key
+
+
+def new_key() -> str:
+    return base64.b64encode(os.urandom(32)).decode("ascii")
+
+
+class KeyRing:
+    """Keys by ID: the active one encrypts new archives, all of them decrypt"""
+
+    def __init__(self, keys: Dict[str, bytes], active_id: Optional[str] = None):
+        self.keys = keys
+        self.active_id = active_id or (next(iter(keys)) if keys else None)
+        if self.active_id is not None and self.active_id not in keys:
+            raise ValueError(f"active encryption key {self.active_id!r} is not configured")
+
+    @classmethod
+    def load(cls, spec: str = "", keys_file: Optional[str] = None, active_id: Optional[str] = None) -> "KeyRing":
+        """spec: "id:key,id:key" (env); keys_file: one "id key" pair per line"""
+        keys: Dict[str, bytes] = {}
+        entries = [e for e in (spec or "").split(",") if e.strip()]
+        if keys_file and Path(keys_file).is_file():
+            for line in Path(keys_file).read_text(encoding="utf-8").splitlines():
+                if line.strip() and not line.lstrip().startswith("#"):
+                    entries.append(":".join(line.split(None, 1)))
+        for entry in entries:
+            key_id, sep, key = entry.strip().partition(":")
+            if not sep or not key_id:
+                raise ValueError(f"bad encryption key entry {key_id!r} (expected id:key)")
+            keys[key_id] = parse_key(key)
+        return cls(keys, active_id or None)
+
+    def get(self, key_id: str) -> bytes:
+        try:
+            return self.keys[key_id]
+        except KeyError:
+            raise DecryptionError(f"encryption key {key_id!r} is not configured")
+
+
+def _header(key_id: str, chunk_size: int, prefix: bytes) -> bytes:
+    kid = key_id.encode("utf-8")
+    if len(kid) > 255:
+        raise ValueError("key id too long")
+    return _HEADER.pack(MAGIC, chunk_size, prefix, len(kid)) + kid
+
+
+def read_header(f: BinaryIO) -> Tuple[str, int, bytes, bytes]:
+    """(key_id, chunk_size, nonce prefix, raw header) of an encrypted file"""
+    fixed = f.read(_HEADER.size)
+    if len(fixed) != _HEADER.size:
+        raise DecryptionError("not an encrypted archive (short header)")
+    magic, chunk_size, prefix, kid_len = _HEADER.unpack(fixed)
+    if magic != MAGIC:
+        raise DecryptionError("not an encrypted archive (bad magic)")
+    kid = f.read(kid_len)
+    return kid.decode("utf-8"), chunk_size, prefix, fixed + kid
+
+
+def _nonce(prefix: bytes, index: int) -> bytes:
+    return prefix + index.to_bytes(4, "big")
+
+
+class EncryptingWriter(io.RawIOBase):
+    """Write-only stream; chunks are sealed on a pool and written in order"""
+
+    def __init__(self, raw: BinaryIO, key_id: str, key: bytes, *, chunk_size: int = DEFAULT_CHUNK_SIZE,
+                 workers: int = 0):
+        self._raw = raw
+        self._aead = _aead(key)
+        self._chunk_size = int(chunk_size)
+        self._prefix = os.urandom(8)
+        self._header = _header(key_id, self._chunk_size, self._prefix)
+        raw.write(self._header)
+        self._buf = bytearray()
+        self._index = 0
+        self._pos = 0
+        workers = workers or DEFAULT_WORKERS
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="encrypt") if workers > 1 else None
+        self._pending: Deque[Future] = deque()
+        self._max_pending = 2 * workers
+
+    def writable(self) -> bool:
+        return True
+
+    def tell(self) -> int:
+        return self._pos
+
+    def _seal(self, data: bytes, last: bool) -> None:
+        index = self._index
+        self._index += 1
+        if index >= 2 ** 32:
+            raise OverflowError("too many chunks for one nonce prefix")
+        aad = self._header + (b"\x01" if last else b"\x00")
+        nonce = _nonce(self._prefix, index)
+        if self._pool is None:
+            self._raw.write(self._aead.encrypt(nonce, data, aad))
+            return
+        self._pending.append(self._pool.submit(self._aead.encrypt, nonce, data, aad))
+        while len(self._pending) > self._max_pending or (last and self._pending):
+            self._raw.write(self._pending.popleft().result())
+
+    def write(self, b) -> int:
+        n = len(b)
+        self._buf += b
+        self._pos += n
+        # Keep the newest chunk back until more data arrives: only close() knows it is the last one
+        while len(self._buf) > self._chunk_size:
+            self._seal(bytes(self._buf[:self._chunk_size]), last=False)
+            del self._buf[:self._chunk_size]
+        return n
+
+    def close(self):
+        if self.closed:
+            return
+        try:
+            self._seal(bytes(self._buf), last=True)
+            self._buf.clear()
+        finally:
+            if self._pool is not None:
+                self._pool.shutdown(wait=True)
+            self._raw.close()
+            super().close()
+
+
+class DecryptingReader(io.RawIOBase):
+    """Seekable plaintext view of an encrypted file; sequential reads prefetch chunks on a pool"""
+
+    def __init__(self, raw: BinaryIO, keyring: KeyRing, *, workers: int = 0):
+        self._raw = raw
+        self.key_id, self._chunk_size, self._prefix, self._header = read_header(raw)
+        self._aead = _aead(keyring.get(self.key_id))
+        body = raw.seek(0, io.SEEK_END) - len(self._header)
+        self._stride = self._chunk_size + TAG_SIZE
+        self._chunks = -(-body // self._stride)
+        last_size = body - (self._chunks - 1) * self._stride - TAG_SIZE
+        if self._chunks == 0 or last_size < 0:
+            raise DecryptionError("encrypted archive is truncated")
+        self.size = (self._chunks - 1) * self._chunk_size + last_size
+        self._pos = 0
+        workers = workers or DEFAULT_WORKERS
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="decrypt") if workers > 1 else None
+        self._depth = 2 * workers
+        self._prefetch: Dict[int, Future] = {}
+        self._cached: Tuple[int, bytes] = (-1, b"")
+
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return True
+
+    def tell(self) -> int:
+        return self._pos
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        base = {io.SEEK_SET: 0, io.SEEK_CUR: self._pos, io.SEEK_END: self.size}[whence]
+        self._pos = max(0, base + offset)
+        return self._pos
+
+    def _read_sealed(self, index: int) -> bytes:
+        self._raw.seek(len(self._header) + index * self._stride)
+        return self._raw.read(self._stride)
+
+    def _open(self, index: int, sealed: bytes) -> bytes:
+        last = index == self._chunks - 1
+        aad = self._header + (b"\x01" if last else b"\x00")
+        try:
+            return self._aead.decrypt(_nonce(self._prefix, index), sealed, aad)
+        except Exception:
+            raise DecryptionError(f"chunk {index} failed authentication (wrong key, corrupt or truncated)")
+
+    def _chunk(self, index: int) -> bytes:
+        if self._cached[0] == index:
+            return self._cached[1]
+        future = self._prefetch.pop(index, None)
+        data = future.result() if future is not None else self._open(index, self._read_sealed(index))
+        if self._pool is not None:
+            # Sequential reading: keep the next chunks decrypting in the background
+            for ahead in range(index + 1, min(index + 1 + self._depth, self._chunks)):
+                if ahead not in self._prefetch:
+                    self._prefetch[ahead] = self._pool.submit(self._open, ahead, self._read_sealed(ahead))
+            for stale in [i for i in self._prefetch if i < index or i > index + self._depth]:
+                self._prefetch.pop(stale).cancel()
+        self._cached = (index, data)
+        return data
+
+    def readinto(self, b) -> int:
+        if self._pos >= self.size:
+            return 0
+        index, offset = divmod(self._pos, self._chunk_size)
+        data = self._chunk(index)
+        n = min(len(b), len(data) - offset)
+        b[:n] = data[offset:offset + n]
+        self._pos += n
+        return n
+
+    def close(self):
+        if self.closed:
+            return
+        try:
+            if self._pool is not None:
+                for future in self._prefetch.values():
+                    future.cancel()
+                self._pool.shutdown(wait=True)
+            self._raw.close()
+        finally:
+            super().close()
+
+
+def is_encrypted(path: Path) -> bool:
+    try:
+        with open(path, "rb") as f:
+            return f.read(len(MAGIC)) == MAGIC
+    except OSError:
+        return False
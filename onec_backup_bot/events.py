@@ -0,0 +1,117 @@
+"""
+In-process pub/sub bus for backup and metric events
+Publishing is thread-safe (the backup runs on a worker thread) and dispatch
+happens on the API event loop. Every subscriber has a bounded queue; one that
+falls behind is evicted instead of slowing the publisher or growing memory.
+Events are serialized once and the encoded frame is shared by all
+subscribers.
+"""
+from __future__ import annotations
+
+import asyncio
+import itertools
+import json
+import threading
+import time
+from typing import Any, Dict, Iterable, List, Optional, Set
+
+
+class Event:
+    __slots__ = ("id", "topic", "ts", "data", "_json", "_sse")
+
+    def __init__(self, event_id: int, topic: str, data: Dict[str, Any]):
+        self.id = event_id
+        self.topic = topic
+        self.ts = time.time()
+        self.data = data
+        self._json: Optional[str] = None
+        self._sse: Optional[bytes] = None
+
+    def json(self) -> str:
+        if self._json is None:
+            self._json = json.dumps({"id": self.id, "topic": self.topic, "ts": self.ts, "data": self.data},
+                                    ensure_ascii=False, default=str)
+        return self._json
+
+    def sse(self) -> bytes:
+        if self._sse is None:
+            self._sse = f"id: {self.id}\nevent: {self.topic}\ndata: {self.json()}\n\n".encode("utf-8")
+        return self._sse
+
+
+# Sentinel delivered to an evicted subscriber
+EVICTED = object()
+
+
+class Subscriber:
+    def __init__(self, topics: Optional[Iterable[str]], max_queue: int):
+        # Topic prefixes, e.g. {"backup"} matches backup.phase and backup.completed
+        self.topics: Optional[Set[str]] = set(topics) if topics else None
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=max_queue)
+        self.evicted = False
+
+    def wants(self, topic: str) -> bool:
+        if self.topics is None:
+            return True
+        return any(topic == t or topic.startswith(t + ".") for t in self.topics)
+
+
+class EventBus:
+    def __init__(self, max_queue: int = 256, logger=None):
+        self.max_queue = int(max_queue)
+        self.logger = logger
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._subscribers: List[Subscriber] = []
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+
+    def bind(self, loop: asyncio.AbstractEventLoop):
+        """Attach the loop that owns subscriber queues (the API loop)"""
+        self._loop = loop
+
+    @property
+    def subscriber_count(self) -> int:
+        return len(self._subscribers)
+
+    def publish(self, topic: str, **data):
+        """Publish from any thread; a no-op while nobody is listening"""
+        loop = self._loop
+        if loop is None or not self._subscribers or loop.is_closed():
+            return
+        event = Event(next(self._ids), topic, data)
+        try:
+            running = asyncio.get_running_loop()
+        except RuntimeError:
+            running = None
+        if running is loop:
+            self._dispatch(event)
+        else:
+            loop.call_soon_threadsafe(self._dispatch, event)
+
+    def _dispatch(self, event: Event):
+        for sub in list(self._subscribers):
+            if not sub.wants(event.topic):
+                continue
+            try:
+                sub.queue.put_nowait(event)
+            except asyncio.QueueFull:
+                self._evict(sub)
+
+    def _evict(self, sub: Subscriber):
+        sub.evicted = True
+        self.unsubscribe(sub)
+        while not sub.queue.empty():
+            sub.queue.get_nowait()
+        sub.queue.put_nowait(EVICTED)
+        if self.logger:
+            self.logger.warning("Event stream subscriber evicted (slow consumer)")
+
+    def subscribe(self, topics: Optional[Iterable[str]] = None) -> Subscriber:
+        sub = Subscriber(topics, self.max_queue)
+        with self._lock:
+            self._subscribers = self._subscribers + [sub]
+        return sub
+
+    def unsubscribe(self, sub: Subscriber):
+        with self._lock:
+            self._subscribers = [s for s in self._subscribers if s is not sub]
@@ -0,0 +1,238 @@
+"""
+Fleet aggregator mode
+Polls /api/health and /api/metrics.prom of many bot instances concurrently
+through one pooled aiohttp client, caches the latest state per node and
+serves a combined fleet view plus a merged Prometheus endpoint where every
+sample carries an `instance` label.
+"""
+from __future__ import annotations
+
+import asyncio
+import json
+import re
+import time
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional, Tuple
+
+import aiohttp
+from aiohttp import web
+
+_SAMPLE_RE = re.compile(r'^([a-zA-Z_:][a-zA-Z0-9_:]*)(\{[^}]*\})?\s+(.*)$')
+_HIST_SUFFIXES = ("_bucket", "_sum", "_count")
+
+
+@dataclass
+class NodeState:
+    name: str
+    url: str
+    token: str = ""
+    up: bool = False
+    error: Optional[str] = None
+    last_poll: Optional[float] = None
+    last_success: Optional[float] = None
+    latency_sec: Optional[float] = None
+    health: Optional[Dict[str, Any]] = None
+    health_etag: Optional[str] = None
+    prom_text: str = ""
+
+    def view(self) -> Dict[str, Any]:
+        return {
+            "name": self.name,
+            "url": self.url,
+            "up": self.up,
+            "error": self.error,
+            "last_poll": self.last_poll,
+            "last_success": self.last_success,
+            "latency_sec": self.latency_sec,
+            "health": self.health,
+        }
+
+
+def _parse_nodes(nodes: List[Any]) -> List[NodeState]:
+    parsed = []
+    for node in nodes or []:
+        if isinstance(node, str):
+            node = {"url": node}
+        url = str(node.get("url", "")).rstrip("/")
+        if not url:
+            continue
+        name = str(node.get("name") or re.sub(r"^https?://", "", url))
+        parsed.append(NodeState(name=name, url=url, token=str(node.get("token", "") or "")))
+    return parsed
+
+
+def _with_instance(labels: Optional[str], instance: str) -> str:
+    inst = 'instance="' + instance.replace("\\", "\\\\").replace('"', '\\"') + '"'
+    if not labels or labels == "{}":
+        return "{" + inst + "}"
+    return "{" + inst + "," + labels[1:]
+
+
+def merge_prometheus(texts: List[Tuple[str, str]]) -> str:
+    """Merge exposition texts from (instance, text) pairs, grouping samples by metric family"""
+    families: Dict[str, Dict[str, Any]] = {}
+
+    def _family(name: str, current: Optional[str]) -> str:
+        if current and (name == current or (name.startswith(current) and name[len(current):] in _HIST_SUFFIXES)):
+            return current
+        return name
+
+    for instance, text in texts:
+        current: Optional[str] = None
+        for line in text.splitlines():
+            line = line.strip()
+            if not line:
+                continue
+            if line.startswith("#"):
+                parts = line.split(None, 3)
+                if len(parts) >= 4 and parts[1] in ("TYPE", "HELP"):
+                    current = parts[2]
+                    fam = families.setdefault(current, {"type": None, "help": None, "samples": []})
+                    key = "type" if parts[1] == "TYPE" else "help"
+                    if not fam[key]:
+                        fam[key] = parts[3]
+                continue
+            m = _SAMPLE_RE.match(line)
+            if not m:
+                continue
+            name, labels, rest = m.groups()
+            fam = families.setdefault(_family(name, current), {"type": None, "help": None, "samples": []})
+            fam["samples"].append(f"{name}{_with_instance(labels, instance)} {rest}")
+
+    out = []
+    for name, fam in families.items():
+        if not fam["samples"]:
+            continue
+        if fam["help"]:
+            out.append(f"# HELP {name} {fam['help']}")
+        if fam["type"]:
+            out.append(f"# TYPE {name} {fam['type']}")
+        out.extend(fam["samples"])
+    return "\n".join(out) + "\n"
+
+
+class FleetAggregator:
+    def __init__(self, *, nodes: List[Any], logger, interval: float = 30.0, timeout: float = 5.0,
+                 concurrency: int = 100, host: str = "0.0.0.0", port: int = 8080):
+        self.nodes = _parse_nodes(nodes)
+        self.logger = logger
+        self.interval = float(interval)
+        self.timeout = float(timeout)
+        self.concurrency = max(1, int(concurrency))
+        self.host = host
+        self.port = int(port)
+
+        self._session: Optional[aiohttp.ClientSession] = None
+        self._poll_task: Optional[asyncio.Task] = None
+        self._runner: Optional[web.AppRunner] = None
+        self._merged_prom: str = ""
+        self.last_cycle_sec: Optional[float] = None
+
+    def _headers(self, node: NodeState) -> Dict[str, str]:
+        return {"Authorization": f"Bearer {node.token}"} if node.token else {}
+
+    async def _poll_node(self, node: NodeState):
+        started = time.monotonic()
+        timeout = aiohttp.ClientTimeout(total=self.timeout)
+        headers = self._headers(node)
+        health_headers = dict(headers)
+        if node.health_etag:
+            health_headers["If-None-Match"] = node.health_etag
+
+        async def _health():
+            async with self._session.get(f"{node.url}/api/health", headers=health_headers, timeout=timeout) as r:
+                if r.status == 304:
+                    return node.health, node.health_etag
+                r.raise_for_status()
+                return json.loads(await r.text()), r.headers.get("ETag")
+
+        async def _prom():
+            async with self._session.get(f"{node.url}/api/metrics.prom", headers=headers, timeout=timeout) as r:
+                r.raise_for_status()
+                return await r.text()
+
+        node.last_poll = time.time()
+        try:
+            (health, etag), prom = await asyncio.gather(_health(), _prom())
+            node.health, node.health_etag, node.prom_text = health, etag, prom
+            node.up, node.error = True, None
+            node.last_success = node.last_poll
+        except asyncio.TimeoutError:
+            node.up, node.error = False, f"timeout after {self.timeout}s"
+        except Exception as e:
+            node.up, node.error = False, str(e) or e.__class__.__name__
+        node.latency_sec = round(time.monotonic() - started, 4)
+
+    async def poll_once(self):
+        started = time.monotonic()
+        await asyncio.gather(*(self._poll_node(n) for n in self.nodes))
+        self.last_cycle_sec = round(time.monotonic() - started, 4)
+        self._merged_prom = self._build_prom()
+        down = sum(1 for n in self.nodes if not n.up)
+        self.logger.debug(f"Fleet poll: {len(self.nodes)} nodes, {down} down, {self.last_cycle_sec}s")
+
+    def _build_prom(self) -> str:
+        # A down node's last scrape is not current: onec_fleet_up=0 is all that is exported for it
+        texts = [(n.name, n.prom_text) for n in self.nodes if n.up and n.prom_text]
+        fleet_lines = ["# TYPE onec_fleet_up gauge"]
+        fleet_lines += [f'onec_fleet_up{_with_instance(None, n.name)} {1 if n.up else 0}' for n in self.nodes]
+        fleet_lines.append("# TYPE onec_fleet_scrape_duration_seconds gauge")
+        fleet_lines += [f'onec_fleet_scrape_duration_seconds{_with_instance(None, n.name)} {n.latency_sec or 0}'
+                        for n in self.nodes]
+        return "\n".join(fleet_lines) + "\n" + merge_prometheus(texts)
+
+    async def _poll_loop(self):
+        loop = asyncio.get_running_loop()
+        next_run = loop.time()
+        while True:
+            try:
+                await self.poll_once()
+            except Exception as e:
+                self.logger.error(f"Fleet poll failed: {e}")
+            next_run += self.interval
+            await asyncio.sleep(max(0.0, next_run - loop.time()))
+
+    async def handle_fleet(self, request: web.Request) -> web.Response:
+        nodes = [n.view() for n in self.nodes]
+        return web.json_response({
+            "nodes": nodes,
+            "total": len(nodes),
+            "up": sum(1 for n in nodes if n["up"]),
+            "last_cycle_sec": self.last_cycle_sec,
+        })
+
+    async def handle_fleet_prom(self, request: web.Request) -> web.Response:
+        return web.Response(text=self._merged_prom, content_type="text/plain; version=0.0.4; charset=utf-8")
+
+    async def start(self):
+        connector = aiohttp.TCPConnector(limit=self.concurrency, limit_per_host=2, ttl_dns_cache=300)
+        self._session = aiohttp.ClientSession(connector=connector)
+        app = web.Application()
+        app.add_routes([
+            web.get("/api/fleet", self.handle_fleet),
+            web.get("/api/fleet/metrics.prom", self.handle_fleet_prom),
+        ])
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, host=self.host, port=self.port).start()
+        self._poll_task = asyncio.create_task(self._poll_loop())
+        self.logger.info(f"Fleet aggregator started on http://{self.host}:{self.port} ({len(self.nodes)} nodes)")
+
+    async def stop(self):
+        if self._poll_task:
+            self._poll_task.cancel()
+            self._poll_task = None
+        if self._runner:
+            await self._runner.cleanup()
+            self._runner = None
+        if self._session:
+            await self._session.close()
+            self._session = None
+        self.logger.info("Fleet aggregator stopped")
+
+    async def run_forever(self):
+        await self.start()
+        try:
+            await asyncio.Event().wait()
+        finally:
+            await self.stop()
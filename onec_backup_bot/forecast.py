@@ -0,0 +1,295 @@
+"""
+Capacity forecasting from the backup history
+Recent OK backups are folded in incrementally (like BackupStats) and fitted
+with Theil-Sen lines (median of pairwise slopes), which shrug off the odd
+failed-and-retried or freshly-collapsed dump that would drag a least-squares
+fit around. From the fits:
+
+    next backup   raw .dt size, compression ratio, archive size, duration
+    upper bound   fit + 2 robust sigmas (1.4826 * MAD of the residuals)
+    disk full     free space of backup_dir stepped forward one backup at a
+                  time, archives released again once older than retention_days
+                  or, with a slow tier, once the migrator moves them away
+
+preflight() compares the space the next backup needs (the dump and, while it
+is compressed, the archive next to it) with what is free right now.
+"""
+from __future__ import annotations
+
+import shutil
+import statistics
+import threading
+from collections import deque
+from dataclasses import dataclass
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Deque, Dict, Optional, Sequence, Tuple
+
+DAY = 86400.0
+UPPER_SIGMAS = 2.0
+MIN_HISTORY = 3  # fewer OK backups: no forecast, pre-flight passes
+MAX_STEPS = 20000  # disk-full simulation cap (hourly backups for two years)
+
+
+@dataclass
+class Trend:
+    slope: float  # per day
+    intercept: float
+    sigma: float  # robust residual spread
+
+    def at(self, t: float) -> float:
+        return self.intercept + self.slope * t
+
+    def upper(self, t: float) -> float:
+        return self.at(t) + UPPER_SIGMAS * self.sigma
+
+    def lower(self, t: float) -> float:
+        return self.at(t) - UPPER_SIGMAS * self.sigma
+
+
+def theil_sen(points: Sequence[Tuple[float, float]]) -> Optional[Trend]:
+    """Median-of-slopes line through (t, y); O(n^2), n is the forecast window"""
+    if not points:
+        return None
+    slopes = [(y2 - y1) / (t2 - t1)
+              for i, (t1, y1) in enumerate(points) for t2, y2 in points[i + 1:] if t2 != t1]
+    slope = statistics.median(slopes) if slopes else 0.0
+    intercept = statistics.median(y - slope * t for t, y in points)
+    residuals = [abs(y - intercept - slope * t) for t, y in points]
+    return Trend(slope, intercept, 1.4826 * statistics.median(residuals))
+
+
+@dataclass
+class Forecast:
+    history: int  # OK backups in the window
+    next_at: datetime
+    interval_sec: float  # median spacing of OK backups
+    raw_size_bytes: Optional[int] = None
+    raw_size_upper_bytes: Optional[int] = None
+    size_bytes: Optional[int] = None
+    size_upper_bytes: Optional[int] = None
+    compression_ratio: Optional[float] = None
+    duration_sec: Optional[float] = None
+    size_trend_bytes_per_day: float = 0.0
+    disk_free_bytes: Optional[int] = None
+    disk_full_at: Optional[datetime] = None  # None: not within horizon_days
+
+    def as_dict(self) -> Dict[str, Any]:
+        data = dict(self.__dict__)
+        data["next_at"] = self.next_at.isoformat(timespec="seconds")
+        data["disk_full_at"] = self.disk_full_at.isoformat(timespec="seconds") if self.disk_full_at else None
+        data["compression_ratio"] = round(self.compression_ratio, 3) if self.compression_ratio else None
+        data["duration_sec"] = round(self.duration_sec, 1) if self.duration_sec is not None else None
+        data["interval_sec"] = round(self.interval_sec, 1)
+        data["size_trend_bytes_per_day"] = round(self.size_trend_bytes_per_day)
+        return data
+
+
+@dataclass
+class Preflight:
+    ok: bool
+    dump_bytes: int = 0
+    archive_bytes: int = 0
+    reserve_bytes: int = 0
+    free_bytes: Optional[int] = None
+    needed_upper_bytes: int = 0
+    reason: str = ""
+
+    @property
+    def needed_bytes(self) -> int:
+        return self.dump_bytes + self.archive_bytes + self.reserve_bytes
+
+    @property
+    def archive_fits(self) -> bool:
+        """Room for the archive alone (the dump written elsewhere)"""
+        return self.free_bytes is None or self.free_bytes >= self.archive_bytes + self.reserve_bytes
+
+
+def _parse_ts(value) -> Optional[datetime]:
+    try:
+        return datetime.fromisoformat(str(value))
+    except (TypeError, ValueError):
+        return None
+
+
+class Forecaster:
+    """Incrementally fed trend model of one base's backups"""
+
+    def __init__(self, db, backup_dir: Path, *, base: Optional[str] = None, window: int = 60,
+                 retention_days: float = 0.0, reserve_mb: float = 1024.0, horizon_days: int = 365,
+                 keep_dump: bool = False, tier_hold_hours: Optional[float] = None):
+        self.db = db
+        self.backup_dir = Path(backup_dir)
+        self.base = base
+        self.retention_days = float(retention_days)
+        # Days an archive occupies backup_dir (0 = for good): retention, or the tier policy if sooner
+        holds = [d for d in (self.retention_days,
+                             float(tier_hold_hours) / 24 if tier_hold_hours is not None else 0.0) if d > 0]
+        self.hold_days = min(holds) if holds else 0.0
+        self.reserve_bytes = int(float(reserve_mb) * 1024 * 1024)
+        self.horizon_days = int(horizon_days)
+        # The .dt stays next to its archive (delete_dt_after_compress: false)
+        self.keep_dump = keep_dump
+        self._lock = threading.Lock()
+        self._last_id = 0
+        # (t days, archive bytes, raw bytes or None, duration sec or None) of recent OK backups
+        self._points: Deque[Tuple[float, int, Optional[int], Optional[float]]] = deque(maxlen=max(2, int(window)))
+        # (t days, bytes on disk) of OK backups still in backup_dir, for the disk-full walk
+        self._retained: Deque[Tuple[float, int]] = deque()
+        self._fits: Optional[Dict[str, Optional[Trend]]] = None
+        self._disk_free: Optional[int] = None
+        self._cached: Optional[Forecast] = None  # forecast() as of the last refresh
+
+    def _ingest(self, row):
+        if (row["status"] or "").upper() != "OK" or not row["size_bytes"]:
+            return
+        if self.base and row["base"] and row["base"] != self.base:
+            return
+        ts = _parse_ts(row["ts"])
+        if ts is None:
+            return
+        t = ts.timestamp() / DAY
+        raw = row["raw_size_bytes"]
+        self._points.append((t, int(row["size_bytes"]), int(raw) if raw else None,
+                             float(row["duration_sec"]) if row["duration_sec"] is not None else None))
+        if self.hold_days > 0:
+            on_disk = int(row["size_bytes"]) + (int(raw) if self.keep_dump and raw else 0)
+            self._retained.append((t, on_disk))
+        self._fits = None
+
+    def refresh(self):
+        """Fold in new backups and re-read free space (blocking: call off the event loop)"""
+        try:
+            free = shutil.disk_usage(self.backup_dir).free
+        except OSError:
+            free = None
+        with self._lock:
+            for row in self.db.backups_since(self._last_id):
+                self._ingest(row)
+                self._last_id = row["id"]
+            cutoff = datetime.now().timestamp() / DAY - self.hold_days
+            while self._retained and self._retained[0][0] < cutoff:
+                self._retained.popleft()
+            self._disk_free = free
+            self._cached = None
+
+    def _fit(self) -> Dict[str, Optional[Trend]]:
+        if self._fits is None:
+            pts = list(self._points)
+            self._fits = {
+                "size": theil_sen([(t, s) for t, s, _, _ in pts]),
+                "raw": theil_sen([(t, r) for t, _, r, _ in pts if r]),
+                "ratio": theil_sen([(t, r / s) for t, s, r, _ in pts if r]),
+                "duration": theil_sen([(t, d) for t, _, _, d in pts if d is not None]),
+            }
+        return self._fits
+
+    def forecast(self, now: Optional[datetime] = None) -> Optional[Forecast]:
+        """Model as of the last refresh(); None until MIN_HISTORY OK backups exist"""
+        with self._lock:
+            if len(self._points) < MIN_HISTORY:
+                return None
+            if now is None and self._cached is not None:
+                return self._cached
+            cache, now = now is None, now or datetime.now()
+            fits = self._fit()
+            times = [p[0] for p in self._points]
+            interval = statistics.median(b - a for a, b in zip(times, times[1:])) or 1.0
+            t_now = now.timestamp() / DAY
+            t_next = max(t_now, times[-1] + interval)
+            fc = Forecast(history=len(times), next_at=datetime.fromtimestamp(t_next * DAY),
+                          interval_sec=interval * DAY, disk_free_bytes=self._disk_free)
+            size_fit, raw_fit, ratio_fit = fits["size"], fits["raw"], fits["ratio"]
+            size = size_fit.at(t_next)
+            size_upper = size_fit.upper(t_next)
+            if raw_fit is not None and ratio_fit is not None:
+                raw = max(1.0, raw_fit.at(t_next))
+                fc.raw_size_bytes = int(raw)
+                fc.raw_size_upper_bytes = int(max(raw, raw_fit.upper(t_next)))
+                fc.compression_ratio = max(1e-3, ratio_fit.at(t_next))
+                # Archive = dump / ratio: follows a codec change faster than the size line alone
+                size = raw / fc.compression_ratio
+                size_upper = max(size_upper, fc.raw_size_upper_bytes / max(1e-3, ratio_fit.lower(t_next)))
+            fc.size_bytes = int(max(1.0, size))
+            fc.size_upper_bytes = int(max(fc.size_bytes, size_upper))
+            fc.size_trend_bytes_per_day = size_fit.slope
+            if fits["duration"] is not None:
+                fc.duration_sec = max(0.0, fits["duration"].at(t_next))
+            if self._disk_free is not None:
+                fc.disk_full_at = self._disk_full(t_now, t_next, interval, size_fit, fc)
+            if cache:
+                self._cached = fc
+            return fc
+
+    def _disk_full(self, t_now: float, t_next: float, interval: float, size_fit: Trend,
+                   fc: Forecast) -> Optional[datetime]:
+        free = self._disk_free - self.reserve_bytes
+        expiring = deque(self._retained)
+        future: Deque[Tuple[float, int]] = deque()
+        ratio = (fc.raw_size_bytes / fc.size_bytes) if fc.raw_size_bytes else 0.0
+        step = max(interval, self.horizon_days / MAX_STEPS)
+        t = t_next
+        while t <= t_now + self.horizon_days:
+            size = max(0.0, size_fit.at(t)) * step / interval
+            if self.keep_dump:
+                size += size * ratio
+            free -= size
+            if self.hold_days > 0:
+                future.append((t, int(size)))
+                for queue in (expiring, future):
+                    while queue and queue[0][0] + self.hold_days <= t:
+                        free += queue.popleft()[1]
+            if free < 0:
+                return datetime.fromtimestamp(t * DAY)
+            t += step
+        return None
+
+    def preflight(self, compress: bool) -> Preflight:
+        """Does the next backup fit into backup_dir? Passes when there is no forecast yet"""
+        self.refresh()
+        fc = self.forecast()
+        if fc is None or fc.disk_free_bytes is None:
+            return Preflight(True, reason="no forecast")
+        dump = fc.raw_size_bytes or fc.size_bytes
+        dump_upper = fc.raw_size_upper_bytes or fc.size_upper_bytes
+        # The archive is written while the dump still exists
+        check = Preflight(True, dump, fc.size_bytes if compress else 0, self.reserve_bytes, fc.disk_free_bytes,
+                          dump_upper + (fc.size_upper_bytes if compress else 0) + self.reserve_bytes)
+        check.ok = check.free_bytes >= check.needed_bytes
+        if not check.ok:
+            check.reason = (f"needs ~{check.needed_bytes // 2**20} MB with reserve, "
+                            f"{check.free_bytes // 2**20} MB free")
+        return check
+
+    def gauges(self) -> Dict[str, float]:
+        fc = self.forecast()
+        if fc is None:
+            return {}
+        gauges = {
+            "backup_forecast_next_size_bytes": fc.size_bytes,
+            "backup_forecast_next_size_upper_bytes": fc.size_upper_bytes,
+            "backup_forecast_size_trend_bytes_per_day": fc.size_trend_bytes_per_day,
+        }
+        optional = {
+            "backup_forecast_next_raw_size_bytes": fc.raw_size_bytes,
+            "backup_forecast_compression_ratio": fc.compression_ratio,
+            "backup_forecast_next_duration_seconds": fc.duration_sec,
+            "backup_forecast_disk_free_bytes": fc.disk_free_bytes,
+        }
+        gauges.update({k: float(v) for k, v in optional.items() if v is not None})
+        if fc.disk_free_bytes is not None:
+            # Seconds left; the horizon stands in for "not in sight" so alerts can use a plain threshold
+            full_in = ((fc.disk_full_at - datetime.now()).total_seconds() if fc.disk_full_at
+                       else self.horizon_days * DAY)
+            gauges["backup_forecast_disk_full_seconds"] = max(0.0, full_in)
+        return {k: float(v) for k, v in gauges.items()}
+
+
+def spool_fits(spool_dir: Path, needed_bytes: int) -> bool:
+    """Is there room for the dump in spool_dir?"""
+    try:
+        Path(spool_dir).mkdir(parents=True, exist_ok=True)
+        return shutil.disk_usage(spool_dir).free >= needed_bytes
+    except OSError:
+        return False
+
@@ -1,42 +1,104 @@
 """
 Grafana/metrics integration module
 Supports: Prometheus Pushgateway, InfluxDB, Loki
+
+All pushes are asynchronous (aiohttp) and fan out to every configured backend
+concurrently, each bounded by its own deadline, so a slow backend never delays
+the others.
 """
 from __future__ import annotations
 
+import asyncio
 import os
-import json
-import requests
-from typing import Optional, Dict, Any
+from typing import Optional, Dict, Any, List, Awaitable
 from datetime import datetime
 
+import aiohttp
+
 
 class GrafanaClient:
-    """Client for sending metrics to Grafana/Prometheus/InfluxDB"""
-    
+    """Async client for sending metrics to Grafana/Prometheus/InfluxDB"""
+
     def __init__(self, logger):
         self.logger = logger
-        
+
         # Prometheus Push Gateway
         self.prometheus_url = os.getenv("GRAFANA_PROMETHEUS_URL") or os.getenv("PROMETHEUS_PUSHGATEWAY_URL")
         self.prometheus_user = os.getenv("GRAFANA_PROMETHEUS_USER")
         self.prometheus_password = os.getenv("GRAFANA_PROMETHEUS_PASSWORD")
-        
+
         # Loki for logs
         self.loki_url = os.getenv("GRAFANA_LOKI_URL")
         self.loki_user = os.getenv("GRAFANA_LOKI_USER")
         self.loki_password = os.getenv("GRAFANA_LOKI_PASSWORD")
-        
+
         # InfluxDB
         self.influxdb_url = os.getenv("INFLUXDB_URL")
         self.influxdb_token = os.getenv("INFLUXDB_TOKEN")
         self.influxdb_org = os.getenv("INFLUXDB_ORG")
         self.influxdb_bucket = os.getenv("INFLUXDB_BUCKET")
-    
-    def push_metrics_prometheus(self, metrics: Dict[str, Any], job: str = "onec_backup_bot") -> bool:
+
+        # Per-backend deadlines (seconds)
+        default_timeout = float(os.getenv("GRAFANA_TIMEOUT", 10))
+        self.prometheus_timeout = float(os.getenv("GRAFANA_PROMETHEUS_TIMEOUT", default_timeout))
+        self.influxdb_timeout = float(os.getenv("INFLUXDB_TIMEOUT", default_timeout))
+        self.loki_timeout = float(os.getenv("GRAFANA_LOKI_TIMEOUT", default_timeout))
+
+        self._session: Optional[aiohttp.ClientSession] = None
+
+    @property
+    def enabled(self) -> bool:
+        return any([self.prometheus_url, self.influxdb_url, self.loki_url])
+
+    async def _get_session(self) -> aiohttp.ClientSession:
+        # Created lazily so the session binds to the loop it is used on
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession()
+        return self._session
+
+    async def close(self):
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._session = None
+
+    async def _post(self, url: str, *, timeout: float, **kwargs) -> aiohttp.ClientResponse:
+        session = await self._get_session()
+        async with session.post(url, timeout=aiohttp.ClientTimeout(total=timeout), **kwargs) as response:
+            await response.read()
+            return response
+
+    @staticmethod
+    def _build_prometheus_payload(metrics: Dict[str, Any]) -> str:
+        lines = []
+        timestamp_ms = int(datetime.now().timestamp() * 1000)
+
+        for metric_name, value in metrics.items():
+            if value is None:
+                continue
+
+            # Convert metric name to prometheus format
+            prom_name = f"onec_{metric_name}"
+
+            # Add TYPE and HELP comments for gauge metrics
+            if metric_name.endswith('_percent') or metric_name.endswith('_count'):
+                lines.append(f"# TYPE {prom_name} gauge")
+
+            # Add metric value with timestamp
+            if isinstance(value, (int, float)):
+                lines.append(f"{prom_name} {value} {timestamp_ms}")
+            elif isinstance(value, dict):
+                # Handle nested metrics with labels
+                for label_key, label_value in value.items():
+                    if isinstance(label_value, (int, float)):
+                        lines.append(f'{prom_name}{{{label_key}="{label_value}"}} {label_value} {timestamp_ms}')
+
+        return "\n".join(lines) + "\n"
+
+    async def push_metrics_prometheus(self, metrics: Dict[str, Any], job: str = "onec_backup_bot",
+                                      extra_lines: Optional[List[str]] = None) -> bool:
         """
         Send metrics to Prometheus Pushgateway endpoint
-        
+
         Metrics format:
         {
             'cpu_percent': 45.2,
@@ -47,123 +109,108 @@ class GrafanaClient:
         """
         if not self.prometheus_url:
             return False
-        
+
         try:
-            # Build Prometheus text format
-            lines = []
-            timestamp_ms = int(datetime.now().timestamp() * 1000)
-            
-            for metric_name, value in metrics.items():
-                if value is None:
-                    continue
-                
-                # Convert metric name to prometheus format
-                prom_name = f"onec_{metric_name}"
-                
-                # Add TYPE and HELP comments for gauge metrics
-                if metric_name.endswith('_percent') or metric_name.endswith('_count'):
-                    lines.append(f"# TYPE {prom_name} gauge")
-                
-                # Add metric value with timestamp
-                if isinstance(value, (int, float)):
-                    lines.append(f"{prom_name} {value} {timestamp_ms}")
-                elif isinstance(value, dict):
-                    # Handle nested metrics with labels
-                    for label_key, label_value in value.items():
-                        if isinstance(label_value, (int, float)):
-                            lines.append(f'{prom_name}{{{label_key}="{label_value}"}} {label_value} {timestamp_ms}')
-            
-            payload = "\n".join(lines) + "\n"
-            
+            payload = self._build_prometheus_payload(metrics)
+            if extra_lines:
+                # Pre-rendered exposition lines (e.g. histograms)
+                payload += "\n".join(extra_lines) + "\n"
+
             # Determine endpoint (generic Pushgateway-compatible)
             url = f"{self.prometheus_url}/metrics/job/{job}"
-            auth = None
-            
-            response = requests.post(
+            auth = aiohttp.BasicAuth(self.prometheus_user, self.prometheus_password or "") if self.prometheus_user else None
+
+            response = await self._post(
                 url,
                 data=payload,
                 headers={"Content-Type": "text/plain"},
                 auth=auth,
-                timeout=10
+                timeout=self.prometheus_timeout,
             )
-            
-            if response.status_code in (200, 202):
+
+            if response.status in (200, 202):
                 self.logger.debug(f"Metrics pushed to Prometheus: {len(metrics)} metrics")
                 return True
             else:
-                self.logger.warning(f"Failed to push metrics to Prometheus: {response.status_code} {response.text}")
+                self.logger.warning(f"Failed to push metrics to Prometheus: {response.status} {await response.text()}")
                 return False
-                
+
+        except asyncio.TimeoutError:
+            self.logger.warning(f"Prometheus push timed out after {self.prometheus_timeout}s")
+            return False
         except Exception as e:
             self.logger.error(f"Error pushing metrics to Prometheus: {e}")
             return False
-    
-    def push_metrics_influxdb(self, metrics: Dict[str, Any], measurement: str = "system_metrics") -> bool:
+
+    async def push_metrics_influxdb(self, metrics: Dict[str, Any], measurement: str = "system_metrics") -> bool:
         """
         Send metrics to InfluxDB
         """
         if not self.influxdb_url or not self.influxdb_token:
             return False
-        
+
         try:
             # Build InfluxDB Line Protocol
             lines = []
             timestamp_ns = int(datetime.now().timestamp() * 1_000_000_000)
-            
+
             # Build tags and fields
             tags = f"host={os.environ.get('COMPUTERNAME', 'unknown')}"
-            
+
             fields = []
             for key, value in metrics.items():
                 if value is not None and isinstance(value, (int, float)):
                     fields.append(f"{key}={value}")
-            
+
             if fields:
                 line = f"{measurement},{tags} {','.join(fields)} {timestamp_ns}"
                 lines.append(line)
-            
+
             payload = "\n".join(lines)
-            
+
             url = f"{self.influxdb_url}/api/v2/write?org={self.influxdb_org}&bucket={self.influxdb_bucket}&precision=ns"
-            
-            response = requests.post(
+
+            response = await self._post(
                 url,
                 data=payload,
                 headers={
                     "Authorization": f"Token {self.influxdb_token}",
                     "Content-Type": "text/plain; charset=utf-8"
                 },
-                timeout=10
+                timeout=self.influxdb_timeout,
             )
-            
-            if response.status_code in (204, 200):
+
+            if response.status in (204, 200):
                 self.logger.debug(f"Metrics pushed to InfluxDB: {len(metrics)} metrics")
                 return True
             else:
-                self.logger.warning(f"Failed to push metrics to InfluxDB: {response.status_code} {response.text}")
+                self.logger.warning(f"Failed to push metrics to InfluxDB: {response.status} {await response.text()}")
                 return False
-                
+
+        except asyncio.TimeoutError:
+            self.logger.warning(f"InfluxDB push timed out after {self.influxdb_timeout}s")
+            return False
         except Exception as e:
             self.logger.error(f"Error pushing metrics to InfluxDB: {e}")
             return False
-    
-    def push_log_loki(self, message: str, level: str = "info", labels: Optional[Dict[str, str]] = None) -> bool:
+
+    async def push_log_loki(self, message: str, level: str = "info", labels: Optional[Dict[str, str]] = None) -> bool:
         """
         Send log message to Grafana Loki
         """
         if not self.loki_url:
             return False
-        
+
         try:
             default_labels = {
                 "job": "onec_backup_bot",
                 "level": level,
                 "host": os.environ.get('COMPUTERNAME', 'unknown')
             }
-            
+
             if labels:
                 default_labels.update(labels)
-            
+
             # Build Loki JSON payload
             payload = {
                 "streams": [
@@ -175,54 +222,80 @@ class GrafanaClient:
                     }
                 ]
             }
-            
-            auth = (self.loki_user, self.loki_password) if self.loki_user else None
-            
-            response = requests.post(
+
+            auth = aiohttp.BasicAuth(self.loki_user, self.loki_password or "") if self.loki_user else None
+
+            response = await self._post(
                 f"{self.loki_url}/loki/api/v1/push",
                 json=payload,
-                headers={"Content-Type": "application/json"},
                 auth=auth,
-                timeout=10
+                timeout=self.loki_timeout,
             )
-            
-            if response.status_code in (200, 204):
+
+            if response.status in (200, 204):
                 return True
             else:
-                self.logger.warning(f"Failed to push log to Loki: {response.status_code}")
+                self.logger.warning(f"Failed to push log to Loki: {response.status}")
                 return False
-                
+
+        except asyncio.TimeoutError:
+            self.logger.warning(f"Loki push timed out after {self.loki_timeout}s")
+            return False
         except Exception as e:
             self.logger.error(f"Error pushing log to Loki: {e}")
             return False
-    
-    def push_backup_event(self, status: str, message: str, metadata: Optional[Dict[str, Any]] = None):
+
+    async def _fan_out(self, pushes: Dict[str, Awaitable[bool]]) -> Dict[str, bool]:
+        """Run pushes concurrently; every backend is already bounded by its own timeout"""
+        if not pushes:
+            return {}
+        names: List[str] = list(pushes.keys())
+        results = await asyncio.gather(*pushes.values(), return_exceptions=True)
+        return {name: (res is True) for name, res in zip(names, results)}
+
+    async def push_metrics(self, metrics: Dict[str, Any], histograms: Optional[List[Any]] = None) -> Dict[str, bool]:
+        """
+        Push flat metrics to Prometheus and InfluxDB concurrently
+
+        Histograms (backup_stats.Histogram) go to the Pushgateway as native
+        histograms and to InfluxDB as _sum/_count fields.
         """
-        Push backup event to all configured backends
+        histograms = histograms or []
+        pushes: Dict[str, Awaitable[bool]] = {}
+        if self.prometheus_url:
+            extra_lines = [line for h in histograms for line in h.prometheus_lines()]
+            pushes["prometheus"] = self.push_metrics_prometheus(metrics, extra_lines=extra_lines)
+        if self.influxdb_url:
+            fields = dict(metrics)
+            for h in histograms:
+                fields.update(h.flat())
+            pushes["influxdb"] = self.push_metrics_influxdb(fields)
+        return await self._fan_out(pushes)
+
+    async def push_backup_event(self, status: str, message: str, metadata: Optional[Dict[str, Any]] = None) -> Dict[str, bool]:
+        """
+        Push backup event to all configured backends concurrently
         """
         # Prepare metrics
         metrics = {
             "backup_status": 1 if status == "success" else 0,
             "backup_timestamp": int(datetime.now().timestamp())
         }
-        
+
         if metadata:
             for key, value in metadata.items():
                 if isinstance(value, (int, float)):
                     metrics[f"backup_{key}"] = value
-        
-        # Push to Prometheus
+
+        pushes: Dict[str, Awaitable[bool]] = {}
         if self.prometheus_url:
-            self.push_metrics_prometheus(metrics, job="onec_backup_events")
-        
-        # Push to InfluxDB
+            pushes["prometheus"] = self.push_metrics_prometheus(metrics, job="onec_backup_events")
         if self.influxdb_url:
-            self.push_metrics_influxdb(metrics, measurement="backup_events")
-        
-        # Push log to Loki
+            pushes["influxdb"] = self.push_metrics_influxdb(metrics, measurement="backup_events")
         if self.loki_url:
-            self.push_log_loki(
+            pushes["loki"] = self.push_log_loki(
                 message,
                 level="info" if status == "success" else "error",
                 labels={"event_type": "backup"}
             )
+        return await self._fan_out(pushes)
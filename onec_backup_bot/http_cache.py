@@ -0,0 +1,94 @@
+"""
+Conditional-request cache for read endpoints
+Responses are keyed on the request path/query and the Database version
+counter (bumped by insert_backup and by commits from other processes, see
+Database.poll_version). A hit serves pre-serialized JSON, and clients
+presenting a matching ETag or Last-Modified get 304 without any database
+access. ETags hash the body, so API worker processes and restarts agree on
+them.
+"""
+from __future__ import annotations
+
+import hashlib
+import json
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from email.utils import formatdate, parsedate_to_datetime
+from typing import Any, Awaitable, Callable, Optional
+
+from aiohttp import web
+
+
+@dataclass
+class CachedResponse:
+    version: int
+    etag: str
+    last_modified: str
+    last_modified_ts: int
+    body: bytes
+    created: float = 0.0
+
+
+class ResponseCache:
+    def __init__(self, db, max_entries: int = 256):
+        self.db = db
+        self.max_entries = int(max_entries)
+        self._entries: "OrderedDict[str, CachedResponse]" = OrderedDict()
+
+    @staticmethod
+    def _not_modified(request: web.Request, entry: CachedResponse) -> bool:
+        inm = request.headers.get("If-None-Match")
+        if inm is not None:
+            tags = {t.strip() for t in inm.split(",")}
+            return "*" in tags or entry.etag in tags
+        ims = request.headers.get("If-Modified-Since")
+        if ims:
+            try:
+                return int(parsedate_to_datetime(ims).timestamp()) >= entry.last_modified_ts
+            except (TypeError, ValueError):
+                return False
+        return False
+
+    def _respond(self, request: web.Request, entry: CachedResponse) -> web.Response:
+        headers = {
+            "ETag": entry.etag,
+            "Last-Modified": entry.last_modified,
+            "Cache-Control": "no-cache",
+        }
+        if self._not_modified(request, entry):
+            return web.Response(status=304, headers=headers)
+        return web.Response(body=entry.body, content_type="application/json", headers=headers)
+
+    async def json(self, request: web.Request, producer: Callable[[], Awaitable[Any]],
+                   key: Optional[str] = None, max_age: Optional[float] = None) -> web.Response:
+        """Serve producer()'s JSON from cache while the catalog version is unchanged
+
+        max_age bounds the life of responses that also depend on something
+        outside the catalog (free disk space).
+        """
+        key = key or request.path_qs
+        version = self.db.poll_version()
+        entry = self._entries.get(key)
+        now = time.time()
+        if entry is None or entry.version != version or (max_age is not None and now - entry.created >= max_age):
+            data = await producer()
+            if isinstance(data, web.Response):
+                # Errors (e.g. 503 on DB timeout) are passed through uncached
+                return data
+            changed_at = int(self.db.version_changed_at) if max_age is None else int(now)
+            body = json.dumps(data, ensure_ascii=False, default=str).encode("utf-8")
+            entry = CachedResponse(
+                version=version,
+                etag=f'W/"{hashlib.blake2b(body, digest_size=12).hexdigest()}"',
+                last_modified=formatdate(changed_at, usegmt=True),
+                last_modified_ts=changed_at,
+                body=body,
+                created=now,
+            )
+            self._entries[key] = entry
+            if len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        else:
+            self._entries.move_to_end(key)
+        return self._respond(request, entry)
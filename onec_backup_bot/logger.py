@@ -1,20 +1,181 @@
+import atexit
+import copy
+import gzip
+import json
 import logging
+import logging.handlers
+import os
+import queue
+import shutil
+import threading
+import time
+from datetime import datetime
 from pathlib import Path
+from typing import Dict
 
-def setup_logger(name: str, log_dir: Path, log_file: str, level=logging.INFO) -> logging.Logger:
+# One queue listener per logger name, so a repeated setup_logger() replaces it cleanly
+_listeners: Dict[str, logging.handlers.QueueListener] = {}
+# Pause before retrying a rollover whose rename failed
+ROLLOVER_RETRY_SEC = 60.0
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line; ts and level come first so /lastlog can parse them"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        data = {
+            "ts": self.formatTime(record, self.datefmt),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+            "thread": record.threadName,
+        }
+        if record.exc_info:
+            data["exc"] = self.formatException(record.exc_info)
+        return json.dumps(data, ensure_ascii=False)
+
+
+class _QueueHandler(logging.handlers.QueueHandler):
+    """Keeps exc_info on the queued record, so JsonFormatter can still emit it as its own field"""
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # The stock prepare() folds the traceback into msg and clears exc_info; the queue is
+        # in-process, so the record need not be picklable - only its args resolved now
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+
+class RotatingCompressingFileHandler(logging.FileHandler):
+    """
+    Rotates by size and at local midnight (whichever comes first). A rotated
+    segment is renamed to `<log_file>.YYYY-mm-dd_HHMMSS` and gzipped on a
+    background thread; only the newest `backup_count` segments are kept.
+    """
+
+    def __init__(self, filename: Path, *, max_bytes: int = 10 * 1024 * 1024, daily: bool = True,
+                 backup_count: int = 14, compress: bool = True, encoding: str = "utf-8"):
+        super().__init__(filename, encoding=encoding, delay=False)
+        self.max_bytes = int(max_bytes)
+        self.daily = daily
+        self.backup_count = int(backup_count)
+        self.compress = compress
+        self._next_rollover = self._compute_next_rollover()
+        self._retry_at = 0.0  # after a failed rename, no rollover before this
+
+    @staticmethod
+    def _compute_next_rollover() -> float:
+        now = datetime.now()
+        midnight = datetime(now.year, now.month, now.day).timestamp()
+        return midnight + 86400
+
+    def shouldRollover(self, record: logging.LogRecord) -> bool:
+        now = time.time()
+        if now < self._retry_at:
+            return False
+        if self.daily and now >= self._next_rollover:
+            return True
+        if self.max_bytes > 0 and self.stream is not None:
+            return self.stream.tell() >= self.max_bytes
+        return False
+
+    def doRollover(self):
+        if self.stream:
+            self.stream.close()
+            self.stream = None
+        base = Path(self.baseFilename)
+        rotated = base.with_name(f"{base.name}.{datetime.now().strftime('%Y-%m-%d_%H%M%S')}")
+        n = 1
+        while rotated.exists() or rotated.with_name(rotated.name + ".gz").exists():
+            rotated = base.with_name(f"{base.name}.{datetime.now().strftime('%Y-%m-%d_%H%M%S')}-{n}")
+            n += 1
+        try:
+            if base.exists() and base.stat().st_size > 0:
+                os.replace(base, rotated)
+                if self.compress:
+                    threading.Thread(target=self._gzip, args=(rotated,), name="log-gzip", daemon=True).start()
+            self._prune(base)
+            self._next_rollover = self._compute_next_rollover()
+        except OSError:
+            # Another process (daemon and a CLI one-shot share the log) holds the file open on
+            # Windows: keep appending and try again in a minute instead of on every record
+            self._retry_at = time.time() + ROLLOVER_RETRY_SEC
+        self.stream = self._open()
+
+    @staticmethod
+    def _gzip(path: Path):
+        try:
+            target = path.with_name(path.name + ".gz")
+            # Hidden temp name: log readers never see a half-written archive
+            partial = path.with_name(f".{path.name}.gz.part")
+            with open(path, "rb") as src, gzip.open(partial, "wb", compresslevel=6) as dst:
+                shutil.copyfileobj(src, dst, 1024 * 1024)
+            st = path.stat()
+            # Keep the segment's mtime so readers can still order segments by age
+            os.utime(partial, (st.st_atime, st.st_mtime))
+            os.replace(partial, target)
+            path.unlink()
+        except OSError:
+            pass
+
+    def _prune(self, base: Path):
+        if self.backup_count <= 0:
+            return
+        segments = sorted(base.parent.glob(f"{base.name}.*"), key=lambda p: p.stat().st_mtime, reverse=True)
+        for old in segments[self.backup_count:]:
+            try:
+                old.unlink()
+            except OSError:
+                pass
+
+    def emit(self, record: logging.LogRecord):
+        try:
+            if self.shouldRollover(record):
+                self.doRollover()
+            super().emit(record)
+        except Exception:
+            self.handleError(record)
+
+
+def setup_logger(name: str, log_dir: Path, log_file: str, level=logging.INFO, *,
+                 max_mb: float = 10.0, daily: bool = True, backup_count: int = 14,
+                 compress: bool = True, json_lines: bool = False) -> logging.Logger:
+    """
+    Callers only pay for enqueueing a record; file and console I/O, rotation
+    and compression happen on the queue listener's thread.
+    """
     log_dir.mkdir(parents=True, exist_ok=True)
     logger = logging.getLogger(name)
     logger.setLevel(level)
     logger.handlers.clear()
+    previous = _listeners.pop(name, None)
+    if previous is not None:
+        previous.stop()
 
     fmt = logging.Formatter('[%(asctime)s] %(levelname)s %(name)s: %(message)s', datefmt='%Y-%m-%d %H:%M:%S')
+    file_fmt = JsonFormatter(datefmt='%Y-%m-%d %H:%M:%S') if json_lines else fmt
 
-    fh = logging.FileHandler(log_dir / log_file, encoding='utf-8')
-    fh.setFormatter(fmt)
-    logger.addHandler(fh)
+    fh = RotatingCompressingFileHandler(log_dir / log_file, max_bytes=int(max_mb * 1024 * 1024),
+                                        daily=daily, backup_count=backup_count, compress=compress)
+    fh.setFormatter(file_fmt)
 
     sh = logging.StreamHandler()
     sh.setFormatter(fmt)
-    logger.addHandler(sh)
+
+    log_queue: "queue.SimpleQueue[logging.LogRecord]" = queue.SimpleQueue()
+    logger.addHandler(_QueueHandler(log_queue))
+    listener = logging.handlers.QueueListener(log_queue, fh, sh, respect_handler_level=True)
+    listener.start()
+    _listeners[name] = listener
 
     return logger
+
+
+def shutdown_logging():
+    """Flush queued records and stop all listener threads"""
+    for name in list(_listeners):
+        _listeners.pop(name).stop()
+
+
+atexit.register(shutdown_logging)
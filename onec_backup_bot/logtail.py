@@ -0,0 +1,207 @@
+"""
+Log access layer for /lastlog and /api/logs
+Reads the log backward from the end in blocks, so showing the last N records
+costs O(N) regardless of file size. Supports level/regex/time-range filters,
+a sparse in-memory offset index for seeking to a time range, and spans
+rotated (`backup.log.1`, `backup.log.2025-01-15`) and gzip-compressed
+segments.
+"""
+from __future__ import annotations
+
+import bisect
+import gzip
+import os
+import re
+import threading
+from collections import deque
+from dataclasses import dataclass, field
+from datetime import datetime
+from pathlib import Path
+from typing import Deque, Dict, Iterator, List, Optional, Pattern, Tuple
+
+BLOCK_SIZE = 64 * 1024
+INDEX_STRIDE = 256 * 1024  # bytes between index checkpoints
+
+_HEADER_RE = re.compile(rb'^\[(\d{4}-\d\d-\d\d \d\d:\d\d:\d\d)\] (\w+) ')
+# JSON-lines log format (logging.json_lines: true)
+_JSON_HEADER_RE = re.compile(rb'^\{"ts": "(\d{4}-\d\d-\d\d \d\d:\d\d:\d\d)", "level": "(\w+)"')
+_LEVELS = {"DEBUG": 10, "INFO": 20, "WARNING": 30, "WARN": 30, "ERROR": 40, "CRITICAL": 50}
+
+
+@dataclass
+class Record:
+    ts: Optional[datetime]
+    level: str
+    text: str
+
+
+def _parse_header(line: bytes) -> Optional[Tuple[datetime, str]]:
+    m = _HEADER_RE.match(line) or _JSON_HEADER_RE.match(line)
+    if not m:
+        return None
+    try:
+        return datetime.strptime(m.group(1).decode(), "%Y-%m-%d %H:%M:%S"), m.group(2).decode()
+    except ValueError:
+        return None
+
+
+def level_value(level: Optional[str]) -> int:
+    return _LEVELS.get((level or "").upper(), 0)
+
+
+def _reverse_lines(f, end: int) -> Iterator[bytes]:
+    """Yield lines of f ending before offset `end`, last line first"""
+    pos = end
+    buf = b""
+    while pos > 0:
+        size = min(BLOCK_SIZE, pos)
+        pos -= size
+        f.seek(pos)
+        chunk = f.read(size) + buf
+        lines = chunk.split(b"\n")
+        buf = lines[0]
+        for line in reversed(lines[1:]):
+            yield line
+    yield buf
+
+
+def _records_backward(lines: Iterator[bytes]) -> Iterator[Record]:
+    """Group lines (newest first) into records; continuation lines attach to their header"""
+    pending: List[bytes] = []
+    for line in lines:
+        line = line.rstrip(b"\r")
+        if not line:
+            continue
+        header = _parse_header(line)
+        if header is None:
+            pending.append(line)
+            continue
+        pending.append(line)
+        text = b"\n".join(reversed(pending)).decode("utf-8", errors="replace")
+        pending = []
+        yield Record(ts=header[0], level=header[1], text=text)
+    if pending:
+        yield Record(ts=None, level="", text=b"\n".join(reversed(pending)).decode("utf-8", errors="replace"))
+
+
+def _records_forward(lines: Iterator[bytes]) -> Iterator[Record]:
+    current: Optional[Record] = None
+    parts: List[bytes] = []
+    for line in lines:
+        line = line.rstrip(b"\r\n")
+        if not line:
+            continue
+        header = _parse_header(line)
+        if header is not None:
+            if parts:
+                yield Record(ts=current.ts if current else None, level=current.level if current else "",
+                             text=b"\n".join(parts).decode("utf-8", errors="replace"))
+            current = Record(ts=header[0], level=header[1], text="")
+            parts = [line]
+        else:
+            parts.append(line)
+    if parts:
+        yield Record(ts=current.ts if current else None, level=current.level if current else "",
+                     text=b"\n".join(parts).decode("utf-8", errors="replace"))
+
+
+@dataclass
+class _SparseIndex:
+    size: int = 0  # bytes scanned so far (always at a line start)
+    offsets: List[int] = field(default_factory=list)
+    stamps: List[datetime] = field(default_factory=list)
+    inode: Optional[Tuple[int, int]] = None
+
+
+_indexes: Dict[str, _SparseIndex] = {}
+_indexes_lock = threading.Lock()
+
+
+def _sparse_index(path: Path) -> _SparseIndex:
+    """Checkpoints (offset, timestamp) every INDEX_STRIDE bytes, extended incrementally"""
+    st = path.stat()
+    key = str(path)
+    with _indexes_lock:
+        idx = _indexes.get(key)
+        if idx is None or idx.inode != (st.st_dev, st.st_ino) or st.st_size < idx.size:
+            idx = _SparseIndex(inode=(st.st_dev, st.st_ino))
+            _indexes[key] = idx
+        if st.st_size - idx.size < INDEX_STRIDE:
+            return idx
+        with open(path, "rb") as f:
+            f.seek(idx.size)
+            offset = idx.size
+            last = idx.offsets[-1] if idx.offsets else -INDEX_STRIDE
+            for line in f:
+                if not line.endswith(b"\n"):
+                    break  # partial last line, index it next time
+                if offset - last >= INDEX_STRIDE:
+                    header = _parse_header(line)
+                    if header is not None:
+                        idx.offsets.append(offset)
+                        idx.stamps.append(header[0])
+                        last = offset
+                offset += len(line)
+            idx.size = offset
+        return idx
+
+
+def log_segments(log_dir: Path, log_file: str) -> List[Path]:
+    """Current log first, then rotated/compressed segments newest first"""
+    current = log_dir / log_file
+    rotated = [p for p in log_dir.glob(f"{log_file}.*") if p.is_file()]
+    rotated.sort(key=lambda p: p.stat().st_mtime, reverse=True)
+    return ([current] if current.exists() else []) + rotated
+
+
+def search(log_dir: Path, log_file: str, *, limit: int = 100, level: Optional[str] = None,
+           pattern: Optional[str] = None, since: Optional[datetime] = None,
+           until: Optional[datetime] = None) -> List[str]:
+    """Return up to `limit` newest matching records in chronological order"""
+    min_level = level_value(level)
+    regex: Optional[Pattern[str]] = re.compile(pattern, re.IGNORECASE) if pattern else None
+
+    def _match(rec: Record) -> bool:
+        if min_level and level_value(rec.level) < min_level:
+            return False
+        if until is not None and rec.ts is not None and rec.ts > until:
+            return False
+        if regex is not None and not regex.search(rec.text):
+            return False
+        return True
+
+    found: List[str] = []
+    for segment in log_segments(log_dir, log_file):
+        if len(found) >= limit:
+            break
+        if since is not None and datetime.fromtimestamp(segment.stat().st_mtime) < since:
+            break  # this segment and all older ones end before the range
+        if segment.suffix == ".gz":
+            # No backward seeking in gzip: stream forward keeping only the newest matches
+            keep: Deque[str] = deque(maxlen=limit - len(found))
+            with gzip.open(segment, "rb") as f:
+                for rec in _records_forward(f):
+                    if since is not None and rec.ts is not None and rec.ts < since:
+                        continue
+                    if _match(rec):
+                        keep.append(rec.text)
+            found.extend(reversed(keep))
+            continue
+
+        with open(segment, "rb") as f:
+            end = f.seek(0, os.SEEK_END)
+            if until is not None:
+                # Start just after the first checkpoint newer than `until`
+                idx = _sparse_index(segment)
+                pos = bisect.bisect_right(idx.stamps, until)
+                if pos < len(idx.offsets):
+                    end = idx.offsets[pos]
+            for rec in _records_backward(_reverse_lines(f, end)):
+                if since is not None and rec.ts is not None and rec.ts < since:
+                    break
+                if _match(rec):
+                    found.append(rec.text)
+                    if len(found) >= limit:
+                        break
+    found.reverse()
+    return found
@@ -0,0 +1,313 @@
+"""
+Per-date archive manifests and catalog reconciliation
+Every `YYYY-MM-DD` folder carries a manifest.json describing its archives
+(catalog id, size, checksum, codec, key id, fingerprint), so a folder copied
+back from tape or another disk still explains itself. reconcile() scans all
+date folders of backup_dir (and of the slow tier, tier_dir) in parallel with
+os.scandir, joins them with the `backups` table in memory and reports
+(optionally repairs) the differences:
+
+    moved     row points elsewhere, archive found in a tier       -> path and tier updated
+    missing   OK row whose archive is gone                        -> status MISSING
+    returned  MISSING row whose archive is back                   -> status OK
+    orphan    archive without a row                               -> row adopted from manifest/file
+              (a bare .dt only with a manifest entry; dumps of failed
+              backups and dumps kept next to an archive are skipped)
+    size      size differs from the catalog                       -> flagged only
+    checksum  sha256 differs (with checksums=True)                -> flagged only
+    manifest  manifest.json out of date                           -> rewritten
+    duplicate same archive in both tiers (interrupted migration)  -> flagged only
+"""
+from __future__ import annotations
+
+import datetime as dt
+import json
+import os
+import re
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+from .compression import infer_spec
+from .fileio import IOOptions, file_sha256
+
+MANIFEST_NAME = "manifest.json"
+ARCHIVE_SUFFIXES = (".dt", ".zip", ".zst", ".lz4", ".xz", ".enc")
+_DATE_DIR_RE = re.compile(r"^\d{4}-\d{2}-\d{2}$")
+_NAME_TS_RE = re.compile(r"(\d{4}-\d{2}-\d{2})_(\d{2})-(\d{2})-(\d{2})")
+_ENTRY_KEYS = ("id", "ts", "base", "size_bytes", "raw_size_bytes", "sha256", "codec", "key_id", "fingerprint")
+
+
+def load_manifest(folder: Path) -> Dict[str, Dict[str, Any]]:
+    """Archives of one date folder by file name ({} if there is no readable manifest)"""
+    try:
+        with open(folder / MANIFEST_NAME, "r", encoding="utf-8") as f:
+            return dict(json.load(f).get("archives") or {})
+    except (OSError, ValueError, AttributeError):
+        return {}
+
+
+def save_manifest(folder: Path, archives: Dict[str, Dict[str, Any]]):
+    """Atomic rewrite: readers never see a half-written manifest"""
+    data = {"version": 1, "folder": folder.name, "archives": dict(sorted(archives.items()))}
+    partial = folder / f".{MANIFEST_NAME}.part"
+    with open(partial, "w", encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False, indent=1)
+    os.replace(partial, folder / MANIFEST_NAME)
+
+
+def manifest_entry(row) -> Dict[str, Any]:
+    keys = row.keys()
+    return {k: row[k] for k in _ENTRY_KEYS if k in keys}
+
+
+def add_to_manifest(path: Path, entry: Dict[str, Any]):
+    """Record one archive; callers hold the backup lock, so read-modify-write is safe"""
+    archives = load_manifest(path.parent)
+    archives[path.name] = entry
+    save_manifest(path.parent, archives)
+
+
+def remove_from_manifest(path: Path):
+    """Forget one archive; a folder left with no archives loses its manifest and, if empty, itself"""
+    archives = load_manifest(path.parent)
+    if archives.pop(path.name, None) is None:
+        return
+    if archives:
+        save_manifest(path.parent, archives)
+        return
+    (path.parent / MANIFEST_NAME).unlink(missing_ok=True)
+    try:
+        path.parent.rmdir()
+    except OSError:
+        pass  # other files (the archive itself, a kept .dt) are still there
+
+
+def _is_archive(name: str) -> bool:
+    return not name.startswith(".") and name.lower().endswith(ARCHIVE_SUFFIXES)
+
+
+def _scan_folder(folder: str) -> Tuple[str, Dict[str, Tuple[int, float]], Dict[str, Dict[str, Any]]]:
+    files: Dict[str, Tuple[int, float]] = {}
+    has_manifest = False
+    with os.scandir(folder) as it:
+        for entry in it:
+            if entry.name == MANIFEST_NAME:
+                has_manifest = True
+            elif _is_archive(entry.name) and entry.is_file(follow_symlinks=False):
+                st = entry.stat(follow_symlinks=False)
+                files[entry.name] = (st.st_size, st.st_mtime)
+    return folder, files, load_manifest(Path(folder)) if has_manifest else {}
+
+
+def dump_name(archive_name: str) -> str:
+    """Name of the .dt an archive was compressed from: X.zip.enc, X.dt.zst -> X.dt"""
+    stem = archive_name
+    while True:
+        base, ext = os.path.splitext(stem)
+        if not base or ext.lower() not in ARCHIVE_SUFFIXES:
+            return stem + ".dt"
+        stem = base
+
+
+def _rel_key(path: str) -> str:
+    """`YYYY-MM-DD/name` of a catalog path, independent of where backup_dir lives now"""
+    # Plain string ops: this runs once per catalog row
+    parts = path.replace("\\", "/").rsplit("/", 2)
+    return "/".join(parts[-2:])
+
+
+def _ts_from_name(name: str, mtime: float) -> str:
+    m = _NAME_TS_RE.search(name)
+    if m:
+        return f"{m.group(1)}T{m.group(2)}:{m.group(3)}:{m.group(4)}"
+    return dt.datetime.fromtimestamp(mtime).isoformat(timespec="seconds")
+
+
+@dataclass
+class Finding:
+    kind: str
+    path: str
+    backup_id: Optional[int] = None
+    detail: str = ""
+
+
+@dataclass
+class ReconcileReport:
+    folders: int = 0
+    archives: int = 0
+    rows: int = 0
+    findings: List[Finding] = field(default_factory=list)
+    repaired: bool = False
+    seconds: float = 0.0
+
+    def count(self, kind: str) -> int:
+        return sum(1 for f in self.findings if f.kind == kind)
+
+    @property
+    def problems(self) -> int:
+        """Findings that need a human even after repair"""
+        return sum(1 for f in self.findings if f.kind in ("size", "checksum", "duplicate")) + \
+            (0 if self.repaired else sum(1 for f in self.findings if f.kind in ("missing", "orphan", "moved")))
+
+
+def _under(path: str, prefix: str) -> bool:
+    return os.path.normcase(os.path.normpath(path)).startswith(os.path.normcase(prefix))
+
+
+def reconcile(db, backup_dir: Path, *, tier_dir: Optional[Path] = None, repair: bool = False,
+              checksums: bool = False, workers: int = 16, io_opts: Optional[IOOptions] = None) -> ReconcileReport:
+    started = dt.datetime.now()
+    roots = [str(backup_dir)]
+    if tier_dir:
+        # An unmounted share would otherwise turn every migrated archive into MISSING
+        if not Path(tier_dir).is_dir():
+            raise OSError(f"tier_dir {tier_dir} is not reachable")
+        roots.append(str(tier_dir))
+    prefixes = {root: os.path.join(root, "") for root in roots}
+    tiers = {root: "fast" if i == 0 else "slow" for i, root in enumerate(roots)}
+    report = ReconcileReport()
+
+    folders: List[Tuple[str, str]] = []
+    for root in roots:
+        with os.scandir(root) as it:
+            folders.extend((root, e.path) for e in it
+                           if _DATE_DIR_RE.match(e.name) and e.is_dir(follow_symlinks=False))
+    # date/name -> (size, mtime, root); the slow tier's copy of a key already seen goes to `shadowed`
+    on_disk: Dict[str, Tuple[int, float, str]] = {}
+    shadowed: Dict[str, Tuple[int, float, str]] = {}
+    manifests: Dict[Tuple[str, str], Dict[str, Dict[str, Any]]] = {}
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+        scans = pool.map(_scan_folder, [f for _, f in folders])
+        for (root, _), (folder, files, manifest) in zip(folders, scans):
+            name = Path(folder).name
+            manifests[(root, name)] = manifest
+            for file_name, (size, mtime) in files.items():
+                key = f"{name}/{file_name}"
+                (shadowed if key in on_disk else on_disk)[key] = (size, mtime, root)
+    report.folders, report.archives = len(folders), len(on_disk) + len(shadowed)
+
+    rows = db.archive_rows()
+    report.rows = len(rows)
+    by_key: Dict[str, Any] = {}
+    for row in rows:
+        by_key.setdefault(_rel_key(row["path"]), row)  # rows come in id order: the oldest row wins
+
+    paths: List[Tuple[int, str, str]] = []
+    statuses: List[Tuple[int, str]] = []
+    inserts: List[Dict[str, Any]] = []
+    to_hash: List[Tuple[str, str, Optional[int]]] = []  # (path, recorded sha256, backup id)
+    # What each (root, folder) manifest should contain after this pass
+    expected: Dict[Tuple[str, str], Dict[str, Dict[str, Any]]] = {(r, Path(f).name): {} for r, f in folders}
+
+    for key, row in by_key.items():
+        folder, name = key.split("/", 1)
+        if key not in on_disk:
+            if row["status"] == "OK" and not os.path.isfile(row["path"]):
+                report.findings.append(Finding("missing", row["path"], row["id"]))
+                statuses.append((row["id"], "MISSING"))
+            continue
+        size, _, root = on_disk[key]
+        other = shadowed.get(key)
+        if other is not None:
+            if _under(row["path"], prefixes[other[2]]):
+                (size, _, root), other = other, on_disk[key]
+            report.findings.append(Finding("duplicate", prefixes[other[2]] + folder + os.sep + name, row["id"],
+                                           f"catalog copy: {prefixes[root] + folder + os.sep + name}"))
+        actual = prefixes[root] + folder + os.sep + name
+        if row["status"] == "MISSING":
+            report.findings.append(Finding("returned", actual, row["id"]))
+            statuses.append((row["id"], "OK"))
+        if row["path"] != actual and os.path.normcase(os.path.normpath(row["path"])) != os.path.normcase(actual):
+            report.findings.append(Finding("moved", actual, row["id"], f"catalog: {row['path']}"))
+            paths.append((row["id"], actual, tiers[root]))
+        if row["size_bytes"] is not None and row["size_bytes"] != size:
+            report.findings.append(Finding("size", actual, row["id"],
+                                           f"{size} bytes, catalog {row['size_bytes']}"))
+        want = row["sha256"] or manifests.get((root, folder), {}).get(name, {}).get("sha256")
+        if checksums and want:
+            to_hash.append((actual, want, row["id"]))
+        expected.setdefault((root, folder), {})[name] = manifest_entry(row)
+
+    # Dumps kept next to their archive (delete_dt_after_compress: false) and dumps of failed backups
+    skip = {_rel_key(p) for p in db.failed_paths()}
+    for key in list(on_disk) + list(shadowed):
+        folder, name = key.split("/", 1)
+        if not name.lower().endswith(".dt"):
+            skip.add(f"{folder}/{dump_name(name)}")
+
+    for key, (size, mtime, root) in on_disk.items():
+        if key in by_key or key in skip:
+            continue
+        folder, name = key.split("/", 1)
+        actual = prefixes[root] + folder + os.sep + name
+        known = manifests.get((root, folder), {}).get(name, {})
+        if not known and name.lower().endswith(".dt"):
+            # Could be a truncated dump: only a manifest entry vouches for a bare .dt
+            report.findings.append(Finding("orphan", actual, None, "bare .dt without manifest entry, not adopted"))
+            continue
+        report.findings.append(Finding("orphan", actual, known.get("id"),
+                                       "described by manifest" if known else "no manifest entry"))
+        if known.get("size_bytes") is not None and known["size_bytes"] != size:
+            report.findings.append(Finding("size", actual, known.get("id"),
+                                           f"{size} bytes, manifest {known['size_bytes']}"))
+        spec = known.get("codec") or str(infer_spec(name))
+        inserts.append({
+            "ts": known.get("ts") or _ts_from_name(name, mtime),
+            "path": actual,
+            "size_bytes": size,
+            "raw_size_bytes": known.get("raw_size_bytes"),
+            "stderr": "adopted by reconcile",
+            "fingerprint": known.get("fingerprint"),
+            "base": known.get("base"),
+            "codec": spec,
+            "key_id": known.get("key_id"),
+            "sha256": known.get("sha256"),
+            "tier": tiers[root],
+        })
+        if checksums and known.get("sha256"):
+            to_hash.append((actual, known["sha256"], known.get("id")))
+        expected.setdefault((root, folder), {})[name] = {k: v for k, v in inserts[-1].items()
+                                                         if k in _ENTRY_KEYS}
+
+    if to_hash:
+        def _check(item):
+            path, want, backup_id = item
+            got = file_sha256(Path(path), io_opts)
+            return path, want, got, backup_id
+
+        with ThreadPoolExecutor(max_workers=max(1, min(workers, 4))) as pool:
+            for path, want, got, backup_id in pool.map(_check, to_hash):
+                if got != want:
+                    report.findings.append(Finding("checksum", path, backup_id,
+                                                   f"sha256 {got[:16]}…, recorded {want[:16]}…"))
+
+    stale_folders = []
+    for (root, folder), entries in expected.items():
+        current = manifests.get((root, folder), {})
+        if set(current) != set(entries):
+            report.findings.append(Finding("manifest", prefixes[root] + folder + os.sep + MANIFEST_NAME, None,
+                                           f"{len(current)} entries, expected {len(entries)}"))
+            stale_folders.append((root, folder))
+
+    if repair:
+        db.apply_reconciliation(paths=paths, statuses=statuses, inserts=inserts)
+        if inserts:
+            # Adopted rows got new ids: put them into the manifests
+            ids = {_rel_key(r["path"]): r["id"] for r in db.archive_rows()}
+            for (_, folder), entries in expected.items():
+                for name, entry in entries.items():
+                    entry.setdefault("id", ids.get(f"{folder}/{name}"))
+        for (root, folder), entries in expected.items():
+            current = manifests.get((root, folder), {})
+            if (root, folder) in stale_folders or any(current.get(n, {}).get("id") != e.get("id")
+                                                      for n, e in entries.items()):
+                # Values the catalog lacks (e.g. sha256 of old rows) are kept from the manifest
+                save_manifest(Path(root) / folder, {
+                    n: {**current.get(n, {}), **{k: v for k, v in e.items() if v is not None}}
+                    for n, e in entries.items()})
+        report.repaired = True
+
+    report.seconds = (dt.datetime.now() - started).total_seconds()
+    return report
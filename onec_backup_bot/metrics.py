@@ -1,7 +1,10 @@
 from __future__ import annotations
 
-import psutil
+import os
 from pathlib import Path
+from typing import List, Optional
+
+import psutil
 
 
 def _cpu_percent_reliable() -> float:
@@ -40,3 +43,47 @@ def collect_system_metrics(backup_dir: Path):
         "mem_percent": mem,
         "disk_percent": disk,
     }
+
+
+# 1C client executables (thick, thin); DESIGNER runs share the 1cv8 name
+_ONEC_CLIENT_NAMES = {"1cv8.exe", "1cv8c.exe", "1cv8", "1cv8c"}
+
+
+def _norm_path(path: str) -> str:
+    return os.path.normcase(os.path.abspath(path.strip().strip('"')))
+
+
+def _uses_base(proc, args: List[str], base: str) -> bool:
+    """The process was started with /F <base> or holds a file of the base open"""
+    for i, arg in enumerate(args):
+        if arg.upper().startswith("/F"):
+            path = arg[2:] or (args[i + 1] if i + 1 < len(args) else "")
+            if path and _norm_path(path) == base:
+                return True
+    try:
+        return any(os.path.dirname(_norm_path(f.path)) == base for f in proc.open_files())
+    except (psutil.AccessDenied, psutil.NoSuchProcess, OSError):
+        return False
+
+
+def count_onec_clients(base_path: Optional[str] = None) -> int:
+    """Local 1C client processes (of the file base at base_path, if given), not counting DESIGNER dumps.
+
+    Only this host is seen: users working with a shared file base from their own workstations are not counted.
+    """
+    base = _norm_path(base_path) if base_path else None
+    count = 0
+    for proc in psutil.process_iter(["name", "cmdline"]):
+        try:
+            name = (proc.info.get("name") or "").lower()
+            if name not in _ONEC_CLIENT_NAMES:
+                continue
+            args = proc.info.get("cmdline") or []
+            if "/DUMPIB" in " ".join(args).upper():
+                continue
+            if base is not None and not _uses_base(proc, args, base):
+                continue
+            count += 1
+        except (psutil.NoSuchProcess, psutil.AccessDenied):
+            continue
+    return count
@@ -13,6 +13,8 @@ from typing import Dict, Any, List, Optional
 from datetime import datetime
 import socket
 
+from .collectors import get_registry
+
 
 def get_rdp_sessions() -> List[Dict[str, str]]:
     """
@@ -70,12 +72,10 @@ def get_logged_in_users() -> List[Dict[str, Any]]:
     return users
 
 
-def get_network_stats() -> Dict[str, Any]:
-    """Get network interface statistics"""
+def get_network_io() -> Dict[str, Any]:
+    """Get network interface counters (cheap)"""
     try:
         net_io = psutil.net_io_counters()
-        net_connections = len(psutil.net_connections())
-        
         return {
             "bytes_sent": net_io.bytes_sent,
             "bytes_recv": net_io.bytes_recv,
@@ -85,12 +85,27 @@ def get_network_stats() -> Dict[str, Any]:
             "errout": net_io.errout,
             "dropin": net_io.dropin,
             "dropout": net_io.dropout,
-            "active_connections": net_connections
         }
     except Exception:
         return {}
 
 
+def get_network_connections_count() -> int:
+    """Count open network connections (walks the whole connection table)"""
+    try:
+        return len(psutil.net_connections())
+    except Exception:
+        return 0
+
+
+def get_network_stats() -> Dict[str, Any]:
+    """Get network interface statistics"""
+    stats = get_network_io()
+    if stats:
+        stats["active_connections"] = get_network_connections_count()
+    return stats
+
+
 def get_disk_io_stats() -> Dict[str, Any]:
     """Get disk I/O statistics"""
     try:
@@ -243,52 +258,11 @@ def get_system_info() -> Dict[str, str]:
 def collect_all_metrics(backup_dir: Optional[Path] = None) -> Dict[str, Any]:
     """
     Collect ALL available system metrics
-    This is the main function to use for comprehensive monitoring
+    This is the main function to use for comprehensive monitoring.
+    Only collectors whose interval has elapsed are re-run; the rest are
+    served from the registry cache (see collectors.py).
     """
-    metrics = {
-        "timestamp": datetime.now().isoformat(),
-        "timestamp_unix": int(datetime.now().timestamp())
-    }
-    
-    # System info
-    metrics["system"] = get_system_info()
-    metrics["uptime_seconds"] = get_system_uptime()
-    
-    # CPU
-    cpu_data = get_cpu_detailed()
-    metrics["cpu_percent"] = cpu_data.get("percent", 0)
-    metrics["cpu"] = cpu_data
-    
-    # Memory
-    mem_data = get_memory_detailed()
-    metrics["memory_percent"] = mem_data.get("percent", 0)
-    metrics["memory"] = mem_data
-    
-    # Disk
-    disk_data = get_disk_detailed(backup_dir)
-    metrics["disk_percent"] = disk_data.get("backup_disk_percent", 0)
-    metrics["disk"] = disk_data
-    
-    # Disk I/O
-    metrics["disk_io"] = get_disk_io_stats()
-    
-    # Network
-    metrics["network"] = get_network_stats()
-    
-    # Processes
-    metrics["processes"] = get_process_stats()
-    
-    # Users
-    metrics["logged_users"] = get_logged_in_users()
-    metrics["logged_users_count"] = len(metrics["logged_users"])
-    
-    # RDP Sessions (Windows only)
-    if platform.system() == "Windows":
-        rdp_sessions = get_rdp_sessions()
-        metrics["rdp_sessions"] = rdp_sessions
-        metrics["rdp_active_count"] = len(rdp_sessions)
-    
-    return metrics
+    return get_registry(backup_dir).collect()
 
 
 def flatten_metrics_for_prometheus(metrics: Dict[str, Any]) -> Dict[str, float]:
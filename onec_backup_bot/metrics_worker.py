@@ -3,120 +3,146 @@ Background worker for periodic metrics collection and sending to Grafana
 """
 from __future__ import annotations
 
+import asyncio
+import concurrent.futures
 import os
-import threading
-import time
 from pathlib import Path
 from typing import Optional
 
 from .metrics_extended import collect_all_metrics, flatten_metrics_for_prometheus
 from .grafana import GrafanaClient
+from .tracing import get_tracer
 
 
 class MetricsWorker:
-    """Background thread that periodically collects and sends metrics"""
-    
-    def __init__(self, backup_dir: Path, logger, interval: int = 60):
+    """Periodic metrics task running on a shared asyncio event loop"""
+
+    def __init__(self, backup_dir: Path, logger, interval: int = 60, backup_stats=None, alerts=None):
         """
         Args:
             backup_dir: Path to backup directory for disk metrics
             logger: Logger instance
             interval: Metrics collection interval in seconds (default 60)
+            backup_stats: Optional BackupStats for backup histograms and SLO gauges
+            alerts: Optional AlertDispatcher fed with every sample
         """
         self.backup_dir = backup_dir
         self.logger = logger
+        self.backup_stats = backup_stats
+        self.alerts = alerts
         self.interval = int(os.getenv("METRICS_INTERVAL", interval))
         self.grafana = GrafanaClient(logger)
-        
-        self._stop_event = threading.Event()
-        self._thread: Optional[threading.Thread] = None
-        
-    def start(self):
-        """Start the metrics worker thread"""
-        if self._thread and self._thread.is_alive():
+
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._future: Optional[concurrent.futures.Future] = None
+        self._stop: Optional[asyncio.Event] = None
+
+    def start(self, loop: asyncio.AbstractEventLoop):
+        """Schedule the metrics task on a running event loop (thread-safe)"""
+        if self._future and not self._future.done():
             self.logger.warning("Metrics worker already running")
             return
-        
-        # Check if any Grafana endpoint is configured
-        if not any([
-            self.grafana.prometheus_url,
-            self.grafana.influxdb_url,
-            self.grafana.loki_url
-        ]):
+
+        # Check if any Grafana endpoint is configured (alerts need the samples either way)
+        if not self.grafana.enabled and self.alerts is None:
             self.logger.info("No Grafana endpoints configured, metrics worker disabled")
             return
-        
-        self._stop_event.clear()
-        self._thread = threading.Thread(target=self._run, daemon=True, name="MetricsWorker")
-        self._thread.start()
+
+        self._loop = loop
+        self._future = asyncio.run_coroutine_threadsafe(self._run(), loop)
         self.logger.info(f"Metrics worker started (interval: {self.interval}s)")
-    
+
     def stop(self):
-        """Stop the metrics worker thread"""
-        if not self._thread:
+        """Stop the metrics task and wait for it to finish"""
+        if not self._future or not self._loop:
             return
-        
+
         self.logger.info("Stopping metrics worker...")
-        self._stop_event.set()
-        
-        if self._thread.is_alive():
-            self._thread.join(timeout=5)
-        
+        if self._stop is not None and not self._loop.is_closed():
+            self._loop.call_soon_threadsafe(self._stop.set)
+        try:
+            self._future.result(timeout=5)
+        except Exception:
+            self._future.cancel()
+        self._future = None
+
         self.logger.info("Metrics worker stopped")
-    
-    def _run(self):
-        """Main worker loop"""
-        while not self._stop_event.is_set():
-            try:
-                self._collect_and_send()
-            except Exception as e:
-                self.logger.error(f"Error in metrics worker: {e}", exc_info=True)
-            
-            # Sleep with interruptible wait
-            self._stop_event.wait(timeout=self.interval)
-    
-    def _collect_and_send(self):
+
+    async def _run(self):
+        """Main worker loop; deadlines are absolute so slow pushes don't drift the interval"""
+        self._stop = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        next_run = loop.time()
+        try:
+            while not self._stop.is_set():
+                try:
+                    await self._collect_and_send()
+                except Exception as e:
+                    self.logger.error(f"Error in metrics worker: {e}", exc_info=True)
+
+                next_run += self.interval
+                delay = next_run - loop.time()
+                if delay < 0:
+                    # Cycle overran the interval; skip the missed ticks
+                    next_run = loop.time()
+                    delay = 0
+                try:
+                    await asyncio.wait_for(self._stop.wait(), timeout=delay)
+                except asyncio.TimeoutError:
+                    pass
+        finally:
+            await self.grafana.close()
+
+    async def _collect_and_send(self):
         """Collect metrics and send to all configured backends"""
         try:
-            # Collect comprehensive metrics
-            metrics = collect_all_metrics(self.backup_dir)
-            
+            # psutil calls block, keep them off the event loop
+            metrics = await asyncio.to_thread(collect_all_metrics, self.backup_dir)
+
             # Flatten for Prometheus
             flat_metrics = flatten_metrics_for_prometheus(metrics)
-            
-            # Send to Prometheus
-            if self.grafana.prometheus_url:
-                success = self.grafana.push_metrics_prometheus(flat_metrics)
-                if success:
-                    self.logger.debug(f"Sent {len(flat_metrics)} metrics to Prometheus")
-            
-            # Send to InfluxDB
-            if self.grafana.influxdb_url:
-                success = self.grafana.push_metrics_influxdb(flat_metrics)
+
+            # Backup histograms and SLO gauges
+            histograms = get_tracer().histograms()
+            if self.backup_stats is not None:
+                await asyncio.to_thread(self.backup_stats.refresh)
+                flat_metrics.update(self.backup_stats.slo())
+                histograms = self.backup_stats.histograms() + histograms
+
+            if self.alerts is not None:
+                self.alerts.observe(flat_metrics)
+            if not self.grafana.enabled:
+                return
+
+            # Send to Prometheus and InfluxDB concurrently
+            results = await self.grafana.push_metrics(flat_metrics, histograms=histograms)
+            for backend, success in results.items():
                 if success:
-                    self.logger.debug(f"Sent {len(flat_metrics)} metrics to InfluxDB")
-            
+                    self.logger.debug(f"Sent {len(flat_metrics)} metrics to {backend}")
+
         except Exception as e:
             self.logger.error(f"Failed to collect/send metrics: {e}")
-    
+
     def send_backup_event(self, status: str, message: str, size_bytes: Optional[int] = None, duration_sec: Optional[float] = None):
         """
-        Send backup event to Grafana
-        
+        Send backup event to Grafana (safe to call from any thread)
+
         Args:
             status: 'success', 'failed', 'skipped'
             message: Event message
             size_bytes: Backup file size
             duration_sec: Backup duration
         """
+        if not self._loop or self._loop.is_closed() or not self.grafana.enabled:
+            return
         try:
             metadata = {}
             if size_bytes is not None:
                 metadata['size_bytes'] = size_bytes
             if duration_sec is not None:
                 metadata['duration_seconds'] = duration_sec
-            
-            self.grafana.push_backup_event(status, message, metadata)
+
+            asyncio.run_coroutine_threadsafe(self.grafana.push_backup_event(status, message, metadata), self._loop)
             self.logger.debug(f"Backup event sent to Grafana: {status}")
         except Exception as e:
             self.logger.error(f"Failed to send backup event: {e}")
@@ -0,0 +1,284 @@
+"""
+Offsite copies of backup archives in a Telegram chat
+Each finished archive is split into volumes below the Bot API limits and the
+volumes are uploaded concurrently (paced to the chat's message rate, 429
+retry_after honoured, failed parts retried). Message and file IDs land in
+SQLite; a JSON manifest is posted last so the archive can be rebuilt even
+without the local catalog. api_base can point at a local Bot API server or a
+test stand-in.
+"""
+from __future__ import annotations
+
+import asyncio
+import hashlib
+import json
+import time
+from pathlib import Path
+from typing import Any, Dict, Optional, Set
+
+import aiohttp
+
+DEFAULT_API_BASE = "https://api.telegram.org"
+# Bots can upload 50 MB but only download 20 MB from the cloud Bot API;
+# 19 MB volumes keep reassembly possible without a local Bot API server
+DEFAULT_VOLUME_MB = 19.0
+
+
+class TelegramAPIError(Exception):
+    def __init__(self, method: str, description: str, error_code: int = 0, retry_after: Optional[float] = None):
+        super().__init__(f"{method}: {error_code} {description}")
+        self.error_code = error_code
+        self.retry_after = retry_after
+
+
+class _Pacer:
+    """Spaces request starts at least `interval` seconds apart; 429 pushes the next slot back"""
+
+    def __init__(self, per_minute: float):
+        self.interval = 60.0 / per_minute if per_minute > 0 else 0.0
+        self._next = 0.0
+        self._lock = asyncio.Lock()
+
+    async def wait(self):
+        async with self._lock:
+            now = time.monotonic()
+            delay = self._next - now
+            self._next = max(now, self._next) + self.interval
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+    def back_off(self, seconds: float):
+        self._next = max(self._next, time.monotonic() + seconds)
+
+
+def _read_volume(path: Path, offset: int, size: int):
+    with open(path, "rb") as f:
+        f.seek(offset)
+        data = f.read(size)
+    return data, hashlib.sha256(data).hexdigest()
+
+
+def _copy_hashed(src: Path, dst) -> str:
+    h = hashlib.sha256()
+    with open(src, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            h.update(chunk)
+            dst.write(chunk)
+    return h.hexdigest()
+
+
+def _file_sha256(path: Path) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+class TelegramOffsite:
+    def __init__(self, *, bot_token: str, chat_id: str, db, logger, api_base: str = DEFAULT_API_BASE,
+                 volume_mb: float = DEFAULT_VOLUME_MB, concurrency: int = 3, rate_per_min: float = 20.0,
+                 retries: int = 5, timeout: float = 300.0):
+        self.bot_token = bot_token
+        self.chat_id = str(chat_id)
+        self.db = db
+        self.logger = logger
+        self.api_base = (api_base or DEFAULT_API_BASE).rstrip("/")
+        self.volume_size = max(1, int(float(volume_mb) * 1024 * 1024))
+        self.concurrency = max(1, int(concurrency))
+        self.retries = max(1, int(retries))
+        self.timeout = float(timeout)
+        self._pacer = _Pacer(rate_per_min)
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._session: Optional[aiohttp.ClientSession] = None
+        # Backups queued or uploading; the tier migrator leaves their archives in place
+        self._active: Set[int] = set()
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.bot_token and self.chat_id)
+
+    def start(self, loop: asyncio.AbstractEventLoop):
+        """Attach the loop uploads run on (the API loop)"""
+        self._loop = loop
+
+    def submit(self, backup_id: int, path: Path):
+        """Queue an upload from any thread (the backup runs on a worker thread)"""
+        if not self.enabled or self._loop is None or self._loop.is_closed():
+            return None
+        self._active.add(backup_id)
+        future = asyncio.run_coroutine_threadsafe(self.upload(backup_id, Path(path)), self._loop)
+        future.add_done_callback(lambda _: self._active.discard(backup_id))
+        return future
+
+    def uploading(self, backup_id: int) -> bool:
+        return backup_id in self._active
+
+    def submit_reassemble(self, dest_dir: Path, backup_id: int):
+        """Run reassemble() on the uploader's loop from another loop or thread"""
+        if self._loop is None or self._loop.is_closed():
+            raise RuntimeError("Offsite uploader is not running")
+        return asyncio.run_coroutine_threadsafe(self.reassemble(Path(dest_dir), backup_id=backup_id), self._loop)
+
+    async def _get_session(self) -> aiohttp.ClientSession:
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=self.timeout))
+        return self._session
+
+    async def close(self):
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._session = None
+
+    async def _call(self, method: str, data: Any = None, params: Optional[Dict[str, Any]] = None) -> Any:
+        session = await self._get_session()
+        url = f"{self.api_base}/bot{self.bot_token}/{method}"
+        async with session.post(url, data=data, params=params) as r:
+            try:
+                payload = await r.json(content_type=None)
+            except (ValueError, aiohttp.ContentTypeError):
+                raise TelegramAPIError(method, f"HTTP {r.status}", r.status)
+        if not payload.get("ok"):
+            retry_after = (payload.get("parameters") or {}).get("retry_after")
+            raise TelegramAPIError(method, payload.get("description", ""), payload.get("error_code", r.status),
+                                   retry_after)
+        return payload["result"]
+
+    async def _send_document(self, data: bytes, file_name: str, caption: str) -> Dict[str, Any]:
+        last_error: Optional[Exception] = None
+        for attempt in range(self.retries):
+            await self._pacer.wait()
+            form = aiohttp.FormData()
+            form.add_field("chat_id", self.chat_id)
+            form.add_field("caption", caption)
+            form.add_field("disable_notification", "true")
+            form.add_field("document", data, filename=file_name, content_type="application/octet-stream")
+            try:
+                return await self._call("sendDocument", data=form)
+            except TelegramAPIError as e:
+                last_error = e
+                if e.retry_after:
+                    # The pacer holds this and every other volume for retry_after; no extra backoff
+                    self._pacer.back_off(float(e.retry_after))
+                    continue
+                elif 400 <= e.error_code < 500 and e.error_code != 429:
+                    raise  # bad token/chat/size: retrying won't help
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                last_error = e
+            await asyncio.sleep(min(60.0, 2 ** attempt))
+        raise last_error or TelegramAPIError("sendDocument", "failed")
+
+    async def _upload_part(self, sem: asyncio.Semaphore, backup_id: int, path: Path, part: int, parts: int,
+                           offset: int, size: int):
+        async with sem:
+            data, digest = await asyncio.to_thread(_read_volume, path, offset, size)
+            name = f"{path.name}.part{part:03d}of{parts:03d}"
+            caption = f"#backup{backup_id} {path.name} part {part}/{parts} sha256:{digest[:16]}"
+            message = await self._send_document(data, name, caption)
+            await asyncio.to_thread(self.db.offsite_record_part, backup_id=backup_id, part=part,
+                                    message_id=message["message_id"], file_id=message["document"]["file_id"],
+                                    offset=offset, size_bytes=len(data), sha256=digest)
+
+    async def upload(self, backup_id: int, path: Path) -> bool:
+        """Upload missing volumes of an archive; safe to re-run after a failure"""
+        if not path.is_file():
+            self.logger.warning(f"Offsite upload skipped, archive missing: {path}")
+            return False
+        size = path.stat().st_size
+        parts = max(1, -(-size // self.volume_size))
+        started = time.monotonic()
+        await asyncio.to_thread(self.db.offsite_start, backup_id=backup_id, chat_id=self.chat_id,
+                                file_name=path.name, parts=parts, size_bytes=size)
+        done = {r["part"] for r in await asyncio.to_thread(self.db.offsite_parts, backup_id)}
+        sem = asyncio.Semaphore(self.concurrency)
+        tasks = [
+            self._upload_part(sem, backup_id, path, part, parts, (part - 1) * self.volume_size,
+                              min(self.volume_size, size - (part - 1) * self.volume_size))
+            for part in range(1, parts + 1) if part not in done
+        ]
+        self.logger.info(f"Offsite upload of {path.name}: {len(tasks)} of {parts} volumes to chat {self.chat_id}")
+        results = await asyncio.gather(*tasks, return_exceptions=True)
+        errors = [r for r in results if isinstance(r, BaseException)]
+        if errors:
+            await asyncio.to_thread(self.db.offsite_finish, backup_id=backup_id, status="FAILED")
+            self.logger.error(f"Offsite upload of {path.name} failed ({len(errors)} volumes): {errors[0]}")
+            return False
+
+        sha256 = await asyncio.to_thread(_file_sha256, path)
+        rows = await asyncio.to_thread(self.db.offsite_parts, backup_id)
+        manifest = {
+            "backup_id": backup_id,
+            "file_name": path.name,
+            "size_bytes": size,
+            "sha256": sha256,
+            "parts": [{"part": r["part"], "file_id": r["file_id"], "message_id": r["message_id"],
+                       "offset": r["offset"], "size_bytes": r["size_bytes"], "sha256": r["sha256"]} for r in rows],
+        }
+        manifest_id = None
+        try:
+            message = await self._send_document(json.dumps(manifest, indent=1).encode("utf-8"),
+                                                f"{path.name}.manifest.json",
+                                                f"#backup{backup_id} {path.name} manifest ({parts} parts)")
+            manifest_id = message["message_id"]
+        except Exception as e:
+            self.logger.warning(f"Offsite manifest for {path.name} not sent: {e}")
+        await asyncio.to_thread(self.db.offsite_finish, backup_id=backup_id, status="OK", sha256=sha256,
+                                manifest_message_id=manifest_id)
+        self.logger.info(f"Offsite upload of {path.name} done: {parts} volumes, {size} bytes "
+                         f"in {time.monotonic() - started:.1f}s")
+        return True
+
+    async def _download(self, file_id: str, dst) -> str:
+        """Append one volume to dst; returns its sha256"""
+        info = await self._call("getFile", params={"file_id": file_id})
+        file_path = info["file_path"]
+        local = Path(file_path)
+        if local.is_absolute() and local.is_file():
+            # Local Bot API server (--local) returns a path on its own filesystem
+            return await asyncio.to_thread(_copy_hashed, local, dst)
+        h = hashlib.sha256()
+        session = await self._get_session()
+        async with session.get(f"{self.api_base}/file/bot{self.bot_token}/{file_path}") as r:
+            r.raise_for_status()
+            async for chunk in r.content.iter_chunked(256 * 1024):
+                h.update(chunk)
+                dst.write(chunk)
+        return h.hexdigest()
+
+    async def reassemble(self, dest_dir: Path, backup_id: Optional[int] = None,
+                         manifest: Optional[Dict[str, Any]] = None) -> Path:
+        """Rebuild an archive from its volumes (catalog lookup by backup_id, or a manifest dict)"""
+        if manifest is None:
+            upload = await asyncio.to_thread(self.db.offsite_upload, backup_id)
+            if upload is None:
+                raise FileNotFoundError(f"No offsite copy recorded for backup {backup_id}")
+            rows = await asyncio.to_thread(self.db.offsite_parts, backup_id)
+            manifest = {"file_name": upload["file_name"], "size_bytes": upload["size_bytes"],
+                        "sha256": upload["sha256"], "parts": [dict(r) for r in rows]}
+            if len(rows) != upload["parts"]:
+                raise ValueError(f"Offsite copy of backup {backup_id} is incomplete "
+                                 f"({len(rows)}/{upload['parts']} volumes)")
+
+        dest_dir.mkdir(parents=True, exist_ok=True)
+        target = dest_dir / Path(manifest["file_name"]).name
+        partial = target.with_name(target.name + ".part")
+        try:
+            with open(partial, "wb") as out:
+                for part in sorted(manifest["parts"], key=lambda p: p["part"]):
+                    out.seek(part["offset"])
+                    if await self._download(part["file_id"], out) != part["sha256"]:
+                        raise ValueError(f"Volume {part['part']} checksum mismatch")
+            if manifest.get("sha256"):
+                if await asyncio.to_thread(_file_sha256, partial) != manifest["sha256"]:
+                    raise ValueError("Reassembled archive checksum mismatch")
+        except BaseException:
+            partial.unlink(missing_ok=True)
+            raise
+        partial.replace(target)
+        self.logger.info(f"Reassembled {target} from {len(manifest['parts'])} volumes")
+        return target
+
+
+def load_manifest(path: Path) -> Dict[str, Any]:
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
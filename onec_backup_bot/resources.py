@@ -0,0 +1,201 @@
+"""
+Resource profile of the 1C dump process tree
+While /DumpIB runs, a background thread samples the 1C process and its
+descendants through psutil: CPU time, RSS, bytes read/written and read/write
+operations. Counters are accumulated per PID, so children that exit mid-dump
+do not make the totals jump backwards. Samples are packed as fixed-width
+integers and zlib-compressed (a two-hour dump at 1 s is ~200 KB raw, a few
+tens of KB stored), with peaks and a rough bottleneck label kept alongside
+for queries and metrics.
+"""
+from __future__ import annotations
+
+import struct
+import threading
+import time
+import zlib
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional, Tuple
+
+# offset ms, CPU in 1/1000 of a core, RSS KiB, read KiB, written KiB, read ops, write ops (per interval)
+SAMPLE = struct.Struct("<7I")
+_U32 = 0xFFFFFFFF
+KIB = 1024
+
+# Bottleneck heuristic thresholds
+CPU_BOUND_PERCENT = 80.0  # DumpIB is essentially single-threaded: ~one busy core
+MEMORY_BOUND_SHARE = 0.8  # peak RSS vs physical memory
+IDLE_IO_BYTES_PER_SEC = 1024 * 1024
+
+
+@dataclass
+class ResourceProfile:
+    interval_sec: float
+    mem_total_bytes: int = 0
+    samples: List[Tuple[int, ...]] = field(default_factory=list)
+
+    def encode(self) -> bytes:
+        return zlib.compress(b"".join(SAMPLE.pack(*s) for s in self.samples), 6)
+
+    @classmethod
+    def decode(cls, interval_sec: float, blob: bytes, mem_total_bytes: int = 0) -> "ResourceProfile":
+        raw = zlib.decompress(blob) if blob else b""
+        return cls(interval_sec, mem_total_bytes, [s for s in SAMPLE.iter_unpack(raw)])
+
+    def series(self) -> List[Dict[str, float]]:
+        """Samples in plain units; rates are per second over each sample's own interval"""
+        out = []
+        prev = 0
+        for offset, cpu, rss, rkb, wkb, rops, wops in self.samples:
+            dt = max((offset - prev) / 1000.0, 1e-3)
+            prev = offset
+            out.append({
+                "t": offset / 1000.0,
+                "cpu_percent": cpu / 10.0,
+                "rss_bytes": rss * KIB,
+                "read_bytes_per_sec": rkb * KIB / dt,
+                "write_bytes_per_sec": wkb * KIB / dt,
+                "read_iops": rops / dt,
+                "write_iops": wops / dt,
+            })
+        return out
+
+    def summary(self) -> Dict[str, Any]:
+        series = self.series()
+        if not series:
+            return {"samples": 0}
+        duration = max(series[-1]["t"], 1e-3)
+
+        def peak(key):
+            return round(max(s[key] for s in series), 1)
+
+        # Time-weighted: cpu_percent * interval summed = CPU seconds used
+        cpu_seconds = sum(s["cpu_percent"] / 100.0 * (s["t"] - prev["t"])
+                          for prev, s in zip([{"t": 0.0}] + series, series))
+        mean_cpu = cpu_seconds / duration * 100.0
+        read_bytes = sum(s[3] for s in self.samples) * KIB
+        write_bytes = sum(s[4] for s in self.samples) * KIB
+        peak_rss = max(s["rss_bytes"] for s in series)
+        if self.mem_total_bytes and peak_rss >= MEMORY_BOUND_SHARE * self.mem_total_bytes:
+            bottleneck = "memory"
+        elif mean_cpu >= CPU_BOUND_PERCENT:
+            bottleneck = "cpu"
+        elif (read_bytes + write_bytes) / duration >= IDLE_IO_BYTES_PER_SEC:
+            bottleneck = "disk"
+        else:
+            bottleneck = "wait"  # neither busy nor doing I/O: locks, network share, licence
+        return {
+            "samples": len(series),
+            "peak_cpu_percent": peak("cpu_percent"),
+            "mean_cpu_percent": round(mean_cpu, 1),
+            "peak_rss_bytes": int(peak_rss),
+            "read_bytes": int(read_bytes),
+            "write_bytes": int(write_bytes),
+            "peak_read_bps": peak("read_bytes_per_sec"),
+            "peak_write_bps": peak("write_bytes_per_sec"),
+            "peak_read_iops": peak("read_iops"),
+            "peak_write_iops": peak("write_iops"),
+            "bottleneck": bottleneck,
+        }
+
+    def row(self) -> Dict[str, Any]:
+        """Columns of backup_resources"""
+        summary = self.summary()
+        summary.pop("samples", None)
+        return {"interval_sec": self.interval_sec, "samples": len(self.samples),
+                "mem_total_bytes": self.mem_total_bytes, "data": self.encode(), **summary}
+
+
+class ResourceSampler:
+    """Samples a process and its descendants on a daemon thread until stop()"""
+
+    def __init__(self, pid: int, interval_sec: float = 1.0):
+        import psutil
+
+        self._psutil = psutil
+        self.interval_sec = max(0.05, float(interval_sec))
+        self._root = psutil.Process(pid)
+        self._procs: Dict[int, Any] = {pid: self._root}
+        # Last cumulative counters per PID: cpu seconds, read bytes, write bytes, read ops, write ops
+        self._last: Dict[int, Tuple[float, int, int, int, int]] = {}
+        self._profile = ResourceProfile(self.interval_sec, int(psutil.virtual_memory().total))
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._started = 0.0
+        self._prev_offset = 0
+
+    def _tree(self) -> List[Any]:
+        psutil = self._psutil
+        try:
+            for child in self._root.children(recursive=True):
+                self._procs.setdefault(child.pid, child)
+        except psutil.Error:
+            pass
+        return list(self._procs.values())
+
+    def _tick(self):
+        psutil = self._psutil
+        cpu = rss = rb = wb = rc = wc = 0.0
+        alive = 0
+        for proc in self._tree():
+            try:
+                with proc.oneshot():
+                    times = proc.cpu_times()
+                    mem = proc.memory_info()
+                    try:
+                        io = proc.io_counters()
+                        counters = (io.read_bytes, io.write_bytes, io.read_count, io.write_count)
+                    except (AttributeError, psutil.AccessDenied):
+                        counters = (0, 0, 0, 0)  # macOS has no per-process I/O counters
+            except psutil.Error:
+                self._procs.pop(proc.pid, None)
+                continue
+            current = (times.user + times.system,) + counters
+            last = self._last.get(proc.pid, (0.0, 0, 0, 0, 0))
+            self._last[proc.pid] = current
+            deltas = [max(0, c - p) for c, p in zip(current, last)]
+            cpu += deltas[0]
+            rb += deltas[1]
+            wb += deltas[2]
+            rc += deltas[3]
+            wc += deltas[4]
+            rss += mem.rss
+            alive += 1
+        if not alive:
+            return  # the dump has exited; stop() follows
+        offset = int((time.monotonic() - self._started) * 1000)
+        wall = max((offset - self._prev_offset) / 1000.0, 1e-3)
+        self._prev_offset = offset
+        self._profile.samples.append(tuple(min(_U32, int(v)) for v in (
+            offset, cpu / wall * 1000, rss / KIB, rb / KIB, wb / KIB, rc, wc)))
+
+    def _run(self):
+        while not self._stop.wait(self.interval_sec):
+            self._tick()
+
+    def start(self) -> "ResourceSampler":
+        self._started = time.monotonic()
+        self._tick()  # baseline: counters accumulated before the first interval
+        self._profile.samples.clear()
+        self._prev_offset = 0
+        self._thread = threading.Thread(target=self._run, name="resource-sampler", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> ResourceProfile:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+        return self._profile
+
+
+def start_sampler(pid: int, interval_sec: float, logger=None) -> Optional[ResourceSampler]:
+    """Sampler for pid, or None if sampling is off, psutil is missing or the process is gone"""
+    if interval_sec <= 0:
+        return None
+    try:
+        return ResourceSampler(pid, interval_sec).start()
+    except Exception as e:
+        if logger is not None:
+            logger.warning(f"Resource sampling unavailable: {e}")
+        return None
@@ -0,0 +1,245 @@
+"""
+Load-aware backup scheduler
+Cron-style jobs per base run on the shared API loop. A due run gets a random
+jitter, then waits while the host is busy (CPU/RAM above thresholds or 1C
+clients still connected) until a hard deadline, after which it runs anyway.
+The last fire time of every job is persisted, so runs missed while the bot
+was down are caught up once at startup.
+"""
+from __future__ import annotations
+
+import asyncio
+import concurrent.futures
+import datetime as dt
+import random
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+from .metrics import collect_system_metrics, count_onec_clients
+
+_FIELDS = (("minute", 0, 59), ("hour", 0, 23), ("day", 1, 31), ("month", 1, 12), ("weekday", 0, 6))
+_ALIASES = {"@hourly": "0 * * * *", "@daily": "0 0 * * *", "@midnight": "0 0 * * *",
+            "@weekly": "0 0 * * 0", "@monthly": "0 0 1 * *"}
+
+
+class CronExpr:
+    """Five-field cron expression: minute hour day month weekday (0 or 7 = Sunday)"""
+
+    def __init__(self, expr: str):
+        self.expr = expr.strip()
+        fields = _ALIASES.get(self.expr, self.expr).split()
+        if len(fields) != 5:
+            raise ValueError(f"cron expression needs 5 fields: {expr!r}")
+        parsed = []
+        for text, (name, lo, hi) in zip(fields, _FIELDS):
+            hi_parse = 7 if name == "weekday" else hi
+            values = self._parse_field(text, lo, hi_parse, name)
+            if name == "weekday" and 7 in values:
+                values = (values - {7}) | {0}
+            parsed.append(values)
+        self.minutes, self.hours, self.days, self.months, self.weekdays = parsed
+        # Classic cron: if both day and weekday are restricted, either may match
+        self._day_any = fields[2] == "*"
+        self._weekday_any = fields[4] == "*"
+
+    @staticmethod
+    def _parse_field(text: str, lo: int, hi: int, name: str) -> frozenset:
+        values = set()
+        for part in text.split(","):
+            rng, _, step_text = part.partition("/")
+            step = int(step_text) if step_text else 1
+            if rng == "*":
+                start, end = lo, hi
+            elif "-" in rng:
+                a, b = rng.split("-", 1)
+                start, end = int(a), int(b)
+            else:
+                start = int(rng)
+                end = hi if step_text else start
+            if step < 1 or start < lo or end > hi or start > end:
+                raise ValueError(f"invalid cron {name} field: {text!r}")
+            values.update(range(start, end + 1, step))
+        return frozenset(values)
+
+    def _day_matches(self, day: dt.date) -> bool:
+        dom = day.day in self.days
+        dow = (day.isoweekday() % 7) in self.weekdays
+        if self._day_any:
+            return dow
+        if self._weekday_any:
+            return dom
+        return dom or dow
+
+    def next_after(self, after: dt.datetime) -> dt.datetime:
+        """First matching minute strictly after `after`"""
+        start = after.replace(second=0, microsecond=0) + dt.timedelta(minutes=1)
+        day = start.date()
+        for _ in range(366 * 5):
+            if day.month in self.months and self._day_matches(day):
+                for hour in sorted(self.hours):
+                    for minute in sorted(self.minutes):
+                        candidate = dt.datetime(day.year, day.month, day.day, hour, minute)
+                        if candidate >= start:
+                            return candidate
+            day += dt.timedelta(days=1)
+        raise ValueError(f"cron expression never fires: {self.expr!r}")
+
+
+@dataclass
+class ScheduleJob:
+    base: str
+    cron: CronExpr
+    jitter_sec: float = 0.0
+    deadline_min: float = 120.0
+
+    @property
+    def key(self) -> str:
+        return f"{self.base}|{self.cron.expr}"
+
+
+class BackupScheduler:
+    def __init__(self, *, services: Dict[str, Any], jobs: List[Dict[str, Any]], db, logger, backup_dir: Path,
+                 default_base: str, jitter_sec: float = 300.0, deadline_min: float = 120.0,
+                 catch_up: bool = True, max_cpu_percent: float = 70.0, max_mem_percent: float = 90.0,
+                 max_disk_percent: float = 100.0,
+                 max_onec_clients: int = -1, check_interval_sec: float = 60.0):
+        self.services = services
+        self.db = db
+        self.logger = logger
+        self.backup_dir = Path(backup_dir)
+        self.catch_up = catch_up
+        self.max_cpu_percent = float(max_cpu_percent)
+        self.max_mem_percent = float(max_mem_percent)
+        self.max_disk_percent = float(max_disk_percent)
+        self.max_onec_clients = int(max_onec_clients)
+        self.check_interval_sec = max(5.0, float(check_interval_sec))
+
+        self.jobs: List[ScheduleJob] = []
+        for spec in jobs or []:
+            if isinstance(spec, str):
+                spec = {"cron": spec}
+            base = str(spec.get("base") or default_base)
+            if base not in services:
+                logger.warning(f"Schedule entry for unknown base {base!r} ignored")
+                continue
+            try:
+                cron = CronExpr(str(spec["cron"]))
+            except (KeyError, ValueError) as e:
+                logger.error(f"Invalid schedule entry {spec!r}: {e}")
+                continue
+            self.jobs.append(ScheduleJob(base=base, cron=cron,
+                                         jitter_sec=float(spec.get("jitter_sec", jitter_sec)),
+                                         deadline_min=float(spec.get("deadline_min", deadline_min))))
+
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._future: Optional[concurrent.futures.Future] = None
+        self._stop: Optional[asyncio.Event] = None
+        self.next_runs: Dict[str, dt.datetime] = {}
+
+    def start(self, loop: asyncio.AbstractEventLoop):
+        """Schedule all jobs on a running event loop (thread-safe)"""
+        if not self.jobs:
+            self.logger.info("No valid schedule entries, scheduler disabled")
+            return
+        self._loop = loop
+        self._future = asyncio.run_coroutine_threadsafe(self._run(), loop)
+        self.logger.info("Backup scheduler started: " + ", ".join(f"{j.base} [{j.cron.expr}]" for j in self.jobs))
+
+    def stop(self):
+        if not self._future or not self._loop:
+            return
+        if self._stop is not None and not self._loop.is_closed():
+            self._loop.call_soon_threadsafe(self._stop.set)
+        try:
+            self._future.result(timeout=5)
+        except Exception:
+            self._future.cancel()
+        self._future = None
+
+    async def _run(self):
+        self._stop = asyncio.Event()
+        await asyncio.gather(*(self._run_job(job) for job in self.jobs))
+
+    async def _sleep_until(self, when: dt.datetime) -> bool:
+        """Wall-clock sleep in short steps (survives clock changes); False if stopping"""
+        while not self._stop.is_set():
+            remaining = (when - dt.datetime.now()).total_seconds()
+            if remaining <= 0:
+                return True
+            try:
+                await asyncio.wait_for(self._stop.wait(), timeout=min(remaining, 60.0))
+            except asyncio.TimeoutError:
+                pass
+        return False
+
+    def _busy_reasons(self, job: ScheduleJob) -> List[str]:
+        m = collect_system_metrics(self.backup_dir)
+        reasons = []
+        if m["cpu_percent"] > self.max_cpu_percent:
+            reasons.append(f"CPU {m['cpu_percent']:.0f}% > {self.max_cpu_percent:.0f}%")
+        if m["mem_percent"] > self.max_mem_percent:
+            reasons.append(f"RAM {m['mem_percent']:.0f}% > {self.max_mem_percent:.0f}%")
+        # backup_dir's volume: give a retention/cleanup task the chance to run first
+        if m["disk_percent"] > self.max_disk_percent:
+            reasons.append(f"disk {m['disk_percent']:.0f}% > {self.max_disk_percent:.0f}%")
+        if self.max_onec_clients >= 0:
+            clients = count_onec_clients(self.services[job.base].base_path)
+            if clients > self.max_onec_clients:
+                reasons.append(f"1C clients of {job.base} running: {clients}")
+        return reasons
+
+    async def _wait_for_quiet(self, job: ScheduleJob, anchor: dt.datetime) -> bool:
+        deadline = anchor + dt.timedelta(minutes=job.deadline_min)
+        deferred = False
+        while not self._stop.is_set():
+            reasons = await asyncio.to_thread(self._busy_reasons, job)
+            if not reasons:
+                if deferred:
+                    self.logger.info(f"Scheduled backup of {job.base}: host is quiet, starting")
+                return True
+            if dt.datetime.now() >= deadline:
+                self.logger.warning(f"Scheduled backup of {job.base}: deadline reached, running despite "
+                                    f"{'; '.join(reasons)}")
+                return True
+            if not deferred:
+                self.logger.info(f"Scheduled backup of {job.base} deferred: {'; '.join(reasons)} "
+                                 f"(deadline {deadline:%H:%M})")
+                deferred = True
+            step = min(self.check_interval_sec, max(1.0, (deadline - dt.datetime.now()).total_seconds()))
+            await self._sleep_until(dt.datetime.now() + dt.timedelta(seconds=step))
+        return False
+
+    async def _run_job(self, job: ScheduleJob):
+        now = dt.datetime.now()
+        last = await asyncio.to_thread(self.db.schedule_last_fire, job.key)
+        if last is None:
+            # New job: no history to catch up on
+            await asyncio.to_thread(self.db.schedule_set_last_fire, job.key, now)
+            last = now
+        elif not self.catch_up:
+            last = max(last, now)
+        while not self._stop.is_set():
+            fire = job.cron.next_after(last)
+            # A missed run is due now; its deferral deadline counts from now, not from the old slot
+            anchor = max(fire, dt.datetime.now())
+            if fire < anchor:
+                self.logger.info(f"Catching up missed backup of {job.base} scheduled for {fire:%Y-%m-%d %H:%M}")
+            start_at = anchor + dt.timedelta(seconds=random.uniform(0, job.jitter_sec))
+            self.next_runs[job.key] = start_at
+            if not await self._sleep_until(start_at):
+                break
+            if not await self._wait_for_quiet(job, anchor):
+                break
+            # Record first: a crash during the dump must not cause a restart loop of catch-ups
+            last = max(fire, dt.datetime.now().replace(second=0, microsecond=0))
+            await asyncio.to_thread(self.db.schedule_set_last_fire, job.key, last)
+            service = self.services[job.base]
+            try:
+                path = await asyncio.to_thread(service.make_backup)
+                self.logger.info(f"Scheduled backup of {job.base} finished: {path or 'no archive (see log)'}")
+            except Exception as e:
+                self.logger.error(f"Scheduled backup of {job.base} failed: {e}")
+
+    def describe(self) -> List[Tuple[str, str, Optional[dt.datetime]]]:
+        return [(j.base, j.cron.expr, self.next_runs.get(j.key)) for j in self.jobs]
@@ -0,0 +1,312 @@
+"""
+Storage tiers
+The dump and its archive land in backup_dir (fast local disk), so the 1C base
+is locked no longer than the local disk needs. TierMigrator then moves
+finished archives to tier_dir (slow tier, e.g. a NAS share) in the background:
+
+    policy   archives older than tier_min_age_hours go, oldest first; while
+             backup_dir has less than tier_min_free_mb free, the oldest go
+             regardless of age. Archives still uploading offsite wait.
+    copy     streamed through a hidden .part file at up to tier_rate_mb_s,
+             paused while a backup runs in this process
+    verify   the copy is read back and its sha256 compared with the source
+             and the catalog before it takes the archive's name
+    catalog  path, tier ('fast' -> 'slow') and migrated_at are updated and the
+             manifest.json entry moves with the archive; only then is the
+             local copy deleted
+
+A .dt kept next to its archive (delete_dt_after_compress: false) moves with it.
+One pass runs at a time across processes (daemon, `python main.py migrate`).
+"""
+from __future__ import annotations
+
+import asyncio
+import datetime as dt
+import hashlib
+import os
+import shutil
+import threading
+import time
+from dataclasses import dataclass
+from pathlib import Path
+from typing import List, Optional
+
+from .backup import _ProcessLock
+from .fileio import IOOptions, open_input, open_output
+from .manifests import add_to_manifest, dump_name, load_manifest, manifest_entry, remove_from_manifest
+
+SLOW = "slow"
+
+
+class MigrationError(Exception):
+    """The copy of one archive could not be verified"""
+
+
+class _Cancelled(Exception):
+    pass
+
+
+class _Throttle:
+    """Keeps the average copy rate under bytes_per_sec by sleeping when ahead"""
+
+    def __init__(self, bytes_per_sec: float, cancel: threading.Event):
+        self.rate = float(bytes_per_sec)
+        self.cancel = cancel
+        self.reset()
+
+    def reset(self):
+        self.started = time.monotonic()
+        self.done = 0
+
+    def __call__(self, n: int):
+        if self.rate <= 0:
+            return
+        self.done += n
+        ahead = self.done / self.rate - (time.monotonic() - self.started)
+        if ahead > 0:
+            self.cancel.wait(ahead)
+
+
+@dataclass
+class MigrationResult:
+    moved: int = 0
+    bytes: int = 0
+    failed: int = 0
+    held: int = 0  # due but left in place (offsite upload running, missing locally)
+    seconds: float = 0.0
+
+
+def _companion_dump(archive: Path) -> Optional[Path]:
+    """The .dt a compressed archive was made from, if it was kept next to it"""
+    dump = archive.with_name(dump_name(archive.name))
+    return dump if dump != archive and dump.is_file() else None
+
+
+class TierMigrator:
+    def __init__(self, db, backup_dir: Path, tier_dir: Path, logger, *, min_age_hours: float = 0.0,
+                 min_free_mb: float = 0.0, rate_mb_s: float = 0.0, interval_sec: float = 300.0,
+                 io_opts: Optional[IOOptions] = None, backup_service=None, offsite=None, events=None):
+        self.db = db
+        self.backup_dir = Path(backup_dir)
+        self.tier_dir = Path(tier_dir)
+        self.logger = logger
+        self.min_age_hours = float(min_age_hours)
+        self.min_free_bytes = int(float(min_free_mb) * 1024 * 1024)
+        self.interval_sec = max(10.0, float(interval_sec))
+        self.io_opts = io_opts or IOOptions()
+        self.backup_service = backup_service
+        self.offsite = offsite
+        self.events = events
+        self._cancel = threading.Event()
+        self._throttle = _Throttle(float(rate_mb_s) * 1024 * 1024, self._cancel)
+        self._process_lock = _ProcessLock(self.backup_dir / ".migrate.lock")
+        # Local copies whose delete failed (e.g. still open on Windows); retried every pass
+        self._leftovers: List[Path] = []
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._future = None
+        self._stop: Optional[asyncio.Event] = None
+
+    def _emit(self, topic: str, **data):
+        if self.events is not None:
+            try:
+                self.events.publish(topic, **data)
+            except Exception:
+                pass
+
+    def _wait_for_backup(self):
+        """Block while a backup runs here: the dump and compression get the local disk to themselves"""
+        if self.backup_service is None or not self.backup_service.running:
+            return
+        while self.backup_service.running:
+            if self._cancel.wait(5.0):
+                raise _Cancelled()
+        self._throttle.reset()
+
+    def plan(self, now: Optional[dt.datetime] = None) -> List:
+        """Catalog rows due for the slow tier, oldest first"""
+        now = now or dt.datetime.now()
+        deficit = 0
+        if self.min_free_bytes:
+            try:
+                deficit = self.min_free_bytes - shutil.disk_usage(self.backup_dir).free
+            except OSError:
+                pass
+        due = []
+        for row in self.db.tier_candidates():
+            try:
+                age_h = (now - dt.datetime.fromisoformat(row["ts"])).total_seconds() / 3600
+            except (TypeError, ValueError):
+                age_h = float("inf")
+            if age_h < self.min_age_hours and deficit <= 0:
+                continue
+            due.append(row)
+            deficit -= row["size_bytes"] or 0
+        return due
+
+    @staticmethod
+    def _relative(path: Path, root: Path) -> Optional[Path]:
+        try:
+            return path.resolve().relative_to(root.resolve())
+        except ValueError:
+            return None
+
+    def _stream(self, src: Path, dst: Optional[Path], buf: bytearray) -> str:
+        """sha256 of src, copied to dst on the way if given (paced, pausable)"""
+        h = hashlib.sha256()
+        view = memoryview(buf)
+        with open_input(src, self.io_opts) as fin:
+            fout = open_output(dst, self.io_opts) if dst is not None else None
+            try:
+                while True:
+                    if self._cancel.is_set():
+                        raise _Cancelled()
+                    self._wait_for_backup()
+                    n = fin.readinto(buf)
+                    if not n:
+                        break
+                    h.update(view[:n])
+                    if fout is not None:
+                        fout.write(view[:n])
+                    self._throttle(n)
+                if fout is not None:
+                    fout.flush()
+                    os.fsync(fout.fileno())
+            finally:
+                if fout is not None:
+                    fout.close()
+        return h.hexdigest()
+
+    def _copy_verified(self, src: Path, dst: Path, expected: Optional[str]) -> str:
+        partial = dst.with_name(f".{dst.name}.part")
+        buf = bytearray(self.io_opts.buffer_size)
+        try:
+            digest = self._stream(src, partial, buf)
+            if expected and digest != expected:
+                raise MigrationError(f"{src.name}: sha256 differs from the catalog, archive left in place")
+            # Read back from the slow tier, not from what we think we wrote
+            if self._stream(partial, None, buf) != digest:
+                raise MigrationError(f"{src.name}: copy on {self.tier_dir} does not verify")
+            os.replace(partial, dst)
+        except BaseException:
+            partial.unlink(missing_ok=True)
+            raise
+        return digest
+
+    def _unlink(self, path: Path):
+        try:
+            path.unlink(missing_ok=True)
+        except OSError as e:
+            self.logger.warning(f"Migrated {path.name} but could not delete the local copy yet: {e}")
+            self._leftovers.append(path)
+
+    def migrate(self, row) -> int:
+        """Move one archive to the slow tier; bytes moved (0 if it was only re-labelled)"""
+        src = Path(row["path"])
+        rel = self._relative(src, self.backup_dir)
+        if rel is None:
+            # Already outside backup_dir (moved by hand, then reconciled): just record the tier
+            if self._relative(src, self.tier_dir) is not None:
+                self.db.set_tier(row["id"], str(src), SLOW)
+            return 0
+        started = time.monotonic()
+        dst = self.tier_dir / rel
+        dst.parent.mkdir(parents=True, exist_ok=True)
+        dump = _companion_dump(src)
+        self._copy_verified(src, dst, row["sha256"])
+        if dump is not None:
+            self._copy_verified(dump, dst.with_name(dump.name), None)
+        self._wait_for_backup()  # manifests are rewritten by the backup too
+        entry = load_manifest(src.parent).get(src.name) or manifest_entry(row)
+        add_to_manifest(dst, entry)
+        self.db.set_tier(row["id"], str(dst), SLOW)
+        remove_from_manifest(src)
+        for local in (src, dump):
+            if local is not None:
+                self._unlink(local)
+        try:
+            src.parent.rmdir()  # the last archive of its day: remove_from_manifest could not while it was there
+        except OSError:
+            pass
+        size = dst.stat().st_size + (dst.with_name(dump.name).stat().st_size if dump is not None else 0)
+        seconds = time.monotonic() - started
+        self.logger.info(f"Migrated #{row['id']} {src.name} to {dst.parent} "
+                         f"({size / 2**20:.1f} MB in {seconds:.1f}s, {size / 2**20 / max(seconds, 1e-6):.1f} MB/s)")
+        self._emit("backup.migrated", backup_id=row["id"], path=str(dst), size_bytes=size,
+                   seconds=round(seconds, 1))
+        return size
+
+    def run_once(self) -> MigrationResult:
+        """One pass over the due archives (skipped if another process is migrating)"""
+        result = MigrationResult()
+        started = time.monotonic()
+        if not self._process_lock.acquire():
+            self.logger.info("Another migration is running; skipping this pass")
+            return result
+        try:
+            for path in list(self._leftovers):
+                self._leftovers.remove(path)
+                self._unlink(path)
+            self._throttle.reset()
+            for row in self.plan():
+                if self._cancel.is_set():
+                    break
+                if self.offsite is not None and self.offsite.uploading(row["id"]):
+                    result.held += 1
+                    continue
+                if self._relative(Path(row["path"]), self.backup_dir) is not None and not os.path.isfile(row["path"]):
+                    result.held += 1  # missing locally: reconcile's business
+                    continue
+                try:
+                    size = self.migrate(row)
+                except _Cancelled:
+                    break
+                except MigrationError as e:
+                    self.logger.error(f"Migration of #{row['id']} failed: {e}")
+                    result.failed += 1
+                    continue
+                except OSError as e:
+                    # Most likely the share is unreachable: try again next pass
+                    self.logger.warning(f"Migration to {self.tier_dir} stopped at #{row['id']}: {e}")
+                    result.failed += 1
+                    break
+                result.moved += 1
+                result.bytes += size
+        finally:
+            self._process_lock.release()
+        result.seconds = time.monotonic() - started
+        return result
+
+    def start(self, loop: asyncio.AbstractEventLoop):
+        """Schedule migration passes on a running event loop (thread-safe)"""
+        self._loop = loop
+        self._cancel.clear()
+        self._future = asyncio.run_coroutine_threadsafe(self._run(), loop)
+        self.logger.info(f"Tier migrator started: {self.backup_dir} -> {self.tier_dir}")
+
+    def stop(self):
+        if not self._future or not self._loop:
+            return
+        # Interrupts a copy in progress; its .part file is removed
+        self._cancel.set()
+        if self._stop is not None and not self._loop.is_closed():
+            self._loop.call_soon_threadsafe(self._stop.set)
+        try:
+            self._future.result(timeout=10)
+        except Exception:
+            self._future.cancel()
+        self._future = None
+
+    async def _run(self):
+        self._stop = asyncio.Event()
+        while not self._stop.is_set():
+            try:
+                result = await asyncio.to_thread(self.run_once)
+                if result.moved or result.failed:
+                    self.logger.info(f"Migration pass: {result.moved} moved ({result.bytes / 2**20:.1f} MB), "
+                                     f"{result.failed} failed, {result.held} held, {result.seconds:.1f}s")
+            except Exception as e:
+                self.logger.warning(f"Migration pass failed: {e}")
+            try:
+                await asyncio.wait_for(self._stop.wait(), timeout=self.interval_sec)
+            except asyncio.TimeoutError:
+                pass
@@ -0,0 +1,65 @@
+"""
+Lightweight timing spans
+A span is a perf_counter pair around a block of code. Collector runs and API
+handlers are timed into one process-wide histogram family
+(onec_span_duration_seconds{span="collector.cpu"}); make_backup times its
+phases into a dict that is stored with the backup row, so phase histograms
+also cover one-shot CLI backups and survive restarts.
+"""
+from __future__ import annotations
+
+import copy
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Iterator, List
+
+from .backup_stats import HistogramFamily
+
+SPAN_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+
+@contextmanager
+def timed(record: Dict[str, float], key: str) -> Iterator[None]:
+    """Add the block's wall time to record[key] (seconds)"""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        record[key] = record.get(key, 0.0) + time.perf_counter() - started
+
+
+class Tracer:
+    """Thread-safe span histograms keyed by span name"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._family = HistogramFamily("span_duration_seconds", "span", SPAN_BUCKETS,
+                                       "Duration of instrumented code spans (collectors, API handlers)")
+
+    def observe(self, name: str, seconds: float):
+        with self._lock:
+            self._family.observe(name, seconds)
+
+    @contextmanager
+    def span(self, name: str) -> Iterator[None]:
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - started)
+
+    def histograms(self) -> List[HistogramFamily]:
+        with self._lock:
+            return [copy.deepcopy(self._family)]
+
+    def prometheus_lines(self) -> List[str]:
+        return [line for h in self.histograms() for line in h.prometheus_lines()]
+
+
+_tracer = Tracer()
+
+
+def get_tracer() -> Tracer:
+    """Process-wide tracer"""
+    return _tracer